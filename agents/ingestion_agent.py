@@ -1,74 +1,293 @@
 import tempfile
 import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import PyPDF2
 import docx
 from PIL import Image
 import pytesseract
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from embedding_cache import document_id
+from tracing import new_trace_id, record, span, tracer
+PDF_PAGES_PER_TASK = 8
+SPLIT_BUFFER_CHARS = 20000
+TXT_BLOCK_CHARS = 1 << 20
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']
+def _extract_pdf_pages(file_path, start, end):
+    # Runs in a worker process; each worker opens its own reader over the page range.
+    texts = []
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_number in range(start, end):
+            page_text = pdf_reader.pages[page_number].extract_text()
+            if page_text:
+                texts.append(page_text + "\n")
+    return texts
+def _extract_image(file_path):
+    image = Image.open(file_path)
+    return pytesseract.image_to_string(image)
 class IngestionAgent:
+    def __init__(self, max_workers=None, chunk_size=1000, chunk_overlap=100):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._pool = None
+        self._pool_lock = threading.Lock()
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+    def _make_splitter(self):
+        return RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            separators=["\n\n", "\n", ".", " ", ""]
+        )
     def process_document(self, uploaded_file):
+        try:
+            return list(self.iter_chunks(uploaded_file))
+        except Exception as e:
+            print(f"Error processing {uploaded_file.name}: {str(e)}")
+            raise
+    def iter_chunks(self, uploaded_file):
         with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.name}") as tmp_file:
             tmp_file.write(uploaded_file.read())
-            tmp_file_path = tmp_file.name        
+            tmp_file_path = tmp_file.name
         try:
             file_extension = os.path.splitext(uploaded_file.name)[1].lower()
             if file_extension == '.pdf':
-                text = self._extract_pdf_text(tmp_file_path)
+                blocks = self._iter_pdf_text(tmp_file_path)
             elif file_extension in ['.docx', '.doc']:
-                text = self._extract_docx_text(tmp_file_path)
+                blocks = self._iter_docx_text(tmp_file_path)
             elif file_extension == '.txt':
-                text = self._extract_txt_text(tmp_file_path)
-            elif file_extension in ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']:
-                text = self._extract_image_text(tmp_file_path)
+                blocks = self._iter_txt_text(tmp_file_path)
+            elif file_extension in IMAGE_EXTENSIONS:
+                blocks = self._iter_image_text(tmp_file_path)
             else:
-                raise ValueError(f"Unsupported file type: {file_extension}")            
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=100,
-                separators=["\n\n", "\n", ".", " ", ""]
-            )
-            chunks = splitter.split_text(text)            
-        except Exception as e:
-            chunks = []
+                raise ValueError(f"Unsupported file type: {file_extension}")
+            yield from self._split_stream(blocks)
         finally:
             try:
                 os.unlink(tmp_file_path)
             except Exception as e:
-                pass        
-        return chunks    
+                pass
+    def _split_stream(self, blocks):
+        # Splits as text arrives instead of after the whole file is extracted. The last
+        # chunk of every window is carried into the next one so boundaries still fall
+        # on the splitter's separators rather than on arbitrary buffer edges.
+        splitter = self._make_splitter()
+        parts = []
+        buffered = 0
+        for block in blocks:
+            if not block:
+                continue
+            parts.append(block)
+            buffered += len(block)
+            if buffered < SPLIT_BUFFER_CHARS:
+                continue
+            chunks = splitter.split_text("".join(parts))
+            yield from chunks[:-1]
+            parts = [chunks[-1]] if chunks else []
+            buffered = len(parts[0]) if parts else 0
+        if parts:
+            yield from splitter.split_text("".join(parts))
+    def _iter_pdf_text(self, file_path):
+        with open(file_path, 'rb') as file:
+            num_pages = len(PyPDF2.PdfReader(file).pages)
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, num_pages))
+                  for start in range(0, num_pages, PDF_PAGES_PER_TASK)]
+        if len(ranges) <= 1:
+            for start, end in ranges:
+                yield from _extract_pdf_pages(file_path, start, end)
+            return
+        # Keep a bounded window of page ranges in flight so a 1,000-page PDF never
+        # has more than a few ranges of extracted text resident at once.
+        pool = self._get_pool()
+        window = self.max_workers * 2
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < window:
+                start, end = ranges[next_range]
+                pending.append(pool.submit(_extract_pdf_pages, file_path, start, end))
+                next_range += 1
+            try:
+                texts = pending.pop(0).result()
+            except Exception as e:
+                # A missing page range would index a partial document; fail the file instead.
+                print(f"Error extracting PDF pages: {str(e)}")
+                for future in pending:
+                    future.cancel()
+                raise
+            yield from texts
+    def _iter_docx_text(self, file_path):
+        doc = docx.Document(file_path)
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n"
+    def _iter_txt_text(self, file_path):
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+            while True:
+                block = file.read(TXT_BLOCK_CHARS)
+                if not block:
+                    break
+                yield block
+    def _iter_image_text(self, file_path):
+        yield self._get_pool().submit(_extract_image, file_path).result()
+    def ingest_files(self, uploaded_files, vector_store, file_hashes=None, batch_size=None, max_pending_chunks=1024,
+                     replace_existing=True, trace_id=None, progress=None):
+        # Files are read concurrently (their pages fan out over the shared process pool)
+        # and chunks reach the vector store in bounded batches. The queue bound is the
+        # backpressure: extraction stalls while embedding falls behind. A file's document
+        # id is its name plus its content hash (see document_id), or just the name when
+        # no hash is given; with replace_existing a file whose document is already in
+        # the store replaces it instead of adding to it. progress, if given, is called
+        # as progress(event, doc_id, value) with the events "started", "extracted"
+        # (chunks so far), "indexed" (chunks just written), "done" (total chunks) and
+        # "failed" (the error message).
+        # batch_size defaults to the store's ingest_batch_size: a store with an encoding
+        # engine takes whole windows, so its encoder processes have work to share.
+        stats = {"files": 0, "chunks": 0, "errors": []}
+        if not uploaded_files:
+            return stats
+        if batch_size is None:
+            batch_size = getattr(vector_store, "ingest_batch_size", 64)
+        if trace_id is None and tracer.enabled:
+            trace_id = new_trace_id()
+        file_hashes = file_hashes or [None] * len(uploaded_files)
+        doc_ids = [document_id(f.name, h) for f, h in zip(uploaded_files, file_hashes)]
+        chunk_queue = queue.Queue(maxsize=max_pending_chunks)
+        cancelled = threading.Event()
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    chunk_queue.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+            raise RuntimeError("ingestion cancelled")
+        def produce(uploaded_file, file_hash, doc_id):
+            count = 0
+            start = time.perf_counter()
+            try:
+                if progress is not None:
+                    progress("started", doc_id, None)
+                for chunk in self.iter_chunks(uploaded_file):
+                    put(("chunk", (doc_id, chunk)))
+                    count += 1
+                    if progress is not None:
+                        progress("extracted", doc_id, count)
+                # Extraction and splitting, including time blocked on a full queue.
+                record("ingest.file", time.perf_counter() - start, trace_id, file=uploaded_file.name, chunks=count)
+                put(("file", (file_hash, uploaded_file.name, doc_id, count)))
+            except Exception as e:
+                if cancelled.is_set():
+                    return
+                print(f"Error processing {uploaded_file.name}: {str(e)}")
+                put(("error", (doc_id, uploaded_file.name, str(e))))
+        def produce_all(producers):
+            futures = [producers.submit(produce, f, h, d) for f, h, d in zip(uploaded_files, file_hashes, doc_ids)]
+            for future in futures:
+                future.exception()
+            if not cancelled.is_set():
+                put(("done", None))
+        with span("ingest.files", trace_id=trace_id, files=len(uploaded_files)) as files_span, \
+                ThreadPoolExecutor(max_workers=min(len(uploaded_files), self.max_workers)) as producers:
+            threading.Thread(target=produce_all, args=(producers,), daemon=True).start()
+            try:
+                self._consume(chunk_queue, vector_store, batch_size, stats, replace_existing, progress)
+            finally:
+                # Unblocks producers waiting on a full queue if the store raised.
+                cancelled.set()
+            files_span.set(chunks=stats["chunks"])
+        return stats
+    def _flush(self, vector_store, batch, progress=None):
+        with span("ingest.flush", chunks=len(batch)):
+            vector_store.add_documents([chunk for _, chunk in batch], doc_id=[doc_id for doc_id, _ in batch])
+        if progress is not None:
+            for doc_id, count in Counter(doc_id for doc_id, _ in batch).items():
+                progress("indexed", doc_id, count)
+    def _consume(self, chunk_queue, vector_store, batch_size, stats, replace_existing=True, progress=None):
+        batch = []
+        started = set()
+        # New chunks of a document already in the store are held back and swapped in with
+        # one upsert_document when the file is complete: readers see the old version
+        # until then, and keep it if extraction fails. New documents stream in batches.
+        replacing = {}
+        can_replace = replace_existing and hasattr(vector_store, 'upsert_document')
+        while True:
+            kind, value = chunk_queue.get()
+            if kind == "chunk":
+                doc_id = value[0]
+                if doc_id not in started:
+                    started.add(doc_id)
+                    if can_replace and vector_store.has_document(doc_id):
+                        replacing[doc_id] = []
+                stats["chunks"] += 1
+                if doc_id in replacing:
+                    replacing[doc_id].append(value[1])
+                    continue
+                batch.append(value)
+                if len(batch) >= batch_size:
+                    self._flush(vector_store, batch, progress)
+                    batch = []
+                continue
+            # A file's chunks are always queued before its "file" marker, so once the
+            # batch is flushed the whole file is in the store and can be recorded.
+            if batch:
+                self._flush(vector_store, batch, progress)
+                batch = []
+            if kind == "file":
+                stats["files"] += 1
+                file_hash, name, doc_id, count = value
+                if doc_id in replacing:
+                    chunks = replacing.pop(doc_id)
+                    with span("ingest.flush", chunks=len(chunks)):
+                        vector_store.upsert_document(doc_id, chunks)
+                    if progress is not None:
+                        progress("indexed", doc_id, len(chunks))
+                if file_hash:
+                    vector_store.mark_file(file_hash, name, count, doc_id=doc_id)
+                if progress is not None:
+                    progress("done", doc_id, count)
+            elif kind == "error":
+                doc_id, name, error = value
+                # A document being replaced keeps its old version; a new one would keep
+                # the chunks streamed before the failure, so they are removed.
+                if replacing.pop(doc_id, None) is None and doc_id in started and \
+                        hasattr(vector_store, 'delete_document'):
+                    vector_store.delete_document(doc_id)
+                stats["errors"].append({"file": name, "doc_id": doc_id, "error": error})
+                if progress is not None:
+                    progress("failed", doc_id, error)
+            else:
+                break
     def _extract_pdf_text(self, file_path):
         try:
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-            return text
+            return "".join(self._iter_pdf_text(file_path))
         except Exception as e:
-            return ""    
+            return ""
     def _extract_docx_text(self, file_path):
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return "".join(self._iter_docx_text(file_path))
         except Exception as e:
-            return ""    
+            return ""
     def _extract_txt_text(self, file_path):
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-                text = file.read()
-            return text
+            return "".join(self._iter_txt_text(file_path))
         except Exception as e:
-            return ""    
+            return ""
     def _extract_image_text(self, file_path):
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
-            return text
+            return "".join(self._iter_image_text(file_path))
         except Exception as e:
             print(f"Error extracting image text: {str(e)}")
-            return ""
\ No newline at end of file
+            return ""
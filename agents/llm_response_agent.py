@@ -1,53 +1,121 @@
 # llm_response_agent_openai.py
-import openai
 from mcp import MCPMessage
+from llm_backends import get_backend
+from tracing import record, span
+import time
 class LLMResponseAgent:
-    def __init__(self):
-        self.model_name = "gpt-3.5-turbo"
-        openai.api_key = ""
-        print("OpenAI LLMResponseAgent initialized successfully")
-    def generate_response(self, mcp_msg):
-        try:
-            retrieved_context = mcp_msg["payload"]["retrieved_context"]
-            context = "\n\n".join(retrieved_context)
-            query = mcp_msg["payload"]["query"]
-            prompt = f"""You are a helpful assistant. Answer the user's question based on the context below.
+    def __init__(self, backend="openai", model_name="gpt-3.5-turbo", base_url=None, api_key=None, temperature=0.7, max_tokens=500, answer_cache=None):
+        self.model_name = model_name
+        # Optional SemanticAnswerCache shared with RetrievalAgent; finished answers are
+        # stored for the traces whose lookup missed.
+        self.answer_cache = answer_cache
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        if backend == "openai":
+            self.backend = get_backend(backend, model_name=model_name, base_url=base_url, api_key=api_key)
+        else:
+            self.backend = get_backend(backend)
+        print(f"LLMResponseAgent initialized with {self.backend.name} backend")
+    def _build_messages(self, mcp_msg):
+        retrieved_context = mcp_msg["payload"]["retrieved_context"]
+        context = "\n\n".join(retrieved_context)
+        query = mcp_msg["payload"]["query"]
+        prompt = f"""You are a helpful assistant. Answer the user's question based on the context below.
             Context:
             {context}
             Question:
             {query}
             Answer:"""
-            print("Sending prompt to OpenAI API")
-            response = openai.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful AI assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
-            answer = response.choices[0].message.content.strip()
-            print("Response received from OpenAI API")
-            return MCPMessage(
-                sender="LLMResponseAgent",
-                receiver="UI",
-                msg_type="FINAL_RESPONSE",
-                payload={
-                    "answer": answer,
-                    "source_context": context
-                },
-                trace_id=mcp_msg.get("trace_id")
-            )
+        messages = [
+            {"role": "system", "content": "You are a helpful AI assistant."},
+            {"role": "user", "content": prompt}
+        ]
+        return messages, context, retrieved_context
+    def _final_message(self, answer, context, retrieved_context, trace_id):
+        payload = {
+            "answer": answer,
+            "source_context": context,
+            "retrieved_context": retrieved_context,
+            "done": True
+        }
+        if self.answer_cache is not None and trace_id:
+            self.answer_cache.complete(trace_id, dict(payload))
+        return MCPMessage(
+            sender="LLMResponseAgent",
+            receiver="UI",
+            msg_type="FINAL_RESPONSE",
+            payload=payload,
+            trace_id=trace_id
+        )
+    def _partial_message(self, delta, index, trace_id):
+        return MCPMessage(
+            sender="LLMResponseAgent",
+            receiver="UI",
+            msg_type="FINAL_RESPONSE",
+            payload={"delta": delta, "index": index, "done": False},
+            trace_id=trace_id
+        )
+    def _error_message(self, e, trace_id):
+        print(f"Response generation error: {str(e)}")
+        if self.answer_cache is not None and trace_id:
+            self.answer_cache.discard(trace_id)
+        return MCPMessage(
+            sender="LLMResponseAgent",
+            receiver="UI",
+            msg_type="ERROR",
+            payload={
+                "answer": f"Error generating response: {str(e)}",
+                "source_context": "",
+                "done": True
+            },
+            trace_id=trace_id
+        )
+    def generate_response(self, mcp_msg):
+        try:
+            with span("llm.build_prompt", trace_id=mcp_msg.get("trace_id")):
+                messages, context, retrieved_context = self._build_messages(mcp_msg)
+            with span("llm.complete", trace_id=mcp_msg.get("trace_id"), backend=self.backend.name):
+                answer = self.backend.complete(messages, temperature=self.temperature, max_tokens=self.max_tokens).strip()
+            return self._final_message(answer, context, retrieved_context, mcp_msg.get("trace_id"))
+        except Exception as e:
+            return self._error_message(e, mcp_msg.get("trace_id"))
+    def stream_response(self, mcp_msg):
+        # Yields a partial FINAL_RESPONSE (done=False) per text delta, then one final
+        # FINAL_RESPONSE carrying the full answer (done=True), or an ERROR.
+        # Timings are recorded explicitly: the router may resume this generator on a
+        # different thread for every delta.
+        trace_id = mcp_msg.get("trace_id")
+        answer = []
+        start = time.perf_counter()
+        try:
+            messages, context, retrieved_context = self._build_messages(mcp_msg)
+            record("llm.build_prompt", time.perf_counter() - start, trace_id)
+            for delta in self.backend.stream(messages, temperature=self.temperature, max_tokens=self.max_tokens):
+                if not answer:
+                    record("llm.first_token", time.perf_counter() - start, trace_id, backend=self.backend.name)
+                yield self._partial_message(delta, len(answer), trace_id)
+                answer.append(delta)
+            final = self._final_message("".join(answer).strip(), context, retrieved_context, trace_id)
+            record("llm.stream", time.perf_counter() - start, trace_id, backend=self.backend.name, deltas=len(answer))
+        except Exception as e:
+            final = self._error_message(e, trace_id)
+            record("llm.stream", time.perf_counter() - start, trace_id, backend=self.backend.name, error=type(e).__name__)
+        yield final
+    async def astream_response(self, mcp_msg):
+        trace_id = mcp_msg.get("trace_id")
+        answer = []
+        start = time.perf_counter()
+        try:
+            messages, context, retrieved_context = self._build_messages(mcp_msg)
+            record("llm.build_prompt", time.perf_counter() - start, trace_id)
+            async for delta in self.backend.astream(messages, temperature=self.temperature, max_tokens=self.max_tokens):
+                if not answer:
+                    record("llm.first_token", time.perf_counter() - start, trace_id, backend=self.backend.name)
+                yield self._partial_message(delta, len(answer), trace_id)
+                answer.append(delta)
+            final = self._final_message("".join(answer).strip(), context, retrieved_context, trace_id)
+            record("llm.stream", time.perf_counter() - start, trace_id, backend=self.backend.name, deltas=len(answer))
         except Exception as e:
-            print(f"Response generation error: {str(e)}")
-            return MCPMessage(
-                sender="LLMResponseAgent",
-                receiver="UI",
-                msg_type="ERROR",
-                payload={
-                    "answer": f"Error generating response: {str(e)}",
-                    "source_context": ""
-                },
-                trace_id=mcp_msg.get("trace_id")
-            )
+            final = self._error_message(e, trace_id)
+            record("llm.stream", time.perf_counter() - start, trace_id, backend=self.backend.name, error=type(e).__name__)
+        yield final
@@ -1,13 +1,26 @@
 # retrieval_agent.py
 from mcp import MCPMessage
+from answer_cache import context_fingerprint
+from tracing import span
 class RetrievalAgent:
-    def __init__(self, vector_store):
-        self.vector_store = vector_store    
+    def __init__(self, vector_store, answer_cache=None, context_packer=None):
+        self.vector_store = vector_store
+        self.answer_cache = answer_cache
+        # Optional ContextPacker: fetches context_packer.fetch_k candidates and forwards
+        # the packed passages instead of the raw top-k chunks.
+        self.context_packer = context_packer    
     def handle_query(self, mcp_msg):
+        # One span per query; the VectorStore spans it triggers join the same trace.
+        trace_id = mcp_msg.get("trace_id") if isinstance(mcp_msg, dict) else None
+        with span("retrieval.handle_query", trace_id=trace_id):
+            return self._handle_query(mcp_msg)
+    def _handle_query(self, mcp_msg):
         query = ""  
         try:
             if not isinstance(mcp_msg, dict):
                 raise ValueError("mcp_msg must be a dictionary")            
+            if mcp_msg.get("type") == "BATCH_QUERY":
+                return self.handle_batch_query(mcp_msg)
             if "payload" not in mcp_msg:
                 raise ValueError("mcp_msg must contain 'payload' key")            
             if "query" not in mcp_msg["payload"]:
@@ -15,8 +28,57 @@ class RetrievalAgent:
             query = mcp_msg["payload"]["query"]
             if not query or not isinstance(query, str) or not query.strip():
                 raise ValueError("Query must be a non-empty string")            
-            chunks = self.vector_store.retrieve(query.strip())            
-            if chunks and isinstance(chunks[0], dict):
+            # Optional per-query override of the store's retrieval mode (dense/hybrid/lexical).
+            mode = mcp_msg["payload"].get("mode")
+            scope = self._collection_scope(mcp_msg["payload"])
+            packer = self.context_packer
+            context_stats = None
+            if (self.answer_cache is not None or packer is not None) and \
+                    hasattr(self.vector_store, 'retrieve_with_embedding'):
+                # Read before searching: if the store changes meanwhile, the answer is
+                # stored under a stale generation and never served.
+                generation = getattr(self.vector_store, 'generation', 0)
+                if packer is not None:
+                    chunks, query_emb = self.vector_store.retrieve_with_embedding(
+                        query.strip(), top_k=packer.fetch_k, mode=mode, with_embeddings=True, **scope)
+                    with span("retrieval.pack_context") as pack_span:
+                        chunks, context_stats = packer.pack(query_emb, chunks)
+                        pack_span.set(candidates=context_stats["candidates"],
+                                      tokens=context_stats["tokens_packed"])
+                else:
+                    chunks, query_emb = self.vector_store.retrieve_with_embedding(query.strip(), mode=mode, **scope)
+                if self.answer_cache is not None and chunks and query_emb is not None:
+                    # Packed passages are fingerprinted by every chunk they contain.
+                    chunk_ids = [i for chunk in chunks for i in chunk['chunk_ids']] if packer is not None else \
+                        [chunk.get('chunk_id', chunk['index']) for chunk in chunks]
+                    fingerprint = context_fingerprint(chunk_ids)
+                    if scope:
+                        # Chunk ids are only unique within a collection.
+                        fingerprint = f"{scope['collection']}:{fingerprint}"
+                    with span("retrieval.answer_cache") as cache_span:
+                        cached = self.answer_cache.lookup(
+                            query_emb,
+                            fingerprint,
+                            generation,
+                            trace_id=mcp_msg.get("trace_id")
+                        )
+                        cache_span.set(hit=cached is not None)
+                    if cached is not None:
+                        return MCPMessage(
+                            sender="RetrievalAgent",
+                            receiver="UI",
+                            msg_type="FINAL_RESPONSE",
+                            payload=dict(cached, query=query, cached=True, done=True),
+                            trace_id=mcp_msg.get("trace_id")
+                        )
+            elif mode or scope:
+                chunks = self.vector_store.retrieve(query.strip(), mode=mode, **scope)
+            else:
+                chunks = self.vector_store.retrieve(query.strip())            
+            if context_stats is not None:
+                retrieved_context = [chunk['text'] for chunk in chunks]
+                distances = None
+            elif chunks and isinstance(chunks[0], dict):
                 retrieved_context = [chunk['text'] for chunk in chunks]
                 distances = [chunk['distance'] for chunk in chunks]
             else:
@@ -27,8 +89,12 @@ class RetrievalAgent:
                 "query": query,
                 "num_results": len(retrieved_context)
             }
+            if scope:
+                payload["collection"] = scope["collection"]
             if distances:
                 payload["distances"] = distances            
+            if context_stats is not None:
+                payload["context_stats"] = context_stats
             return MCPMessage(
                 sender="RetrievalAgent",
                 receiver="LLMResponseAgent",
@@ -51,6 +117,69 @@ class RetrievalAgent:
                 payload=error_payload,
                 trace_id=mcp_msg.get("trace_id")
             )    
+    def handle_batch_query(self, mcp_msg):
+        queries = []
+        try:
+            if not isinstance(mcp_msg, dict):
+                raise ValueError("mcp_msg must be a dictionary")            
+            if "payload" not in mcp_msg:
+                raise ValueError("mcp_msg must contain 'payload' key")            
+            if "queries" not in mcp_msg["payload"]:
+                raise ValueError("payload must contain 'queries' key")            
+            queries = mcp_msg["payload"]["queries"]
+            if not isinstance(queries, list) or not queries:
+                raise ValueError("queries must be a non-empty list")
+            for query in queries:
+                if not query or not isinstance(query, str) or not query.strip():
+                    raise ValueError("Each query must be a non-empty string")
+            top_k = mcp_msg["payload"].get("top_k", 3)
+            # Same optional mode override as a single query.
+            mode = mcp_msg["payload"].get("mode")
+            scope = self._collection_scope(mcp_msg["payload"])
+            batch_chunks = self.vector_store.retrieve_batch([q.strip() for q in queries], top_k=top_k, mode=mode,
+                                                            **scope)
+            results = []
+            for query, chunks in zip(queries, batch_chunks):
+                results.append({
+                    "query": query,
+                    "retrieved_context": [chunk['text'] for chunk in chunks],
+                    "distances": [chunk['distance'] for chunk in chunks],
+                    "num_results": len(chunks)
+                })
+            return MCPMessage(
+                sender="RetrievalAgent",
+                receiver=mcp_msg.get("sender") or "LLMResponseAgent",
+                msg_type="BATCH_RETRIEVAL_RESULT",
+                payload={
+                    "results": results,
+                    "num_queries": len(queries)
+                },
+                trace_id=mcp_msg.get("trace_id")
+            )
+        except Exception as e:
+            print(f"Batch retrieval error: {str(e)}")
+            return MCPMessage(
+                sender="RetrievalAgent",
+                receiver=(mcp_msg.get("sender") if isinstance(mcp_msg, dict) else None) or "LLMResponseAgent",
+                msg_type="ERROR",
+                payload={
+                    "results": [],
+                    "queries": queries,
+                    "error": str(e),
+                    "error_type": type(e).__name__
+                },
+                trace_id=mcp_msg.get("trace_id") if isinstance(mcp_msg, dict) else None
+            )    
+    def _collection_scope(self, payload):
+        # payload["collection"] picks a named collection of a ShardedVectorStore.
+        collection = payload.get("collection")
+        if not collection:
+            return {}
+        if not isinstance(collection, str):
+            raise ValueError("collection must be a string")
+        if not hasattr(self.vector_store, 'collections'):
+            raise ValueError("This vector store has no named collections")
+        return {"collection": collection}
     def validate_vector_store(self):
         try:
             if not hasattr(self.vector_store, 'retrieve'):
@@ -0,0 +1,141 @@
+# answer_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 1000
+# Lookups that missed wait here (by trace_id) for the LLM's answer.
+MAX_PENDING = 1024
+
+
+def context_fingerprint(chunk_ids):
+    # Order matters: the same chunks in a different order make a different prompt.
+    return hashlib.sha256(",".join(str(int(i)) for i in chunk_ids).encode("ascii")).hexdigest()
+
+
+def _normalize(embedding):
+    embedding = np.asarray(embedding, dtype="float32").reshape(-1)
+    norm = float(np.linalg.norm(embedding))
+    return embedding / norm if norm else embedding
+
+
+class SemanticAnswerCache:
+    # In-memory answers keyed on (store generation, retrieved-context fingerprint); a
+    # lookup hits when the stored query embedding is within `threshold` cosine
+    # similarity of the new one. Any change to the store bumps its generation, which
+    # drops every entry at the next lookup.
+    def __init__(self, threshold=DEFAULT_THRESHOLD, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation = None
+        self._entries = OrderedDict()
+        self._by_context = {}
+        self._pending = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _sync_generation(self, generation):
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_context.clear()
+            self._pending.clear()
+            self.generation = generation
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        keys = self._by_context.get(entry["fingerprint"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[entry["fingerprint"]]
+
+    def lookup(self, query_embedding, fingerprint, generation, trace_id=None):
+        # Returns the cached answer payload, or None; on a miss with a trace_id the
+        # lookup is remembered so complete(trace_id, ...) can store the answer.
+        query = _normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            self._sync_generation(generation)
+            best_key, best_score = None, self.threshold
+            for key in list(self._by_context.get(fingerprint, ())):
+                entry = self._entries[key]
+                if now - entry["created"] > self.ttl:
+                    self._remove(key)
+                    self.expirations += 1
+                    continue
+                score = float(np.dot(entry["embedding"], query))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return dict(self._entries[best_key]["payload"], cache_similarity=best_score)
+            self.misses += 1
+            if trace_id:
+                self._pending[trace_id] = (query, fingerprint, generation)
+                while len(self._pending) > MAX_PENDING:
+                    self._pending.popitem(last=False)
+            return None
+
+    def store(self, query_embedding, fingerprint, generation, payload):
+        with self._lock:
+            self._store(_normalize(query_embedding), fingerprint, generation, payload)
+
+    def _store(self, query, fingerprint, generation, payload):
+        if generation != self.generation:
+            # The store changed while the answer was being generated.
+            return
+        key = self._next_key
+        self._next_key += 1
+        self._entries[key] = {"embedding": query, "fingerprint": fingerprint,
+                              "payload": payload, "created": time.time()}
+        self._by_context.setdefault(fingerprint, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def complete(self, trace_id, payload):
+        with self._lock:
+            pending = self._pending.pop(trace_id, None)
+            if pending is not None:
+                query, fingerprint, generation = pending
+                self._store(query, fingerprint, generation, payload)
+
+    def discard(self, trace_id):
+        with self._lock:
+            self._pending.pop(trace_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_context.clear()
+            self._pending.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+        }
@@ -4,21 +4,104 @@ from agents.ingestion_agent import IngestionAgent
 from agents.retrieval_agent import RetrievalAgent
 from agents.llm_response_agent import LLMResponseAgent  # Import your separate agent
 from mcp import MCPMessage
+from mcp_router import MCPRouter
 from vector_store import VectorStore
+from sharded_store import ShardedVectorStore
+from embedding_cache import content_hash
+from answer_cache import SemanticAnswerCache
+from ingestion_jobs import IngestionJobQueue
+from context_packing import ContextPacker
+from embeddings import get_backend
+from encoding_engine import EncodingEngine
+from tracing import serve_metrics, tracer
 import atexit
+import os
 @st.cache_resource
 def initialize_agents():
     try:
-        vector_store = VectorStore()
+        # Hybrid: BM25 hits fused with dense results, so exact identifiers still match.
+        # RAG_SHARDS > 1 splits every collection over that many shards (in worker
+        # processes with RAG_SHARD_PROCESSES=1) and enables named collections.
+        num_shards = int(os.environ.get("RAG_SHARDS", "1"))
+        # RAG_ENCODE_WORKERS > 1 encodes large uploads in that many encoder processes;
+        # RAG_ENCODE_MAX_CHUNKS_PER_S caps their rate to leave CPU for queries.
+        backend = get_backend("torch")
+        encode_workers = int(os.environ.get("RAG_ENCODE_WORKERS", "0"))
+        max_chunks_per_s = float(os.environ.get("RAG_ENCODE_MAX_CHUNKS_PER_S", "0")) or None
+        encoding_engine = EncodingEngine(backend, workers=encode_workers, max_chunks_per_s=max_chunks_per_s) \
+            if encode_workers > 1 else None
+        if num_shards > 1:
+            vector_store = ShardedVectorStore(num_shards=num_shards, retrieval_mode="hybrid",
+                                              processes=os.environ.get("RAG_SHARD_PROCESSES", "0") == "1",
+                                              embedding_backend=backend, encoding_engine=encoding_engine)
+        else:
+            vector_store = VectorStore(retrieval_mode="hybrid", embedding_backend=backend,
+                                       encoding_engine=encoding_engine)
+        # Load the embedding model in the background so the page renders first.
+        vector_store.model.load_async()
         ingestion_agent = IngestionAgent()
-        retrieval_agent = RetrievalAgent(vector_store)
+        # Wider fetch, MMR and overlap stitching, packed into RAG_CONTEXT_TOKENS of prompt.
+        context_packer = ContextPacker(token_budget=int(os.environ.get("RAG_CONTEXT_TOKENS", "700")))
+        retrieval_agent = RetrievalAgent(vector_store, answer_cache=SemanticAnswerCache(),
+                                         context_packer=context_packer)
         return vector_store, ingestion_agent, retrieval_agent
     except Exception as e:
         st.error(f"Error initializing agents: {str(e)}")
         st.stop()
 @st.cache_resource
 def get_llm_agent():
-    return LLMResponseAgent()
+    # LLM_BASE_URL points the OpenAI client at a local OpenAI-compatible server;
+    # LLM_BACKEND=fake answers offline without any model.
+    return LLMResponseAgent(
+        backend=os.environ.get("LLM_BACKEND", "openai"),
+        model_name=os.environ.get("LLM_MODEL", "gpt-3.5-turbo"),
+        base_url=os.environ.get("LLM_BASE_URL")
+    )
+@st.cache_resource
+def get_router(_retrieval_agent, _llm_agent):
+    # Shared by every session: queries from different users overlap retrieval with
+    # generation instead of each blocking on its own chain of calls.
+    # Answers are stored by the LLM agent and served by the retrieval agent on a hit.
+    _llm_agent.answer_cache = _retrieval_agent.answer_cache
+    router = MCPRouter()
+    router.register("RetrievalAgent", _retrieval_agent.handle_query, concurrency=8, timeout=30.0)
+    router.register("LLMResponseAgent", _llm_agent.stream_response, concurrency=4, timeout=120.0)
+    return router.start_background()
+@st.cache_resource
+def get_metrics_server():
+    # RAG_TRACING=1 records per-stage spans; Prometheus scrapes /metrics, and
+    # /metrics.json and /traces/<trace_id> serve the same data as JSON.
+    if not tracer.enabled:
+        return None
+    return serve_metrics(port=int(os.environ.get("RAG_METRICS_PORT", "9464")))
+@st.cache_resource
+def get_ingestion_jobs(_ingestion_agent, _vector_store, collection=None):
+    # Shared by every session, so the same file uploaded twice is ingested once; one
+    # queue per collection, each writing to that collection.
+    return IngestionJobQueue(_ingestion_agent, _vector_store)
+def render_ingestion_job(job):
+    files = job["files"]
+    if job["status"] not in ("done", "failed"):
+        st.progress(job["progress"], text=f"⏳ Processing documents: {job['files_finished']}/{len(files)} file(s), "
+                                          f"{job['chunks_indexed']} chunk(s) indexed")
+        for f in files:
+            if f["status"] == "extracting":
+                st.caption(f"{f['name']}: {f['chunks_extracted']} chunks extracted, {f['chunks_indexed']} indexed")
+        return
+    done = [f for f in files if f["status"] == "done"]
+    if done:
+        st.success(f"✅ {len(done)} document(s) processed successfully! Created {sum(f['chunks_extracted'] for f in done)} text chunks.")
+    for f in files:
+        if f["status"] == "failed":
+            st.error(f"Error processing {f['name']}: {f['error']}")
+@st.fragment(run_every=1.0)
+def poll_ingestion_jobs(jobs, job_ids):
+    # Only this block reruns while jobs are in flight; once they have all finished,
+    # one full rerun refreshes the rest of the page (document counts, sidebar).
+    if not jobs.has_active(job_ids):
+        st.rerun()
+    for job in jobs.jobs(job_ids):
+        render_ingestion_job(job)
 def cleanup_vector_store():
     if 'vector_store' in st.session_state:
         st.session_state.vector_store.clear()
@@ -32,6 +115,14 @@ try:
     else:
         st.success("✅ Model loaded successfully!")
     vector_store, ingestion_agent, retrieval_agent = initialize_agents()
+    router = get_router(retrieval_agent, llm_agent)
+    collection = None
+    target_store = vector_store
+    if isinstance(vector_store, ShardedVectorStore):
+        collection = st.sidebar.text_input("🗂 Collection", value=vector_store.default_collection).strip() or None
+        target_store = vector_store.collection(collection, create=True)
+    ingestion_jobs = get_ingestion_jobs(ingestion_agent, target_store, collection)
+    get_metrics_server()
     atexit.register(cleanup_vector_store)    
     st.header("📄 Document Upload")
     uploaded_files = st.file_uploader(
@@ -40,21 +131,44 @@ try:
         accept_multiple_files=True,
         help="Upload documents to create a knowledge base for Q&A"
     )        
+    job_ids = st.session_state.setdefault("ingestion_job_ids", [])
     if uploaded_files:
         try:
-            with st.spinner("Processing documents..."):
-                total_chunks = 0
-                for file in uploaded_files:
-                    chunks = ingestion_agent.process_document(file)
-                    vector_store.add_documents(chunks)
-                    total_chunks += len(chunks)
-                print("Document ingestion completed")            
-            st.success(f"✅ {len(uploaded_files)} document(s) processed successfully! Created {total_chunks} text chunks.")
-            if hasattr(vector_store, 'get_stats'):
-                stats = vector_store.get_stats()
-                st.sidebar.success(f"📊 Vector Store: {stats['total_documents']} documents indexed")
+            # Streamlit reruns the script on every interaction; each upload (file_id, new
+            # every time a file is uploaded) is submitted once, and the queue skips files
+            # already indexed or in flight. A file that failed goes in again when it is
+            # uploaded again, and the job it failed in is no longer shown.
+            submitted = st.session_state.setdefault("submitted_uploads", set())
+            new_files, new_hashes = [], []
+            for file in uploaded_files:
+                if (collection, file.file_id) not in submitted:
+                    submitted.add((collection, file.file_id))
+                    new_files.append(file)
+                    new_hashes.append(content_hash(file.getvalue()))
+            if new_files:
+                retried = {job["id"] for job in ingestion_jobs.jobs(job_ids)
+                           if any(f["status"] == "failed" and f["file_hash"] in new_hashes for f in job["files"])}
+                job_ids[:] = [job_id for job_id in job_ids if job_id not in retried]
+                for job_id in ingestion_jobs.submit(new_files, new_hashes):
+                    if job_id not in job_ids:
+                        job_ids.append(job_id)
         except Exception as e:
             st.error(f"Error processing documents: {str(e)}")    
+    if job_ids:
+        if ingestion_jobs.has_active(job_ids):
+            poll_ingestion_jobs(ingestion_jobs, job_ids)
+        else:
+            for job in ingestion_jobs.jobs(job_ids):
+                render_ingestion_job(job)
+    if uploaded_files and hasattr(target_store, 'get_stats'):
+        stats = target_store.get_stats()
+        st.sidebar.success(f"📊 Vector Store: {stats['total_documents']} documents indexed")
+        encoding = stats.get('encoding')
+        if encoding and encoding['chunks_per_s']:
+            st.sidebar.info(f"🧮 Encoding: {encoding['chunks_per_s']:.0f} chunks/s over {encoding['workers']} worker(s)")
+    if retrieval_agent.answer_cache is not None:
+        cache_stats = retrieval_agent.answer_cache.get_stats()
+        st.sidebar.info(f"⚡ Answer cache: {cache_stats['hits']} hits, {cache_stats['hit_rate']:.0%} hit rate")
     st.header("💬 Chat with your documents")
     query = st.text_input("Ask a question about your documents:", placeholder="e.g., What is the main topic of the document?")
     col1, col2 = st.columns([1, 4])
@@ -64,29 +178,48 @@ try:
         if st.button("Clear Chat"):
             st.rerun()   
     if submit_button and query:
-        if vector_store.get_stats()['total_documents'] == 0:
+        if target_store.get_stats()['total_documents'] == 0:
             st.warning("⚠️ Please upload some documents first!")
         else:
             try:
-                with st.spinner("🔍 Searching documents and generating response..."):
-                    mcp_query = MCPMessage(
-                        sender="UI",
-                        receiver="RetrievalAgent",
-                        msg_type="QUERY",
-                        payload={"query": query}
-                    ).to_dict()
-                    mcp_retrieval = retrieval_agent.handle_query(mcp_query).to_dict()
-                    mcp_response = llm_agent.generate_response(mcp_retrieval).to_dict()
+                mcp_query = MCPMessage(
+                    sender="UI",
+                    receiver="RetrievalAgent",
+                    msg_type="QUERY",
+                    payload={"query": query, "collection": collection} if collection else {"query": query}
+                )
                 st.subheader("🔍 Answer")
-                if mcp_response["type"] == "ERROR":
-                    st.error(f"Error: {mcp_response['payload']['answer']}")
+                answer_placeholder = st.empty()
+                partial_answer = ""
+                mcp_response = None
+                with st.spinner("🔍 Searching documents and generating response..."):
+                    # Partial FINAL_RESPONSE messages (done=False) carry one text delta each.
+                    for reply in router.stream_sync(mcp_query):
+                        if reply["type"] != "ERROR" and not reply["payload"].get("done", True):
+                            partial_answer += reply["payload"]["delta"]
+                            answer_placeholder.markdown(partial_answer + "▌")
+                        else:
+                            mcp_response = reply
+                if mcp_response is None:
+                    answer_placeholder.empty()
+                    st.error("Error: no response received")
+                elif mcp_response["type"] == "ERROR":
+                    answer_placeholder.empty()
+                    error = mcp_response["payload"].get("answer") or mcp_response["payload"].get("error")
+                    st.error(f"Error: {error}")
                 else:
-                    st.write(mcp_response["payload"]["answer"])                    
+                    answer_placeholder.markdown(mcp_response["payload"]["answer"])
+                    if mcp_response["payload"].get("cached"):
+                        st.caption("⚡ Answered from cache")                    
+                    if tracer.enabled and mcp_response.get("trace_id"):
+                        with st.expander("⏱ Stage timings"):
+                            for stage in tracer.trace(mcp_response["trace_id"]):
+                                st.write(f"{stage['stage']}: {stage['duration_ms']:.1f} ms")
                     if mcp_response["payload"].get("source_context"):
                         with st.expander("📚 Source Context"):
                             st.text(mcp_response["payload"]["source_context"])                    
-                    if mcp_retrieval.get("payload", {}).get("retrieved_context"):
-                        retrieved_docs = mcp_retrieval["payload"]["retrieved_context"]
+                    if mcp_response["payload"].get("retrieved_context"):
+                        retrieved_docs = mcp_response["payload"]["retrieved_context"]
                         with st.expander(f"📖 Retrieved Documents ({len(retrieved_docs)} found)"):
                             for i, doc in enumerate(retrieved_docs):
                                 st.write(f"**Document {i+1}:**")
@@ -0,0 +1,174 @@
+# benchmarks/concurrency.py
+# Usage: python -m benchmarks.concurrency [--initial 20000] [--readers 4] [--seconds 10] [--batch 256]
+# Query throughput and latency of concurrent readers, first against an idle store and
+# then while a background writer (VectorStore.submit) ingests as fast as it can, with
+# compaction and index promotion happening underneath. Every result is checked
+# against the corpus, so a torn read (a label resolved against the wrong snapshot)
+# shows up as a mismatch.
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.pipeline import latency_stats, synthetic_corpus, synthetic_queries
+from embeddings import HashingBackend
+from vector_store import VectorStore
+
+
+class Readers:
+    def __init__(self, store, corpus, queries, count, top_k, mode):
+        self.store = store
+        self.corpus = corpus
+        self.queries = queries
+        self.count = count
+        self.top_k = top_k
+        self.mode = mode
+        self.latencies = []
+        self.checked = 0
+        self.mismatches = 0
+        self.empty = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def _run(self, seed, stop):
+        rng = np.random.default_rng(seed)
+        latencies, checked, mismatches, empty = [], 0, 0, 0
+        while not stop.is_set():
+            query = self.queries[int(rng.integers(len(self.queries)))]
+            start = time.perf_counter()
+            try:
+                results = self.store.retrieve(query, top_k=self.top_k, mode=self.mode)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(repr(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+            empty += not results
+            for result in results:
+                # Chunk ids are assigned in submission order, so id n is corpus[n].
+                checked += 1
+                mismatches += result['text'] != self.corpus[result['chunk_id']]
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.checked += checked
+            self.mismatches += mismatches
+            self.empty += empty
+
+    def run(self, seconds, during=None):
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._run, args=(i, stop)) for i in range(self.count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            if during is not None:
+                during(stop)
+            else:
+                time.sleep(seconds)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        return dict(latency_stats(self.latencies), qps=len(self.latencies) / elapsed, seconds=elapsed,
+                    results_checked=self.checked, mismatches=self.mismatches, empty_results=self.empty,
+                    errors=self.errors[:5])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query throughput during background ingestion")
+    parser.add_argument("--initial", type=int, default=20000, help="chunks indexed before the readers start")
+    parser.add_argument("--stream", type=int, default=50000, help="chunks available to the background writer")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--batch", type=int, default=256, help="chunks per background write")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--mode", default="dense")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--index-type", default="ivf_flat")
+    parser.add_argument("--vector-codec", default="fp32")
+    parser.add_argument("--promote-threshold", type=int, default=20000)
+    parser.add_argument("--compact-ratio", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag-concurrency-")
+    try:
+        # Store chatter goes to stderr so stdout stays valid JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+def run(args, workdir):
+    corpus = synthetic_corpus(args.initial + args.stream, seed=args.seed)
+    queries = synthetic_queries(corpus[:args.initial], 1000, seed=args.seed + 1)
+    store = VectorStore(persist_path=os.path.join(workdir, "vector_store"),
+                        cache_path=os.path.join(workdir, "embedding_cache"),
+                        embedding_backend=HashingBackend(dimension=args.dim),
+                        index_type=args.index_type, vector_codec=args.vector_codec,
+                        promote_threshold=args.promote_threshold, compact_ratio=args.compact_ratio)
+    for first in range(0, args.initial, 1024):
+        store.add_documents(corpus[first:first + 1024])
+    store.wait_for_maintenance()
+    store.compact()
+    # Pre-compute the writer's embeddings so the measurement is the store's
+    # concurrency, not readers and the writer competing to run the embedder.
+    stream = corpus[args.initial:]
+    cache = store.embedding_cache
+    cache.put_many([cache.chunk_hash(c) for c in stream], store.model.encode(stream))
+
+    idle = Readers(store, corpus, queries, args.readers, args.top_k, args.mode).run(args.seconds)
+
+    ingest = {"chunks": 0, "writes": 0, "compactions_before": store.log.generation}
+
+    def write(stop):
+        start = time.perf_counter()
+        first = 0
+        pending = None
+        while not stop.is_set() and time.perf_counter() - start < args.seconds and first < len(stream):
+            future = store.submit("add_documents", stream[first:first + args.batch])
+            # One write queued behind the running one keeps the writer saturated.
+            if pending is not None:
+                pending.result()
+                ingest["writes"] += 1
+            pending = future
+            first += args.batch
+        if pending is not None:
+            pending.result()
+            ingest["writes"] += 1
+        ingest["seconds"] = time.perf_counter() - start
+        ingest["chunks"] = min(first, len(stream))
+
+    busy = Readers(store, corpus, queries, args.readers, args.top_k, args.mode).run(args.seconds, during=write)
+    store.wait_for_maintenance()
+    ingest["chunks_per_s"] = ingest["chunks"] / ingest["seconds"] if ingest["seconds"] else None
+    ingest["compactions"] = store.log.generation - ingest.pop("compactions_before")
+    stats = store.get_stats()
+    return {
+        "config": vars(args),
+        "idle": idle,
+        "during_ingest": busy,
+        "ingest": ingest,
+        "qps_ratio": busy["qps"] / idle["qps"] if idle["qps"] else None,
+        "p99_ratio": busy["p99_ms"] / idle["p99_ms"] if idle.get("p99_ms") else None,
+        "final": {"ntotal": stats["index_size"], "index_type": stats["index_type"],
+                  "unmerged_vectors": stats["unmerged_vectors"]},
+    }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# benchmarks/context_packing.py
+# Usage: python -m benchmarks.context_packing [--docs 300] [--queries 200] [--budgets 500 1000 2000]
+# Prompt size and latency with and without context packing, offline: documents are
+# split the way IngestionAgent splits them (1000-character chunks, 100 overlapping),
+# a share of them is uploaded twice with small edits (revised versions), and the
+# fake LLM backend charges prefill time per prompt token. "coverage" is the share of
+# queries whose source passage still appears verbatim in the prompt.
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.pipeline import latency_stats, synthetic_corpus
+from context_packing import ContextPacker, estimate_tokens
+from embeddings import HashingBackend
+from mcp import MCPMessage
+from vector_store import VectorStore
+
+
+def split_text(text, chunk_size=1000, chunk_overlap=100):
+    # Word-boundary windows with the splitter's overlap: each chunk starts with the
+    # last words (at most chunk_overlap characters) of the previous one.
+    words = text.split(" ")
+    chunks, current = [], []
+    for word in words:
+        if current and len(" ".join(current + [word])) > chunk_size:
+            chunks.append(" ".join(current))
+            carry = []
+            while current and len(" ".join([current[-1]] + carry)) <= chunk_overlap:
+                carry.insert(0, current.pop())
+            current = carry
+        current.append(word)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def synthetic_documents(n, seed=0, revised_share=0.3):
+    rng = np.random.default_rng(seed)
+    paragraphs = synthetic_corpus(n * 6, seed=seed, words=90)
+    docs = {f"doc-{i}.txt": " ".join(paragraphs[i * 6:(i + 1) * 6]) for i in range(n)}
+    for i in rng.choice(n, size=int(n * revised_share), replace=False):
+        # A revision: the same text with a few words changed, uploaded as its own file.
+        words = docs[f"doc-{i}.txt"].split(" ")
+        for j in rng.choice(len(words), size=5, replace=False):
+            words[j] = words[j][::-1]
+        docs[f"doc-{i}-v2.txt"] = " ".join(words)
+    return docs
+
+
+def queries_for(chunks, n, seed=1, words=8):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(chunks), size=n):
+        tokens = chunks[i].split(" ")
+        start = int(rng.integers(0, max(len(tokens) - words, 1)))
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+def run_config(name, queries, retrieve, llm_agent):
+    retrieval_ms, e2e_ms, tokens, covered, stats = [], [], [], 0, []
+    for query in queries:
+        start = time.perf_counter()
+        msg = retrieve(query)
+        retrieval_ms.append(time.perf_counter() - start)
+        answer = llm_agent.generate_response(msg).to_dict()
+        e2e_ms.append(time.perf_counter() - start)
+        context = answer["payload"].get("source_context", "")
+        tokens.append(estimate_tokens(context))
+        covered += query in context
+        if "context_stats" in msg["payload"]:
+            stats.append(msg["payload"]["context_stats"])
+    result = {
+        "config": name,
+        "prompt_context_tokens": {"mean": float(np.mean(tokens)), "p95": float(np.percentile(tokens, 95))},
+        "coverage": covered / len(queries),
+        "retrieval": latency_stats(retrieval_ms),
+        "end_to_end": latency_stats(e2e_ms),
+    }
+    if stats:
+        result["packing"] = {key: float(np.mean([s[key] for s in stats]))
+                             for key in ("candidates", "near_duplicates", "contained", "stitched", "over_budget",
+                                         "chunks_used", "passages", "tokens_candidates", "tokens_chunks_used",
+                                         "tokens_packed", "pack_ms")}
+    return result
+
+
+def run(args, workdir):
+    from agents.llm_response_agent import LLMResponseAgent
+    from agents.retrieval_agent import RetrievalAgent
+    from llm_backends import FakeLLMBackend
+
+    store = VectorStore(persist_path=os.path.join(workdir, "vector_store"),
+                        cache_path=os.path.join(workdir, "embedding_cache"),
+                        embedding_backend=HashingBackend(dimension=args.dim), retrieval_mode=args.mode)
+    all_chunks = []
+    for name, text in synthetic_documents(args.docs, seed=args.seed).items():
+        chunks = split_text(text)
+        store.add_documents(chunks, doc_id=name)
+        all_chunks.extend(chunks)
+    store.wait_for_maintenance()
+    if store.lexical_index is not None:
+        while not store.lexical_index.ready:
+            time.sleep(0.05)
+    queries = queries_for(all_chunks, args.queries, seed=args.seed + 1)
+    llm_agent = LLMResponseAgent(backend=FakeLLMBackend(first_token_s=args.llm_first_token_ms / 1000,
+                                                        tokens_per_s=0.0,
+                                                        prefill_tokens_per_s=args.llm_prefill_tokens_per_s),
+                                 max_tokens=args.llm_tokens)
+
+    def query_msg(query):
+        return MCPMessage("UI", "RetrievalAgent", "QUERY", {"query": query}).to_dict()
+
+    def raw(top_k):
+        def retrieve(query):
+            chunks = store.retrieve(query, top_k=top_k)
+            return MCPMessage("RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT",
+                              {"retrieved_context": [c["text"] for c in chunks], "query": query}).to_dict()
+        return retrieve
+
+    for query in queries[:10]:
+        store.retrieve(query)
+    results = [run_config(f"raw top-{args.top_k}", queries, raw(args.top_k), llm_agent),
+               run_config(f"raw top-{args.fetch_k}", queries, raw(args.fetch_k), llm_agent)]
+    for budget in args.budgets:
+        agent = RetrievalAgent(store, context_packer=ContextPacker(token_budget=budget, fetch_k=args.fetch_k,
+                                                                   mmr_lambda=args.mmr_lambda))
+        retrieve = lambda query, agent=agent: agent.handle_query(query_msg(query)).to_dict()
+        results.append(run_config(f"packed {budget} tokens (fetch {args.fetch_k})", queries, retrieve, llm_agent))
+    return {"config": vars(args), "chunks": len(all_chunks), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Context packing: prompt size and latency")
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3, help="chunks forwarded without packing")
+    parser.add_argument("--fetch-k", type=int, default=20, help="candidates fetched for packing")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[500, 700, 1000, 2000])
+    parser.add_argument("--mmr-lambda", type=float, default=0.7)
+    parser.add_argument("--mode", default="hybrid")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--llm-first-token-ms", type=float, default=50.0)
+    parser.add_argument("--llm-prefill-tokens-per-s", type=float, default=5000.0)
+    parser.add_argument("--llm-tokens", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag-packing-")
+    try:
+        # Store and agent chatter goes to stderr so stdout stays valid JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
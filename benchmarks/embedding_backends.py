@@ -0,0 +1,79 @@
+# benchmarks/embedding_backends.py
+# Usage: python -m benchmarks.embedding_backends [--backends torch int8 onnx] [--chunks 512]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BACKEND_IMPORTS = {
+    "torch": ["sentence_transformers"],
+    "int8": ["torch", "sentence_transformers"],
+    "onnx": ["onnxruntime", "sentence_transformers"],
+}
+
+
+def synthetic_chunks(n, words=120):
+    vocabulary = ("retrieval index vector embedding latency document query answer context "
+                  "agent message pipeline cache throughput shard segment").split()
+    return [" ".join(vocabulary[(i * 7 + j) % len(vocabulary)] for j in range(words)) for i in range(n)]
+
+
+def measure(backend_name, num_chunks):
+    # Runs in a fresh interpreter so import and load costs are truly cold.
+    import importlib
+    start = time.perf_counter()
+    for module in BACKEND_IMPORTS[backend_name]:
+        importlib.import_module(module)
+    import_s = time.perf_counter() - start
+
+    from embeddings import get_backend
+    backend = get_backend(backend_name)
+    start = time.perf_counter()
+    backend.encode(["What is the main topic of the document?"])
+    first_query_s = time.perf_counter() - start
+
+    chunks = synthetic_chunks(num_chunks)
+    start = time.perf_counter()
+    backend.encode(chunks)
+    encode_s = time.perf_counter() - start
+    return {
+        "backend": backend_name,
+        "import_s": import_s,
+        "first_query_s": first_query_s,
+        "encode_chunks": num_chunks,
+        "chunks_per_s": num_chunks / encode_s if encode_s else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends")
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.chunks)))
+        return
+
+    results = []
+    for name in args.backends:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.embedding_backends", "--worker", name, "--chunks", str(args.chunks)],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            results.append({"backend": name, "error": proc.stderr.strip().splitlines()[-1:] or ["failed"]})
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
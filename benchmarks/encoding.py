@@ -0,0 +1,141 @@
+# benchmarks/encoding.py
+# Usage: python -m benchmarks.encoding [--backend hash] [--chunks 20000] [--workers 1 2 4]
+# Bulk encoding throughput (chunks/s): one backend.encode() call over every chunk in
+# input order, against EncodingEngine with length bucketing in this process and over
+# pools of encoder processes, and the same through VectorStore.add_documents. Chunk
+# lengths vary the way a splitter's output does (mostly full chunks, a tail of short
+# ones). "padding_efficiency" is real tokens / padded tokens for the input-order
+# batches and for the engine's buckets; the hash backend pays nothing for padding, so
+# it shows only the process scaling, a transformer backend shows both.
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.pipeline import synthetic_corpus
+from embeddings import get_backend
+from encoding_engine import EncodingEngine, token_lengths
+from vector_store import VectorStore
+
+
+def varied_chunks(n, seed=0, max_words=180):
+    rng = np.random.default_rng(seed)
+    words = synthetic_corpus(n, seed=seed, words=max_words)
+    full = rng.random(n) < 0.6
+    sizes = np.where(full, max_words, rng.integers(10, max_words, size=n))
+    return [" ".join(chunk.split(" ")[:size]) for chunk, size in zip(words, sizes)]
+
+
+def input_order_padding(chunks, batch_size):
+    lengths = token_lengths(chunks)
+    padded = sum(len(lengths[i:i + batch_size]) * int(lengths[i:i + batch_size].max())
+                 for i in range(0, len(lengths), batch_size))
+    return float(lengths.sum() / padded)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def engine_run(backend, chunks, workers, args):
+    engine = EncodingEngine(backend, workers=workers, batch_size=args.batch_size,
+                            max_batch_tokens=args.max_batch_tokens, window=args.window)
+    start = time.perf_counter()
+    engine.start()
+    start_s = time.perf_counter() - start
+    first_window_s = None
+    start = time.perf_counter()
+    for offset, _ in engine.iter_encode(chunks):
+        if first_window_s is None:
+            first_window_s = time.perf_counter() - start
+    seconds = time.perf_counter() - start
+    stats = engine.get_stats()
+    engine.close()
+    return {
+        "config": f"engine, {stats['placement']}, {stats['workers']} worker(s)",
+        "start_s": start_s,
+        "seconds": seconds,
+        "chunks_per_s": len(chunks) / seconds,
+        "first_window_s": first_window_s,
+        "padding_efficiency": stats["padding_efficiency"],
+        "batches": stats["batches"],
+    }
+
+
+def store_run(backend, chunks, workers, args, workdir):
+    engine = None
+    if workers is not None:
+        engine = EncodingEngine(backend, workers=workers, batch_size=args.batch_size,
+                                max_batch_tokens=args.max_batch_tokens, window=args.window)
+        engine.start()
+    path = os.path.join(workdir, f"store-{workers}")
+    store = VectorStore(persist_path=os.path.join(path, "index"), cache_path=os.path.join(path, "embedding_cache"),
+                        embedding_backend=backend, encoding_engine=engine, index_type="flat")
+    seconds = timed(lambda: store.add_documents(chunks, doc_id=[f"doc-{i // 20}" for i in range(len(chunks))]))
+    store.wait_for_maintenance()
+    result = {
+        "config": "add_documents, " + ("no engine" if engine is None else f"engine, {workers} worker(s)"),
+        "seconds": seconds,
+        "chunks_per_s": len(chunks) / seconds,
+        "segments": len(store.log.pending_segments()),
+    }
+    if engine is not None:
+        engine.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk encoding throughput")
+    parser.add_argument("--backend", default="hash")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-batch-tokens", type=int, default=8192)
+    parser.add_argument("--window", type=int, default=4096)
+    parser.add_argument("--baseline-batch-size", type=int, default=32, help="backend.encode default")
+    parser.add_argument("--no-store", action="store_true", help="skip the add_documents runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend)
+    chunks = varied_chunks(args.chunks, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix="rag-encoding-")
+    results = []
+    try:
+        # Store chatter goes to stderr so stdout stays valid JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            backend.encode(chunks[:8])
+            seconds = timed(lambda: backend.encode(chunks, batch_size=args.baseline_batch_size))
+            results.append({"config": "backend.encode, input order", "seconds": seconds,
+                            "chunks_per_s": len(chunks) / seconds,
+                            "padding_efficiency": input_order_padding(chunks, args.baseline_batch_size)})
+            for workers in args.workers:
+                print(f"engine with {workers} worker(s)...", file=sys.stderr)
+                results.append(engine_run(backend, chunks, workers, args))
+            if not args.no_store:
+                for workers in [None] + args.workers:
+                    results.append(store_run(backend, chunks, workers, args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    base = results[0]["chunks_per_s"]
+    for result in results:
+        result["speedup"] = result["chunks_per_s"] / base
+    report = {"meta": {"cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+              "config": vars(args), "results": results}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
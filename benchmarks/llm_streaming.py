@@ -0,0 +1,147 @@
+# benchmarks/llm_streaming.py
+# Usage: python -m benchmarks.llm_streaming [--tokens 500] [--first-token-ms 300] [--tokens-per-s 50]
+#        python -m benchmarks.llm_streaming --serve          # OpenAI client against a local stand-in server
+#        python -m benchmarks.llm_streaming --base-url http://localhost:8000/v1 --model <name>
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from agents.llm_response_agent import LLMResponseAgent
+from llm_backends import FakeLLMBackend
+from mcp import MCPMessage
+from mcp_router import MCPRouter
+
+
+def retrieval_message():
+    return MCPMessage("RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT", {
+        "query": "What does the report say about latency?",
+        "retrieved_context": ["Latency dropped after streaming was enabled for every answer."] * 3,
+    }).to_dict()
+
+
+def serve_fake_openai(fake, port=0):
+    # Minimal OpenAI-compatible /v1/chat/completions endpoint streaming server-sent
+    # events from a FakeLLMBackend.
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for delta in fake.stream(body.get("messages", []), max_tokens=body.get("max_tokens", 500)):
+                chunk = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model", "fake"),
+                         "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure_blocking(agent, msg):
+    start = time.perf_counter()
+    agent.generate_response(msg)
+    elapsed = time.perf_counter() - start
+    return {"time_to_first_token_s": elapsed, "total_s": elapsed}
+
+
+def measure_stream(replies):
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    for reply in replies:
+        reply = reply.to_dict() if isinstance(reply, MCPMessage) else reply
+        if reply["type"] == "ERROR":
+            raise RuntimeError(reply["payload"].get("answer") or reply["payload"].get("error"))
+        if not reply["payload"].get("done", True):
+            tokens += 1
+            if first is None:
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return {"time_to_first_token_s": first, "total_s": total, "tokens": tokens,
+            "tokens_per_s": tokens / total if total else 0.0}
+
+
+async def measure_async_stream(agent, msg):
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    async for reply in agent.astream_response(msg):
+        if not reply.payload.get("done", True):
+            tokens += 1
+            if first is None:
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return {"time_to_first_token_s": first, "total_s": total, "tokens": tokens,
+            "tokens_per_s": tokens / total if total else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-first-token: blocking vs streaming responses")
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-s", type=float, default=50)
+    parser.add_argument("--serve", action="store_true", help="stream through the OpenAI client from a local stand-in server")
+    parser.add_argument("--base-url", default=None, help="an existing OpenAI-compatible server")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    args = parser.parse_args()
+
+    fake = FakeLLMBackend(first_token_s=args.first_token_ms / 1000, tokens_per_s=args.tokens_per_s)
+    server = None
+    if args.serve:
+        server = serve_fake_openai(fake)
+        args.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    # Agent start-up chatter goes to stderr so stdout stays valid JSON.
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.base_url:
+            agent = LLMResponseAgent(backend="openai", model_name=args.model, base_url=args.base_url,
+                                     max_tokens=args.tokens)
+        else:
+            agent = LLMResponseAgent(backend=fake, max_tokens=args.tokens)
+
+    msg = retrieval_message()
+    router = MCPRouter()
+    router.register("LLMResponseAgent", agent.stream_response, timeout=30.0)
+    router.start_background()
+    try:
+        results = {
+            "backend": agent.backend.name,
+            "base_url": args.base_url,
+            "max_tokens": args.tokens,
+            "blocking": measure_blocking(agent, msg),
+            "stream": measure_stream(agent.stream_response(msg)),
+            "async_stream": asyncio.run(measure_async_stream(agent, msg)),
+            "router_stream": measure_stream(router.stream_sync(dict(msg, trace_id=None))),
+        }
+    finally:
+        router.shutdown()
+        if server is not None:
+            server.shutdown()
+    results["ttft_speedup"] = (results["blocking"]["time_to_first_token_s"]
+                               / results["stream"]["time_to_first_token_s"])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/mcp_router.py
+# Usage: python -m benchmarks.mcp_router [--queries 50] [--retrieval-ms 20] [--llm-ms 200]
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from mcp import MCPMessage
+from mcp_router import MCPRouter
+
+
+class StubRetrievalAgent:
+    # Synchronous like the real RetrievalAgent, so it exercises the thread-pool path.
+    def __init__(self, delay):
+        self.delay = delay
+
+    def handle_query(self, mcp_msg):
+        time.sleep(self.delay)
+        query = mcp_msg["payload"]["query"]
+        return MCPMessage("RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT",
+                          {"query": query, "retrieved_context": [f"context for {query}"]},
+                          trace_id=mcp_msg.get("trace_id"))
+
+
+class StubLLMAgent:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def generate_response(self, mcp_msg):
+        time.sleep(self.delay)
+        return MCPMessage("LLMResponseAgent", "UI", "FINAL_RESPONSE",
+                          {"answer": f"answer to {mcp_msg['payload']['query']}"},
+                          trace_id=mcp_msg.get("trace_id"))
+
+
+def query_message(i):
+    return MCPMessage("UI", "RetrievalAgent", "QUERY", {"query": f"question {i}"}).to_dict()
+
+
+def run_sequential(retrieval, llm, n):
+    start = time.perf_counter()
+    for i in range(n):
+        llm.generate_response(retrieval.handle_query(query_message(i)).to_dict())
+    return time.perf_counter() - start
+
+
+async def run_routed(retrieval, llm, n, retrieval_concurrency, llm_concurrency):
+    router = MCPRouter()
+    router.register("RetrievalAgent", retrieval.handle_query, concurrency=retrieval_concurrency)
+    router.register("LLMResponseAgent", llm.generate_response, concurrency=llm_concurrency)
+    await router.start()
+    start = time.perf_counter()
+    replies = await asyncio.gather(*(router.request(query_message(i)) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    stats = router.get_stats()
+    await router.stop()
+    if any(reply["type"] != "FINAL_RESPONSE" for reply in replies):
+        raise RuntimeError("router returned an unexpected reply")
+    return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential agent calls vs the asyncio MCP router")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--retrieval-ms", type=float, default=20)
+    parser.add_argument("--llm-ms", type=float, default=200)
+    parser.add_argument("--retrieval-concurrency", type=int, default=4)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    args = parser.parse_args()
+    retrieval = StubRetrievalAgent(args.retrieval_ms / 1000)
+    llm = StubLLMAgent(args.llm_ms / 1000)
+
+    sequential = run_sequential(retrieval, llm, args.queries)
+    routed, stats = asyncio.run(run_routed(retrieval, llm, args.queries,
+                                           args.retrieval_concurrency, args.llm_concurrency))
+    print(json.dumps({
+        "queries": args.queries,
+        "sequential_s": sequential,
+        "routed_s": routed,
+        "sequential_queries_per_s": args.queries / sequential,
+        "routed_queries_per_s": args.queries / routed,
+        "speedup": sequential / routed,
+        "router": stats,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# benchmarks/pipeline.py
+# Usage: python -m benchmarks.pipeline [--sizes 1000 10000 50000] [--queries 200] [--output results.json]
+#        python -m benchmarks.pipeline --index-type hnsw --vector-codec sq8 --modes dense hybrid
+# Runs offline: a synthetic corpus, the deterministic "hash" embedder and the fake
+# LLM backend. Every corpus size runs in a fresh interpreter, so peak RSS and the
+# cold start of VectorStore() are measured per size.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+DOC_CHUNKS = 100
+
+
+def synthetic_corpus(n, seed=0, words=120, vocabulary=5000):
+    # Zipf-distributed pseudo-words plus one identifier per chunk, so both dense and
+    # exact-match (lexical) queries have something to find.
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    vocab = ["".join(rng.choice(letters, size=rng.integers(3, 10))) for _ in range(vocabulary)]
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+    picks = rng.choice(vocabulary, size=(n, words), p=weights)
+    return [" ".join(vocab[j] for j in row) + f" REF-{i:07d}" for i, row in enumerate(picks)]
+
+
+def synthetic_queries(corpus, n, seed=1, words=6):
+    # Half paraphrase a chunk (a random run of its words), half ask for its identifier.
+    rng = np.random.default_rng(seed)
+    queries = []
+    for k, i in enumerate(rng.integers(0, len(corpus), size=n)):
+        tokens = corpus[i].split()
+        if k % 2:
+            queries.append(f"where is {tokens[-1]} mentioned")
+        else:
+            start = int(rng.integers(0, max(len(tokens) - words, 1)))
+            queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def latency_stats(samples_s):
+    ms = np.asarray(samples_s) * 1000
+    if not len(ms):
+        return {}
+    return {
+        "count": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def open_store(path, args):
+    from embeddings import HashingBackend
+    from vector_store import VectorStore
+    return VectorStore(persist_path=os.path.join(path, "vector_store"),
+                       cache_path=os.path.join(path, "embedding_cache"),
+                       embedding_backend=HashingBackend(dimension=args.dim),
+                       index_type=args.index_type, vector_codec=args.vector_codec,
+                       promote_threshold=args.promote_threshold)
+
+
+def timed(fn, *fn_args, **fn_kwargs):
+    start = time.perf_counter()
+    result = fn(*fn_args, **fn_kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_size(size, path, args):
+    from agents.llm_response_agent import LLMResponseAgent
+    from agents.retrieval_agent import RetrievalAgent
+    from llm_backends import FakeLLMBackend
+    from mcp import MCPMessage
+
+    corpus = synthetic_corpus(size, seed=args.seed)
+    queries = synthetic_queries(corpus, args.queries, seed=args.seed + 1)
+    store, open_s = timed(open_store, path, args)
+
+    start = time.perf_counter()
+    for first in range(0, size, args.batch_size):
+        batch = corpus[first:first + args.batch_size]
+        store.add_documents(batch, doc_id=[f"doc-{(first + j) // DOC_CHUNKS}" for j in range(len(batch))])
+    ingest_s = time.perf_counter() - start
+
+    # Let promotion/retraining and compaction finish so retrieval sees the steady state.
+    start = time.perf_counter()
+    store.wait_for_maintenance()
+    if store._needs_retrain():
+        store.retrain()
+    store.compact()
+    maintenance_s = time.perf_counter() - start
+    stats = store.get_stats()
+
+    for query in queries[:args.warmup]:
+        store.retrieve(query, top_k=args.top_k)
+    retrieve = {}
+    for mode in args.modes:
+        samples = [timed(store.retrieve, query, top_k=args.top_k, mode=mode)[1] for query in queries]
+        retrieve[mode] = latency_stats(samples)
+        retrieve[mode]["qps"] = len(samples) / sum(samples) if sum(samples) else None
+
+    retrieval_agent = RetrievalAgent(store)
+    llm_agent = LLMResponseAgent(backend=FakeLLMBackend(first_token_s=args.llm_first_token_ms / 1000,
+                                                        tokens_per_s=args.llm_tokens_per_s),
+                                 max_tokens=args.llm_tokens)
+    agent_samples, e2e_samples, errors = [], [], 0
+    for query in queries[:args.e2e_queries]:
+        start = time.perf_counter()
+        msg = MCPMessage("UI", "RetrievalAgent", "QUERY", {"query": query}).to_dict()
+        retrieved = retrieval_agent.handle_query(msg).to_dict()
+        agent_samples.append(time.perf_counter() - start)
+        answer = llm_agent.generate_response(retrieved).to_dict()
+        e2e_samples.append(time.perf_counter() - start)
+        errors += retrieved["type"] == "ERROR" or answer["type"] == "ERROR"
+
+    return {
+        "ntotal": stats["index_size"],
+        "index_type": stats["index_type"],
+        "vector_codec": stats["vector_codec"],
+        "open_empty_s": open_s,
+        "ingest": {"chunks": size, "seconds": ingest_s, "chunks_per_s": size / ingest_s if ingest_s else None,
+                   "batch_size": args.batch_size},
+        "maintenance_s": maintenance_s,
+        "retrieve": retrieve,
+        "retrieval_agent": latency_stats(agent_samples),
+        "end_to_end": dict(latency_stats(e2e_samples), errors=int(errors)),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def bench_cold_start(path, args):
+    # Fresh interpreter: module imports, opening the persisted store, first query.
+    start = time.perf_counter()
+    import vector_store  # noqa: F401
+    import_s = time.perf_counter() - start
+    store, open_s = timed(open_store, path, args)
+    _, first_query_s = timed(store.retrieve, "where is REF-0000001 mentioned", top_k=args.top_k)
+    return {"import_s": import_s, "open_s": open_s, "first_query_ms": first_query_s * 1000,
+            "peak_rss_bytes": peak_rss_bytes()}
+
+
+def worker_command(args, flag, value):
+    cmd = [sys.executable, "-m", "benchmarks.pipeline", flag, str(value),
+           "--dim", str(args.dim), "--index-type", args.index_type, "--vector-codec", args.vector_codec,
+           "--promote-threshold", str(args.promote_threshold), "--top-k", str(args.top_k)]
+    if flag == "--worker":
+        cmd += ["--workdir", args.workdir, "--queries", str(args.queries), "--e2e-queries", str(args.e2e_queries),
+                "--warmup", str(args.warmup), "--batch-size", str(args.batch_size), "--seed", str(args.seed),
+                "--llm-first-token-ms", str(args.llm_first_token_ms),
+                "--llm-tokens-per-s", str(args.llm_tokens_per_s), "--llm-tokens", str(args.llm_tokens),
+                "--modes", *args.modes]
+    return cmd
+
+
+def run_worker(cmd):
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or ["failed"])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion, retrieval and end-to-end benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--e2e-queries", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=64, help="chunks per add_documents call")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--index-type", default="ivf_flat")
+    parser.add_argument("--vector-codec", default="fp32")
+    parser.add_argument("--promote-threshold", type=int, default=20000)
+    parser.add_argument("--modes", nargs="+", default=["dense", "hybrid"])
+    parser.add_argument("--llm-first-token-ms", type=float, default=0.0)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=0.0, help="0 streams without delay")
+    parser.add_argument("--llm-tokens", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="where the stores are built (default: a temp dir)")
+    parser.add_argument("--output", default=None, help="also write the JSON report here")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--cold-start", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None or args.cold_start:
+        # Store and agent chatter goes to stderr so stdout stays valid JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.cold_start:
+                result = bench_cold_start(args.cold_start, args)
+            else:
+                result = bench_size(args.worker, os.path.join(args.workdir, f"size-{args.worker}"), args)
+        print(json.dumps(result))
+        return
+
+    own_workdir = args.workdir is None
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    results = []
+    try:
+        for size in args.sizes:
+            print(f"benchmarking {size} chunks...", file=sys.stderr)
+            result = dict(size=size, **run_worker(worker_command(args, "--worker", size)))
+            path = os.path.join(args.workdir, f"size-{size}")
+            if "error" not in result:
+                result["cold_start"] = run_worker(worker_command(args, "--cold-start", path))
+            shutil.rmtree(path, ignore_errors=True)
+            results.append(result)
+    finally:
+        if own_workdir:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    import faiss
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "faiss": getattr(faiss, "__version__", None),
+        },
+        "config": {k: v for k, v in vars(args).items() if k not in ("worker", "cold_start", "output", "workdir")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
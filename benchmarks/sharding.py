@@ -0,0 +1,147 @@
+# benchmarks/sharding.py
+# Usage: python -m benchmarks.sharding [--chunks 20000] [--shards 1 2 4 8] [--placements thread process]
+# How a ShardedVectorStore scales with its shard count: ingestion throughput,
+# single-client query latency and multi-client query throughput, with the shards in
+# this process (fan-out threads) or in worker processes. Results are compared with
+# the single-shard store: with exact (flat) shards the merged top-k must match it.
+# Scaling past one shard needs as many free cores as shards; cpu_count is reported.
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.pipeline import DOC_CHUNKS, latency_stats, synthetic_corpus, synthetic_queries
+from embeddings import HashingBackend
+from sharded_store import ShardedVectorStore
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    # At the descriptor level, so shard worker processes inherit it too.
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def throughput(store, queries, clients, seconds, top_k, mode):
+    stop = threading.Event()
+    counts = [0] * clients
+
+    def client(i):
+        rng = np.random.default_rng(i)
+        while not stop.is_set():
+            store.retrieve(queries[int(rng.integers(len(queries)))], top_k=top_k, mode=mode)
+            counts[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def bench(num_shards, processes, corpus, queries, args, workdir):
+    path = os.path.join(workdir, f"{'process' if processes else 'thread'}-{num_shards}")
+    start = time.perf_counter()
+    store = ShardedVectorStore(persist_path=path, num_shards=num_shards, processes=processes,
+                               embedding_backend=HashingBackend(dimension=args.dim), index_type=args.index_type,
+                               promote_threshold=args.promote_threshold, retrieval_mode=args.mode)
+    open_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for first in range(0, len(corpus), args.batch_size):
+        batch = corpus[first:first + args.batch_size]
+        store.add_documents(batch, doc_id=[f"doc-{(first + j) // DOC_CHUNKS}" for j in range(len(batch))])
+    ingest_s = time.perf_counter() - start
+    store.wait_for_maintenance()
+    store.compact()
+    if args.mode != "dense":
+        # Let every shard finish building its BM25 index before measuring.
+        time.sleep(1.0)
+    for query in queries[:args.warmup]:
+        store.retrieve(query, top_k=args.top_k, mode=args.mode)
+    samples, answers = [], []
+    for query in queries:
+        start = time.perf_counter()
+        answers.append([r['text'] for r in store.retrieve(query, top_k=args.top_k, mode=args.mode)])
+        samples.append(time.perf_counter() - start)
+    qps = throughput(store, queries, args.clients, args.seconds, args.top_k, args.mode)
+    stats = store.get_stats()
+    store.close()
+    return {
+        "shards": num_shards,
+        "placement": "process" if processes else "thread",
+        "chunks_per_shard": [s['index_size'] for s in stats['shards']],
+        "open_s": open_s,
+        "ingest": {"seconds": ingest_s, "chunks_per_s": len(corpus) / ingest_s if ingest_s else None},
+        "query": latency_stats(samples),
+        "qps": {"clients": args.clients, "qps": qps},
+    }, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded vector store scaling")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--placements", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--mode", default="dense")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--promote-threshold", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.chunks, seed=args.seed)
+    queries = synthetic_queries(corpus, args.queries, seed=args.seed + 1)
+    workdir = tempfile.mkdtemp(prefix="rag-sharding-")
+    results, reference = [], None
+    try:
+        # Store chatter goes to stderr so stdout stays valid JSON.
+        with stdout_to_stderr():
+            for placement in args.placements:
+                for num_shards in args.shards:
+                    print(f"benchmarking {num_shards} shard(s) ({placement})...", file=sys.stderr)
+                    result, answers = bench(num_shards, placement == "process", corpus, queries, args, workdir)
+                    if reference is None:
+                        reference = answers
+                    result["same_top_k_as_first"] = float(np.mean([a == b for a, b in zip(answers, reference)]))
+                    results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    base = results[0]
+    for result in results:
+        result["qps_vs_first"] = result["qps"]["qps"] / base["qps"]["qps"] if base["qps"]["qps"] else None
+        result["p50_vs_first"] = result["query"]["p50_ms"] / base["query"]["p50_ms"]
+    report = {"meta": {"cpu_count": os.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+              "config": vars(args), "results": results}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
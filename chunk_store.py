@@ -0,0 +1,116 @@
+# chunk_store.py
+import mmap
+import os
+
+import numpy as np
+
+# chunk_offsets.npy holds len+1 int64 byte offsets into chunks.bin, a contiguous
+# UTF-8 blob. Both are memory-mapped, so opening a store is O(1) and only the
+# chunks that are actually read get decoded.
+OFFSETS_FILE = "chunk_offsets.npy"
+BLOB_FILE = "chunks.bin"
+
+
+class ChunkStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+        blob_path = os.path.join(directory, BLOB_FILE)
+        self._file = open(blob_path, "rb")
+        if os.path.getsize(blob_path):
+            self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = b""
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, OFFSETS_FILE)) and \
+            os.path.exists(os.path.join(directory, BLOB_FILE))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self._blob[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @staticmethod
+    def write(directory, parts, keep=None):
+        # parts is a sequence of ChunkStore instances (copied byte-for-byte) and
+        # lists of str; the result is their concatenation, restricted to the rows
+        # whose keep flag is set when a keep mask is given.
+        offsets = [0]
+        row = 0
+        with open(os.path.join(directory, BLOB_FILE), "wb") as blob:
+            for part in parts:
+                n = len(part)
+                kept = None if keep is None else keep[row:row + n]
+                if isinstance(part, ChunkStore) and (kept is None or kept.all()):
+                    if n:
+                        base = offsets[-1]
+                        blob.write(part._blob[:int(part.offsets[-1])])
+                        offsets.extend((np.asarray(part.offsets[1:], dtype="int64") + base).tolist())
+                elif isinstance(part, ChunkStore):
+                    for i in np.flatnonzero(kept):
+                        data = part._blob[int(part.offsets[i]):int(part.offsets[i + 1])]
+                        blob.write(data)
+                        offsets.append(offsets[-1] + len(data))
+                else:
+                    for i, chunk in enumerate(part):
+                        if kept is not None and not kept[i]:
+                            continue
+                        data = chunk.encode("utf-8")
+                        blob.write(data)
+                        offsets.append(offsets[-1] + len(data))
+                row += n
+            blob.flush()
+            os.fsync(blob.fileno())
+        np.save(os.path.join(directory, OFFSETS_FILE), np.asarray(offsets, dtype="int64"))
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+class ChunkList:
+    # The store's view of every chunk: an immutable base (a mapped ChunkStore, or a
+    # plain list for pickled snapshots) plus an in-memory tail of chunks added since.
+    def __init__(self, base=None, tail=None):
+        self.base = base if base is not None else []
+        self.tail = list(tail) if tail is not None else []
+
+    def __len__(self):
+        return len(self.base) + len(self.tail)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        base_len = len(self.base)
+        if i < base_len:
+            return self.base[i]
+        return self.tail[i - base_len]
+
+    def __iter__(self):
+        yield from self.base
+        yield from self.tail
+
+    def extend(self, chunks):
+        self.tail.extend(chunks)
+
+    def snapshot(self):
+        return self.base, len(self.tail)
+
+    def parts(self, tail_len=None):
+        tail = self.tail if tail_len is None else self.tail[:tail_len]
+        return [self.base, tail]
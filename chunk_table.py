@@ -0,0 +1,192 @@
+# chunk_table.py
+import json
+import os
+
+import numpy as np
+
+# Per-row metadata of a base snapshot, aligned with vectors.npy and the chunk store:
+#   chunk_ids.npy  -> int64 stable chunk id of every row (ascending)
+#   chunk_docs.npy -> int64 ordinal into documents.json, -1 for chunks without a document
+#   documents.json -> list of document ids
+# Bases written before these files existed use chunk id == row and no documents.
+IDS_FILE = "chunk_ids.npy"
+DOCS_FILE = "chunk_docs.npy"
+DOCUMENTS_FILE = "documents.json"
+
+
+class ChunkTable:
+    # Maps index rows (FAISS labels) to stable chunk ids and document ids. Chunk ids
+    # are assigned in increasing order and rows are only ever appended or removed, so
+    # the ids stay sorted and a row is found by binary search. Deleted chunks are
+    # tombstoned here and filtered out of searches until compaction drops their rows.
+    def __init__(self, base_len=0, base_ids=None, base_docs=None, doc_names=None, next_id=None):
+        self.base_len = base_len
+        self.base_ids = base_ids
+        self.base_docs = base_docs
+        self.doc_names = list(doc_names or [])
+        self.tail_ids = []
+        self.tail_docs = []
+        self.tombstones = set()
+        last = int(base_ids[-1]) + 1 if base_ids is not None and len(base_ids) else base_len
+        self.next_id = max(next_id or 0, last)
+        self._documents = None
+        self._tombstone_rows = None
+
+    @classmethod
+    def open(cls, directory, base_len, next_id=None):
+        if directory is None:
+            return cls(base_len, next_id=next_id)
+        ids_path = os.path.join(directory, IDS_FILE)
+        if not os.path.exists(ids_path):
+            return cls(base_len, next_id=next_id)
+        with open(os.path.join(directory, DOCUMENTS_FILE), "r") as f:
+            doc_names = json.load(f)
+        return cls(base_len,
+                   base_ids=np.load(ids_path, mmap_mode="r"),
+                   base_docs=np.load(os.path.join(directory, DOCS_FILE), mmap_mode="r"),
+                   doc_names=doc_names,
+                   next_id=next_id)
+
+    def __len__(self):
+        return self.base_len + len(self.tail_ids)
+
+    def assign(self, n):
+        ids = list(range(self.next_id, self.next_id + n))
+        self.next_id += n
+        return ids
+
+    def extend(self, ids, doc_ids):
+        self.tail_ids.extend(int(i) for i in ids)
+        self.tail_docs.extend(doc_ids)
+        self.next_id = max(self.next_id, int(ids[-1]) + 1) if len(ids) else self.next_id
+        if self._documents is not None:
+            for chunk_id, doc_id in zip(ids, doc_ids):
+                if doc_id is not None:
+                    self._documents.setdefault(doc_id, []).append(int(chunk_id))
+
+    def ids_of(self, rows):
+        rows = np.asarray(rows, dtype="int64")
+        out = np.empty(len(rows), dtype="int64")
+        in_base = rows < self.base_len
+        if self.base_ids is None:
+            out[in_base] = rows[in_base]
+        else:
+            out[in_base] = np.asarray(self.base_ids)[rows[in_base]]
+        if (~in_base).any():
+            out[~in_base] = np.asarray(self.tail_ids, dtype="int64")[rows[~in_base] - self.base_len]
+        return out
+
+    def rows_of(self, chunk_ids):
+        # Binary search over the sorted id columns; ids that are not present map to -1.
+        chunk_ids = np.asarray(list(chunk_ids), dtype="int64")
+        rows = np.full(len(chunk_ids), -1, dtype="int64")
+        if self.base_ids is None:
+            in_base = (chunk_ids >= 0) & (chunk_ids < self.base_len)
+            rows[in_base] = chunk_ids[in_base]
+        elif self.base_len:
+            found = np.searchsorted(self.base_ids, chunk_ids)
+            hit = found < self.base_len
+            hit[hit] = np.asarray(self.base_ids[found[hit]]) == chunk_ids[hit]
+            rows[hit] = found[hit]
+        if self.tail_ids:
+            tail = np.asarray(self.tail_ids, dtype="int64")
+            found = np.searchsorted(tail, chunk_ids)
+            hit = (rows < 0) & (found < len(tail))
+            hit[hit] = tail[found[hit]] == chunk_ids[hit]
+            rows[hit] = found[hit] + self.base_len
+        return rows
+
+    def documents(self):
+        # doc id -> chunk ids, built on first use so opening a large store stays O(1).
+        if self._documents is None:
+            documents = {}
+            if self.base_docs is not None and self.base_len:
+                docs = np.asarray(self.base_docs)
+                order = np.argsort(docs, kind="stable")
+                bounds = np.flatnonzero(np.diff(docs[order])) + 1
+                for group in np.split(order, bounds):
+                    if len(group) and docs[group[0]] >= 0:
+                        documents[self.doc_names[docs[group[0]]]] = self.ids_of(group).tolist()
+            for chunk_id, doc_id in zip(self.tail_ids, self.tail_docs):
+                if doc_id is not None:
+                    documents.setdefault(doc_id, []).append(chunk_id)
+            for doc_id in list(documents):
+                documents[doc_id] = [i for i in documents[doc_id] if i not in self.tombstones]
+                if not documents[doc_id]:
+                    del documents[doc_id]
+            self._documents = documents
+        return self._documents
+
+    def doc_of(self, row):
+        row = int(row)
+        if row < self.base_len:
+            if self.base_docs is None:
+                return None
+            ordinal = int(self.base_docs[row])
+            return self.doc_names[ordinal] if ordinal >= 0 else None
+        return self.tail_docs[row - self.base_len]
+
+    def document_chunks(self, doc_id):
+        return list(self.documents().get(doc_id, []))
+
+    def delete(self, chunk_ids):
+        chunk_ids = [int(i) for i in chunk_ids]
+        if not chunk_ids:
+            return
+        self.tombstones.update(chunk_ids)
+        self._tombstone_rows = None
+        if self._documents is not None:
+            deleted = set(chunk_ids)
+            for doc_id in [d for d, ids in self._documents.items() if deleted.intersection(ids)]:
+                remaining = [i for i in self._documents[doc_id] if i not in deleted]
+                if remaining:
+                    self._documents[doc_id] = remaining
+                else:
+                    del self._documents[doc_id]
+
+    def tombstone_rows(self):
+        if self._tombstone_rows is None:
+            rows = self.rows_of(sorted(self.tombstones)) if self.tombstones else np.zeros(0, dtype="int64")
+            self._tombstone_rows = np.sort(rows[rows >= 0])
+        return self._tombstone_rows
+
+    def snapshot(self):
+        return len(self.tail_ids)
+
+    def write(self, directory, tail_len, keep=None):
+        # Writes the metadata of rows [0, base_len + tail_len) (those in keep, if given).
+        n = self.base_len + tail_len
+        rows = np.arange(n, dtype="int64") if keep is None else np.flatnonzero(keep[:n])
+        base_rows = rows[rows < self.base_len]
+        tail_rows = rows[rows >= self.base_len] - self.base_len
+        names, ordinals = [], {}
+        base_docs = np.full(len(base_rows), -1, dtype="int64")
+        if self.base_docs is not None and len(base_rows):
+            used, inverse = np.unique(np.asarray(self.base_docs)[base_rows], return_inverse=True)
+            remap = np.full(len(used), -1, dtype="int64")
+            for k, ordinal in enumerate(used):
+                if ordinal >= 0:
+                    ordinals[self.doc_names[ordinal]] = remap[k] = len(names)
+                    names.append(self.doc_names[ordinal])
+            base_docs = remap[inverse]
+        tail_docs = np.full(len(tail_rows), -1, dtype="int64")
+        for j, row in enumerate(tail_rows):
+            doc_id = self.tail_docs[row]
+            if doc_id is not None:
+                if doc_id not in ordinals:
+                    ordinals[doc_id] = len(names)
+                    names.append(doc_id)
+                tail_docs[j] = ordinals[doc_id]
+        np.save(os.path.join(directory, IDS_FILE), self.ids_of(rows))
+        np.save(os.path.join(directory, DOCS_FILE), np.concatenate([base_docs, tail_docs]))
+        with open(os.path.join(directory, DOCUMENTS_FILE), "w") as f:
+            json.dump(names, f)
+
+    def rebased(self, directory, base_len, tail_len, purged):
+        # The table after compaction folded the first tail_len tail rows into the new
+        # base at directory and dropped the purged chunk ids.
+        table = ChunkTable.open(directory, base_len, next_id=self.next_id)
+        table.tail_ids = self.tail_ids[tail_len:]
+        table.tail_docs = self.tail_docs[tail_len:]
+        table.tombstones = self.tombstones - set(purged)
+        return table
@@ -0,0 +1,180 @@
+# context_packing.py
+import time
+
+import numpy as np
+
+# About what raw top-3 retrieval sends (three ~1000-character chunks), so packing
+# spends the same prompt on more distinct material instead of a bigger prompt.
+DEFAULT_TOKEN_BUDGET = 700
+DEFAULT_FETCH_K = 20
+DEFAULT_MMR_LAMBDA = 0.7
+# Candidates at least this similar to an already chosen one are dropped outright.
+DUPLICATE_SIMILARITY = 0.95
+MIN_OVERLAP_CHARS = 20
+# Rule of thumb for English under BPE tokenizers; only used for budgeting.
+CHARS_PER_TOKEN = 4
+SEPARATOR = "\n\n"
+SEPARATOR_TOKENS = 1
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def overlap_length(left, right, min_overlap=MIN_OVERLAP_CHARS):
+    # Length of the longest suffix of left that is also a prefix of right (0 when
+    # shorter than min_overlap); the splitter's chunk_overlap produces exactly this.
+    probe = right[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    pos = left.find(probe)
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(probe, pos + 1)
+    return 0
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _rescale(values):
+    spread = values.max() - values.min()
+    return (values - values.min()) / spread if spread > 0 else np.ones_like(values)
+
+
+def mmr_order(relevance, embeddings, mmr_lambda=DEFAULT_MMR_LAMBDA, duplicate_similarity=DUPLICATE_SIMILARITY):
+    # Greedy maximal marginal relevance over every candidate. The pairwise similarity
+    # matrix is computed once; each step then updates all candidates' similarity to
+    # the selection with one row of it. Returns (order, near-duplicate indices).
+    unit = _unit(embeddings)
+    sims = unit @ unit.T
+    relevance = np.asarray(relevance, dtype="float32")
+    redundancy = np.zeros(len(unit), dtype="float32")
+    available = np.ones(len(unit), dtype=bool)
+    order, duplicates = [], []
+    while available.any():
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        np.maximum(redundancy, sims[best], out=redundancy)
+        duplicate = available & (redundancy >= duplicate_similarity)
+        if duplicate.any():
+            duplicates.extend(np.nonzero(duplicate)[0].tolist())
+            available &= ~duplicate
+    return order, duplicates
+
+
+class ContextPacker:
+    # Turns a wide candidate set into the context sent to the LLM: candidates are
+    # ordered by MMR on their stored embeddings (relevance traded against redundancy
+    # with what is already chosen), near-duplicates are dropped, chunks of one document
+    # that overlap or were split next to each other are stitched into one passage, and
+    # passages are taken in that order while they fit the token budget.
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, fetch_k=DEFAULT_FETCH_K, mmr_lambda=DEFAULT_MMR_LAMBDA,
+                 duplicate_similarity=DUPLICATE_SIMILARITY, min_overlap=MIN_OVERLAP_CHARS):
+        self.token_budget = token_budget
+        self.fetch_k = fetch_k
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_similarity = duplicate_similarity
+        self.min_overlap = min_overlap
+
+    def _relevance(self, query_emb, candidates, unit):
+        # Each signal is rescaled to [0, 1] over the candidates. Hybrid results take the
+        # better of their BM25 and query-similarity scores rather than the fused rank:
+        # deeper fusion (a wider fetch) pushes exact-match hits down the RRF order, and
+        # RRF scores differ too little between first and last for MMR to use them.
+        signals = []
+        if query_emb is not None:
+            signals.append(_rescale(unit @ _unit(query_emb).reshape(-1)))
+        if any(c.get('bm25') is not None for c in candidates):
+            signals.append(_rescale(np.array([c.get('bm25') or 0.0 for c in candidates], dtype="float32")))
+        if not signals:
+            return _rescale(-np.arange(len(candidates), dtype="float32"))
+        return np.maximum.reduce(signals)
+
+    def _order(self, query_emb, candidates):
+        if len(candidates) < 2 or any(c.get('embedding') is None for c in candidates):
+            return list(range(len(candidates))), []
+        embeddings = np.stack([c['embedding'] for c in candidates])
+        relevance = self._relevance(query_emb, candidates, _unit(embeddings))
+        return mmr_order(relevance, embeddings, self.mmr_lambda, self.duplicate_similarity)
+
+    def _stitch(self, passage, chunk_id, text):
+        # The passage text with this chunk attached at either end, the same text if it
+        # already contains the chunk, or None when the two are not neighbours.
+        if text in passage['text']:
+            return passage['text']
+        ids = passage['chunk_ids']
+        adjacent = passage['doc_id'] is not None and chunk_id is not None
+        overlap = overlap_length(passage['text'], text, self.min_overlap)
+        if overlap or (adjacent and chunk_id == max(ids) + 1):
+            return passage['text'] + (text[overlap:] if overlap else "\n" + text)
+        overlap = overlap_length(text, passage['text'], self.min_overlap)
+        if overlap or (adjacent and chunk_id == min(ids) - 1):
+            return (text[:-overlap] if overlap else text + "\n") + passage['text']
+        return None
+
+    def pack(self, query_emb, candidates):
+        # candidates: VectorStore results in retrieval order, ideally with 'embedding'.
+        # Returns (passages, stats); passages carry 'text', 'chunk_ids' and 'doc_id'.
+        start = time.perf_counter()
+        order, duplicates = self._order(query_emb, candidates)
+        passages, used = [], 0
+        stats = {"candidates": len(candidates), "near_duplicates": len(duplicates), "contained": 0,
+                 "stitched": 0, "over_budget": 0, "chunks_used": 0, "tokens_chunks_used": 0,
+                 "tokens_candidates": sum(estimate_tokens(c['text']) for c in candidates)}
+        for i in order:
+            candidate = candidates[i]
+            text = candidate['text'].strip()
+            if not text:
+                continue
+            chunk_id = candidate.get('chunk_id')
+            target = new_text = None
+            for passage in passages:
+                if passage['doc_id'] != candidate.get('doc_id'):
+                    continue
+                new_text = self._stitch(passage, chunk_id, text)
+                if new_text is not None:
+                    target = passage
+                    break
+            if target is not None and new_text == target['text']:
+                stats["contained"] += 1
+                continue
+            if target is not None:
+                cost = estimate_tokens(new_text) - target['tokens']
+            else:
+                cost = estimate_tokens(text) + (SEPARATOR_TOKENS if passages else 0)
+            if used + cost > self.token_budget:
+                stats["over_budget"] += 1
+                continue
+            used += cost
+            stats["chunks_used"] += 1
+            stats["tokens_chunks_used"] += estimate_tokens(text)
+            if target is not None:
+                target['text'] = new_text
+                target['tokens'] = estimate_tokens(new_text)
+                target['chunk_ids'].append(chunk_id)
+                stats["stitched"] += 1
+            else:
+                passages.append({'text': text, 'tokens': estimate_tokens(text), 'chunk_ids': [chunk_id],
+                                 'doc_id': candidate.get('doc_id')})
+        if not passages and order:
+            # Not even the best chunk fits: send its head rather than no context at all.
+            text = candidates[order[0]]['text'].strip()[:self.token_budget * CHARS_PER_TOKEN]
+            passages.append({'text': text, 'tokens': estimate_tokens(text),
+                             'chunk_ids': [candidates[order[0]].get('chunk_id')],
+                             'doc_id': candidates[order[0]].get('doc_id')})
+            used = passages[0]['tokens']
+        for passage in passages:
+            passage['chunk_ids'].sort(key=lambda c: (c is None, c))
+        stats.update(passages=len(passages), tokens_packed=used, pack_ms=(time.perf_counter() - start) * 1000)
+        return passages, stats
+
+    @staticmethod
+    def context(passages):
+        return SEPARATOR.join(passage['text'] for passage in passages)
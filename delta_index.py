@@ -0,0 +1,79 @@
+# delta_index.py
+import faiss
+import numpy as np
+
+from index_backends import merge_results, search
+
+# A new run is merged into the previous one while that one is at most this many times
+# larger, so there are O(log n) runs and each vector is copied O(log n) times.
+MERGE_RATIO = 2
+
+
+class DeltaIndex:
+    # Immutable exact index over the vectors added since the last compaction. add()
+    # returns a new DeltaIndex that shares the existing runs (IndexFlatL2s that are
+    # never written again), so a search holding an older DeltaIndex is never affected
+    # by a concurrent add. Labels are row numbers across the runs, in insertion order.
+    def __init__(self, d, runs=()):
+        self.d = d
+        self.runs = tuple(runs)
+        self.offsets = np.cumsum([0] + [run.ntotal for run in self.runs])
+        self.ntotal = int(self.offsets[-1])
+
+    @staticmethod
+    def _run(vectors):
+        run = faiss.IndexFlatL2(vectors.shape[1])
+        run.add(np.ascontiguousarray(vectors, dtype="float32"))
+        return run
+
+    def add(self, vectors):
+        if not len(vectors):
+            return self
+        runs = list(self.runs)
+        pending = np.ascontiguousarray(vectors, dtype="float32")
+        while runs and runs[-1].ntotal <= MERGE_RATIO * len(pending):
+            last = runs.pop()
+            pending = np.vstack([last.reconstruct_n(0, last.ntotal), pending])
+        runs.append(self._run(pending))
+        return DeltaIndex(self.d, runs)
+
+    def tail(self, start):
+        # The rows from start on, as a new DeltaIndex (what stays after compaction).
+        if start >= self.ntotal:
+            return DeltaIndex(self.d)
+        if start <= 0:
+            return self
+        return DeltaIndex(self.d).add(self.reconstruct_n(start, self.ntotal - start))
+
+    def reconstruct(self, i):
+        k = int(np.searchsorted(self.offsets, i, side="right")) - 1
+        return self.runs[k].reconstruct(int(i - self.offsets[k]))
+
+    def reconstruct_n(self, start, n):
+        out = np.empty((n, self.d), dtype="float32")
+        end = start + n
+        for k, run in enumerate(self.runs):
+            lo, hi = max(start, self.offsets[k]), min(end, self.offsets[k + 1])
+            if lo < hi:
+                out[lo - start:hi - start] = run.reconstruct_n(int(lo - self.offsets[k]), int(hi - lo))
+        return out
+
+    def search(self, queries, top_k, exclude=None, include=None):
+        # Same contract as index_backends.search, over every run.
+        results = []
+        for k, run in enumerate(self.runs):
+            lo, hi = self.offsets[k], self.offsets[k + 1]
+            run_exclude = run_include = None
+            if exclude is not None and len(exclude):
+                run_exclude = exclude[(exclude >= lo) & (exclude < hi)] - lo
+            if include is not None:
+                run_include = include[(include >= lo) & (include < hi)] - lo
+                if not len(run_include):
+                    continue
+            distances, labels = search(run, queries, min(top_k, run.ntotal), exclude=run_exclude,
+                                       include=run_include)
+            results.append((distances, np.where(labels >= 0, labels + lo, labels)))
+        if not results:
+            return (np.full((len(queries), 0), np.inf, dtype="float32"),
+                    np.full((len(queries), 0), -1, dtype="int64"))
+        return merge_results(results, top_k)
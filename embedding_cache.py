@@ -0,0 +1,192 @@
+# embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+
+def content_hash(data, namespace=""):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    digest = hashlib.sha256()
+    if namespace:
+        digest.update(namespace.encode("utf-8") + b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def document_id(name, file_hash=None):
+    # An uploaded file's document id. Two different files with the same name (say
+    # report.pdf from two folders) stay separate documents; the name is for display.
+    return f"{name}#{file_hash[:16]}" if file_hash else name
+
+
+class EmbeddingCache:
+    # Content-addressed store of chunk embeddings, plus the registry of which files and
+    # chunks are already in the vector index. Embeddings survive VectorStore.clear();
+    # the registry does not.
+    def __init__(self, path="embedding_cache", max_entries=100000, namespace=""):
+        self.path = path
+        self.db_path = os.path.join(path, "cache.sqlite")
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                hash TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used);
+            CREATE TABLE IF NOT EXISTS files (
+                hash TEXT PRIMARY KEY, name TEXT, num_chunks INTEGER);
+            CREATE TABLE IF NOT EXISTS indexed_chunks (hash TEXT PRIMARY KEY);
+        """)
+        # Caches created before files recorded their document.
+        if "doc_id" not in [r[1] for r in self._conn.execute("PRAGMA table_info(files)")]:
+            self._conn.execute("ALTER TABLE files ADD COLUMN doc_id TEXT")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM embeddings").fetchone()
+        self._clock, self._entries = row
+
+    def chunk_hash(self, text):
+        return content_hash(text, self.namespace)
+
+    def index_key(self, chunk_hash, doc_id=None):
+        # Registry key of a chunk in a document: the same text in two documents is two
+        # index entries, so deleting one document never drops the other's copy.
+        if doc_id is None:
+            return chunk_hash
+        return content_hash(f"{doc_id}\0{chunk_hash}")
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get_many(self, hashes):
+        found = {}
+        if not hashes:
+            return found
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE hash IN ({placeholders})", batch
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype="float32")
+            if found:
+                tick = self._tick()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE hash = ?", [(tick, h) for h in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(hashes)) - len(found)
+        return found
+
+    def put_many(self, hashes, vectors):
+        if not hashes:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock:
+            tick = self._tick()
+            # A hash names its vector, so a row already cached only needs its last_used
+            # bumped; the rows actually inserted keep the entry count current.
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (hash, vector, last_used) VALUES (?, ?, ?)",
+                [(h, vectors[i].tobytes(), tick) for i, h in enumerate(hashes)],
+            ).rowcount
+            if inserted < len(hashes):
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE hash = ?", [(tick, h) for h in hashes]
+                )
+            self._entries += inserted
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        excess = self._entries - self.max_entries
+        if excess > 0:
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE hash IN "
+                "(SELECT hash FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            ).rowcount
+            self._entries -= deleted
+            self.evictions += deleted
+
+    def indexed(self, hashes):
+        present = set()
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash FROM indexed_chunks WHERE hash IN ({placeholders})", batch
+                ).fetchall()
+                present.update(r[0] for r in rows)
+        return present
+
+    def mark_indexed(self, hashes):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO indexed_chunks (hash) VALUES (?)", [(h,) for h in hashes]
+            )
+            self._conn.commit()
+
+    def unmark_indexed(self, hashes):
+        with self._lock:
+            self._conn.executemany("DELETE FROM indexed_chunks WHERE hash = ?", [(h,) for h in hashes])
+            self._conn.commit()
+
+    def indexed_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM indexed_chunks").fetchone()[0]
+
+    def has_file(self, file_hash):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM files WHERE hash = ?", (file_hash,)).fetchone()
+        return row is not None
+
+    def mark_file(self, file_hash, name=None, num_chunks=0, doc_id=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (hash, name, num_chunks, doc_id) VALUES (?, ?, ?, ?)",
+                (file_hash, name, num_chunks, doc_id),
+            )
+            self._conn.commit()
+
+    def unmark_document_files(self, doc_id):
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM files WHERE doc_id = ?", (doc_id,)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def reset_index_state(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM indexed_chunks")
+            self._conn.commit()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,132 @@
+# embeddings.py
+import threading
+import zlib
+
+import numpy as np
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class EmbeddingBackend:
+    # Nothing heavy (torch, onnxruntime, model weights) is imported or loaded until
+    # the first encode() or an explicit load(), so constructing a VectorStore is cheap.
+    name = "base"
+
+    def __init__(self, model_name=DEFAULT_MODEL, dimension=384, batch_size=32):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.batch_size = batch_size
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def cache_namespace(self):
+        # Quantized backends produce slightly different vectors; never share cache entries.
+        # The default torch backend keeps the bare model name that existing caches use.
+        if self.name == "torch":
+            return self.model_name
+        return f"{self.model_name}:{self.name}"
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def __getstate__(self):
+        # Pickled unloaded (for shard worker processes); each process loads its own model.
+        state = dict(self.__dict__, _model=None)
+        del state["_load_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_lock = threading.Lock()
+
+    def load_async(self):
+        thread = threading.Thread(target=self.load, daemon=True)
+        thread.start()
+        return thread
+
+    def _load_model(self):
+        raise NotImplementedError
+
+    def encode(self, texts, **kwargs):
+        model = self.load()
+        kwargs.setdefault("batch_size", self.batch_size)
+        embeddings = model.encode(list(texts), **kwargs)
+        embeddings = np.asarray(embeddings, dtype="float32")
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        return embeddings
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    name = "torch"
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name, device="cpu")
+
+
+class QuantizedTorchBackend(SentenceTransformerBackend):
+    # int8 dynamic quantization of every nn.Linear; roughly 2x encode throughput on
+    # CPU for MiniLM with a negligible change in retrieval quality.
+    name = "int8"
+
+    def _load_model(self):
+        import torch
+        model = super()._load_model()
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend(SentenceTransformerBackend):
+    # Needs sentence-transformers >= 3.2 with the onnx extra (optimum + onnxruntime).
+    name = "onnx"
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name, device="cpu", backend="onnx")
+
+
+class HashingBackend(EmbeddingBackend):
+    # Deterministic offline stand-in: signed feature hashing of the lower-cased words,
+    # L2-normalised. Texts sharing words land close together, so retrieval behaves
+    # plausibly in benchmarks and demos without downloading a model.
+    name = "hash"
+
+    def _load_model(self):
+        return self
+
+    def encode(self, texts, **kwargs):
+        texts = list(texts)
+        out = np.zeros((len(texts), self.dimension), dtype="float32")
+        for row, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in text.lower().split()), dtype="uint32")
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype("float32")
+            np.add.at(out[row], hashes % self.dimension, signs)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms > 0, norms, 1.0)
+
+
+BACKENDS = {
+    "torch": SentenceTransformerBackend,
+    "int8": QuantizedTorchBackend,
+    "onnx": OnnxBackend,
+    "hash": HashingBackend,
+}
+
+
+def get_backend(backend="torch", model_name=DEFAULT_MODEL, **kwargs):
+    if isinstance(backend, EmbeddingBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](model_name=model_name, **kwargs)
@@ -0,0 +1,223 @@
+# encoding_engine.py
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+DEFAULT_BATCH_SIZE = 64
+# Padded tokens per batch (batch length x longest member): long chunks go in small
+# batches, short ones in large batches, at about the same cost per batch.
+DEFAULT_MAX_BATCH_TOKENS = 8192
+# Chunks sorted and bucketed together; results are handed back one window at a time,
+# in input order, so the index fills while later windows are still encoding.
+DEFAULT_WINDOW = 4096
+DEFAULT_PREFETCH = 2
+# Below this many chunks an add is encoded in the caller, as before.
+MIN_PARALLEL_CHUNKS = 256
+# all-MiniLM-L6-v2 truncates at 256 word pieces; longer chunks cost no more than that.
+MAX_SEQ_LENGTH = 256
+CHARS_PER_TOKEN = 4
+
+_worker_backend = None
+
+
+def _init_worker(backend, threads):
+    # Each encoder process loads its own model, limited to its share of the cores so
+    # the workers do not oversubscribe the machine between them.
+    global _worker_backend
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_backend = backend
+    _worker_backend.load()
+
+
+def _encode_batch(texts):
+    return _worker_backend.encode(texts, batch_size=len(texts))
+
+
+def token_lengths(texts, max_length=MAX_SEQ_LENGTH):
+    # A character estimate plus [CLS]/[SEP]; it only has to order chunks and bound
+    # batch cost, so tokenizing everything twice would not pay for itself.
+    lengths = np.fromiter((len(text) for text in texts), dtype="int64", count=len(texts))
+    return np.minimum((lengths + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN + 2, max_length)
+
+
+def plan_batches(lengths, batch_size=DEFAULT_BATCH_SIZE, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS):
+    # Longest first, so each batch is padded only up to its first member. Returns a
+    # list of index arrays into lengths.
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    batches, first = [], 0
+    while first < len(order):
+        longest = max(int(lengths[order[first]]), 1)
+        size = max(1, min(batch_size, max_batch_tokens // longest))
+        batches.append(order[first:first + size])
+        first += size
+    return batches
+
+
+class _Inline:
+    # Encodes in the calling process when result() is asked for, like a Future.
+    def __init__(self, backend, texts):
+        self.backend = backend
+        self.texts = texts
+
+    def result(self):
+        return self.backend.encode(self.texts, batch_size=len(self.texts))
+
+
+class EncodingEngine:
+    # Batch encoding for bulk ingestion: chunks are bucketed by length (so batches
+    # carry little padding), the batches are spread over a pool of encoder processes,
+    # and results stream back window by window in input order. With workers <= 1 the
+    # batches are encoded in this process. max_chunks_per_s caps the rate at which
+    # chunks are handed to the encoders, leaving CPU for queries during large loads.
+    def __init__(self, backend, workers=None, batch_size=DEFAULT_BATCH_SIZE, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+                 window=DEFAULT_WINDOW, prefetch=DEFAULT_PREFETCH, min_parallel=MIN_PARALLEL_CHUNKS,
+                 max_chunks_per_s=None, max_length=MAX_SEQ_LENGTH):
+        self.backend = backend
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.window = window
+        self.prefetch = max(1, prefetch)
+        self.min_parallel = min_parallel
+        self.max_chunks_per_s = max_chunks_per_s
+        self.max_length = max_length
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "chunks": 0, "batches": 0, "tokens": 0, "padded_tokens": 0,
+                       "seconds": 0.0, "wait_seconds": 0.0, "last_chunks_per_s": None}
+
+    @property
+    def parallel(self):
+        return self.workers > 1
+
+    def __getstate__(self):
+        # Sent to shard worker processes without the pool; each process starts its own.
+        state = dict(self.__dict__, _pool=None)
+        del state["_pool_lock"], state["_stats_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(self.backend, threads))
+            return self._pool
+
+    def start(self):
+        # Starts the encoder processes and loads their models ahead of the first ingest.
+        if self.parallel:
+            pool = self._get_pool()
+            for future in [pool.submit(_encode_batch, ["warm up"]) for _ in range(self.workers)]:
+                future.result()
+
+    def _submit(self, texts):
+        if not self.parallel:
+            return _Inline(self.backend, texts)
+        return self._get_pool().submit(_encode_batch, texts)
+
+    def _submit_window(self, texts, offset, started, counts):
+        piece = texts[offset:offset + self.window]
+        if self.max_chunks_per_s:
+            delay = started + offset / self.max_chunks_per_s - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        lengths = token_lengths(piece, self.max_length)
+        batches = plan_batches(lengths, self.batch_size, self.max_batch_tokens)
+        counts["batches"] += len(batches)
+        counts["tokens"] += int(lengths.sum())
+        counts["padded_tokens"] += sum(len(batch) * int(lengths[batch[0]]) for batch in batches)
+        return offset, len(piece), [(batch, self._submit([piece[i] for i in batch])) for batch in batches]
+
+    def iter_encode(self, texts):
+        # Yields (offset, embeddings) for consecutive windows of texts, in order.
+        texts = list(texts)
+        started = time.perf_counter()
+        counts = {"batches": 0, "tokens": 0, "padded_tokens": 0}
+        wait = 0.0
+        offsets = iter(range(0, len(texts), self.window))
+        pending = deque()
+        try:
+            for offset in offsets:
+                pending.append(self._submit_window(texts, offset, started, counts))
+                if len(pending) >= self.prefetch:
+                    break
+            while pending:
+                offset, size, futures = pending.popleft()
+                waiting = time.perf_counter()
+                out = None
+                for batch, future in futures:
+                    encoded = future.result()
+                    if out is None:
+                        out = np.empty((size, encoded.shape[1]), dtype="float32")
+                    out[batch] = encoded
+                wait += time.perf_counter() - waiting
+                # Keep the encoders busy while the caller indexes this window.
+                offset_next = next(offsets, None)
+                if offset_next is not None:
+                    pending.append(self._submit_window(texts, offset_next, started, counts))
+                yield offset, out
+        except BrokenProcessPool as e:
+            print(f"Encoder process died: {str(e)}")
+            with self._pool_lock:
+                self._pool = None
+            raise
+        finally:
+            for _, _, futures in pending:
+                for _, future in futures:
+                    if hasattr(future, "cancel"):
+                        future.cancel()
+        seconds = time.perf_counter() - started
+        with self._stats_lock:
+            stats = self._stats
+            stats["calls"] += 1
+            stats["chunks"] += len(texts)
+            stats["seconds"] += seconds
+            stats["wait_seconds"] += wait
+            for key, value in counts.items():
+                stats[key] += value
+            stats["last_chunks_per_s"] = len(texts) / seconds if seconds else None
+
+    def encode(self, texts):
+        parts = [embeddings for _, embeddings in self.iter_encode(texts)]
+        if not parts:
+            return np.zeros((0, self.backend.dimension), dtype="float32")
+        return np.concatenate(parts)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(
+            workers=self.workers if self.parallel else 1,
+            placement="process" if self.parallel else "inline",
+            batch_size=self.batch_size,
+            max_batch_tokens=self.max_batch_tokens,
+            window=self.window,
+            max_chunks_per_s=self.max_chunks_per_s,
+            # Chunks per second of wall time across every call, including time the
+            # caller spent indexing between windows.
+            chunks_per_s=stats["chunks"] / stats["seconds"] if stats["seconds"] else None,
+            padding_efficiency=stats["tokens"] / stats["padded_tokens"] if stats["padded_tokens"] else None,
+        )
+        return stats
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
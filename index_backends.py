@@ -0,0 +1,385 @@
+# index_backends.py
+import math
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# How vectors are stored inside the index: full float32, float16, 8-bit scalar
+# quantization or product-quantization codes.
+VECTOR_CODECS = ("fp32", "fp16", "sq8", "pq")
+
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_M = 16
+PQ_NBITS = 8
+# faiss warns below ~39 training points per centroid.
+MIN_POINTS_PER_CENTROID = 39
+# sq8 learns per-dimension ranges; too few samples clip later vectors badly.
+MIN_SQ8_TRAINING = 1000
+EXACT_SEARCH_BLOCK = 65536
+# Vectors are added to a new index this many at a time, so building one over a
+# memory-mapped vectors.npy never needs the whole matrix in RAM.
+ADD_BLOCK = 65536
+# faiss k-means samples at most this many points per centroid anyway.
+TRAINING_POINTS_PER_CENTROID = 256
+MAX_SQ_TRAINING = 65536
+
+SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def choose_nlist(ntotal):
+    nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    nlist = min(nlist, max(ntotal // MIN_POINTS_PER_CENTROID, 1))
+    return max(nlist, 1)
+
+
+def min_training_size(index_type, codec="fp32"):
+    needed = 0
+    if index_type == "ivf_pq" or codec == "pq":
+        needed = (2 ** PQ_NBITS) * MIN_POINTS_PER_CENTROID
+    elif index_type == "ivf_flat":
+        needed = MIN_POINTS_PER_CENTROID
+    elif codec == "sq8":
+        needed = MIN_SQ8_TRAINING
+    return needed
+
+
+def training_size(index_type, codec, ntotal):
+    # Rows to train on: what k-means and the quantizers actually use, not the corpus.
+    needed = min_training_size(index_type, codec)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        needed = max(needed, choose_nlist(ntotal) * TRAINING_POINTS_PER_CENTROID)
+    if index_type == "ivf_pq" or codec == "pq":
+        needed = max(needed, (2 ** PQ_NBITS) * TRAINING_POINTS_PER_CENTROID)
+    if codec in SQ_TYPES:
+        needed = max(needed, MAX_SQ_TRAINING)
+    return min(ntotal, needed)
+
+
+def sample_rows(vectors, n, seed=0):
+    # n rows in storage order (sequential reads on a memory-mapped file).
+    if n >= len(vectors):
+        return np.ascontiguousarray(vectors[:len(vectors)], dtype="float32")
+    picks = np.sort(np.random.default_rng(seed).choice(len(vectors), size=n, replace=False))
+    return np.ascontiguousarray(vectors[picks], dtype="float32")
+
+
+class StackedVectors:
+    # Rows of several matrices (the memory-mapped base vectors and the fp32 delta,
+    # say) read as one matrix, without copying them together.
+    def __init__(self, parts):
+        self.parts = [part for part in parts if len(part)]
+        self.offsets = np.cumsum([0] + [len(part) for part in self.parts])
+        self.shape = (int(self.offsets[-1]), self.parts[0].shape[1] if self.parts else 0)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            rows = np.arange(start, stop, step)
+        else:
+            rows = np.asarray(key, dtype="int64")
+            if rows.ndim == 0:
+                k = int(np.searchsorted(self.offsets, rows, side="right")) - 1
+                return self.parts[k][int(rows) - self.offsets[k]]
+        out = np.empty((len(rows), self.shape[1]), dtype="float32")
+        which = np.searchsorted(self.offsets, rows, side="right") - 1
+        for k, part in enumerate(self.parts):
+            selected = which == k
+            if selected.any():
+                out[selected] = part[rows[selected] - self.offsets[k]]
+        return out
+
+
+def build_index(index_type, dim, vectors, codec="fp32"):
+    # vectors: an array, a memory-mapped .npy or StackedVectors. The index is trained on
+    # a sample and filled ADD_BLOCK rows at a time.
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"Unknown vector codec: {codec} (expected one of {', '.join(VECTOR_CODECS)})")
+    ntotal = len(vectors)
+    if ntotal < min_training_size(index_type, codec):
+        raise ValueError(f"{index_type}/{codec} needs at least {min_training_size(index_type, codec)} "
+                         f"vectors to train, got {ntotal}")
+    if index_type == "flat":
+        if codec in SQ_TYPES:
+            index = faiss.IndexScalarQuantizer(dim, SQ_TYPES[codec])
+        elif codec == "pq":
+            index = faiss.IndexPQ(dim, PQ_M, PQ_NBITS)
+        else:
+            index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        if codec in SQ_TYPES:
+            index = faiss.IndexHNSWSQ(dim, SQ_TYPES[codec], HNSW_M)
+        elif codec == "pq":
+            index = faiss.IndexHNSWPQ(dim, PQ_M, HNSW_M)
+        else:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        nlist = choose_nlist(ntotal)
+        if index_type == "ivf_pq" or codec == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS)
+        elif codec in SQ_TYPES:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, SQ_TYPES[codec])
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        index.nprobe = min(DEFAULT_NPROBE, nlist)
+    if not index.is_trained:
+        index.train(sample_rows(vectors, training_size(index_type, codec, ntotal)))
+    for start in range(0, ntotal, ADD_BLOCK):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_BLOCK], dtype="float32"))
+    return index
+
+
+def empty_like(index):
+    # An empty index of the same kind with the same trained parameters (coarse
+    # centroids, scalar-quantizer ranges, PQ codebooks), made without copying the codes
+    # it stores: cloning a mapped base and calling reset() would read it all into RAM.
+    # (The downcast wrapper does not own the index, so the argument keeps it alive.)
+    source = faiss.downcast_index(index)
+    if isinstance(source, faiss.IndexHNSW):
+        storage = faiss.downcast_index(source.storage)
+        m = source.hnsw.nb_neighbors(1)
+        if isinstance(storage, faiss.IndexScalarQuantizer):
+            empty = faiss.IndexHNSWSQ(source.d, storage.sq.qtype, m)
+            faiss.downcast_index(empty.storage).sq = storage.sq
+        elif isinstance(storage, faiss.IndexPQ):
+            empty = faiss.IndexHNSWPQ(source.d, storage.pq.M, m, storage.pq.nbits)
+            faiss.downcast_index(empty.storage).pq = storage.pq
+        else:
+            empty = faiss.IndexHNSWFlat(source.d, m)
+        empty.storage.is_trained = True
+        empty.hnsw.efConstruction = source.hnsw.efConstruction
+        empty.hnsw.efSearch = source.hnsw.efSearch
+    elif isinstance(source, faiss.IndexIVF):
+        quantizer = faiss.clone_index(source.quantizer)
+        if isinstance(source, faiss.IndexIVFPQ):
+            empty = faiss.IndexIVFPQ(quantizer, source.d, source.nlist, source.pq.M, source.pq.nbits,
+                                     source.metric_type)
+            empty.pq = source.pq
+            empty.by_residual = source.by_residual
+            empty.use_precomputed_table = source.use_precomputed_table
+            empty.precompute_table()
+        elif isinstance(source, faiss.IndexIVFScalarQuantizer):
+            empty = faiss.IndexIVFScalarQuantizer(quantizer, source.d, source.nlist, source.sq.qtype,
+                                                  source.metric_type, source.by_residual)
+            empty.sq = source.sq
+        else:
+            empty = faiss.IndexIVFFlat(quantizer, source.d, source.nlist, source.metric_type)
+        empty.nprobe = source.nprobe
+    elif isinstance(source, faiss.IndexScalarQuantizer):
+        empty = faiss.IndexScalarQuantizer(source.d, source.sq.qtype, source.metric_type)
+        empty.sq = source.sq
+    elif isinstance(source, faiss.IndexPQ):
+        empty = faiss.IndexPQ(source.d, source.pq.M, source.pq.nbits, source.metric_type)
+        empty.pq = source.pq
+    else:
+        return faiss.IndexFlat(source.d, source.metric_type)
+    empty.is_trained = True
+    return empty
+
+
+def read_index_mmap(path, index_type=None):
+    # IVF indexes map their inverted lists with IO_FLAG_MMAP; flat-code indexes
+    # (flat, HNSW storage, scalar/product quantizers) map their codes with IO_FLAG_MMAP_IFC.
+    if index_type in ("ivf_flat", "ivf_pq"):
+        flags = [faiss.IO_FLAG_MMAP]
+    else:
+        flags = [getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP), faiss.IO_FLAG_MMAP]
+    for flag in flags:
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            continue
+    return faiss.read_index(path)
+
+
+def _codec_of_codes(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "fp32"
+
+
+def describe_index(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw", _codec_of_codes(index.storage)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq", "pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat", _codec_of_codes(index)
+    return "flat", _codec_of_codes(index)
+
+
+def index_type_of(index):
+    return describe_index(index)[0]
+
+
+def bytes_per_vector(index):
+    # In-RAM cost of one vector: its code plus the per-vector structure overhead
+    # (IVF stores an int64 id per entry, HNSW stores level-0 neighbour links).
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        return storage.code_size + index.hnsw.nb_neighbors(0) * 4
+    if isinstance(index, faiss.IndexIVF):
+        return index.code_size + 8
+    if isinstance(index, faiss.IndexFlatCodes):
+        return index.code_size
+    return index.d * 4
+
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    # Per-call parameter objects instead of mutating index.nprobe, so concurrent
+    # queries with different settings never interfere.
+    index_type = index_type_of(index)
+    kwargs = {"sel": sel} if sel is not None else {}
+    if index_type in ("ivf_flat", "ivf_pq") and (nprobe is not None or sel is not None):
+        if nprobe is not None:
+            kwargs["nprobe"] = int(nprobe)
+        return faiss.SearchParametersIVF(**kwargs)
+    if index_type == "hnsw" and (ef_search is not None or sel is not None):
+        if ef_search is not None:
+            kwargs["efSearch"] = int(ef_search)
+        return faiss.SearchParametersHNSW(**kwargs)
+    if sel is not None:
+        return faiss.SearchParameters(**kwargs)
+    return None
+
+
+def _drop_labels(distances, labels, exclude, top_k):
+    dropped = (labels < 0) | np.isin(labels, exclude)
+    distances = np.where(dropped, np.inf, distances)
+    labels = np.where(dropped, -1, labels)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :top_k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+
+def _search_subset(index, queries, top_k, include):
+    # Exact L2 over the decoded include rows.
+    vectors = np.vstack([index.reconstruct(int(i)) for i in include]).astype("float32")
+    exact = faiss.IndexFlatL2(index.d)
+    exact.add(vectors)
+    distances, local = exact.search(np.ascontiguousarray(queries, dtype="float32"), min(top_k, len(include)))
+    labels = np.where(local >= 0, include[np.maximum(local, 0)], -1)
+    return distances, labels
+
+
+def search(index, queries, top_k, nprobe=None, ef_search=None, exclude=None, include=None):
+    # exclude holds labels that must never be returned (deleted rows awaiting compaction);
+    # include, when given, restricts the search to those labels.
+    sel = None
+    if include is not None:
+        include = np.asarray(include, dtype="int64")
+        if exclude is not None and len(exclude):
+            include = np.setdiff1d(include, exclude)
+        else:
+            include = np.unique(include)
+        if not len(include):
+            return (np.full((len(queries), 0), np.inf, dtype="float32"),
+                    np.full((len(queries), 0), -1, dtype="int64"))
+        index_type, codec = describe_index(index)
+        # A graph walk rarely reaches a handful of allowed nodes and IndexPQ takes no
+        # selector: score the decoded candidates directly. IVF probes every list, so
+        # candidates outside the nearest clusters are still found.
+        if index_type == "hnsw" or (index_type, codec) == ("flat", "pq"):
+            return _search_subset(index, queries, top_k, include)
+        if index_type in ("ivf_flat", "ivf_pq"):
+            nprobe = faiss.extract_index_ivf(index).nlist
+        sel = faiss.IDSelectorBatch(include)
+        top_k = min(top_k, len(include))
+    elif exclude is not None and len(exclude):
+        if describe_index(index) == ("flat", "pq"):
+            # IndexPQ does not take an IDSelector: over-fetch and drop instead.
+            k = min(top_k + len(exclude), index.ntotal)
+            distances, labels = search(index, queries, k, nprobe=nprobe, ef_search=ef_search)
+            return _drop_labels(distances, labels, exclude, top_k)
+        batch = faiss.IDSelectorBatch(np.ascontiguousarray(exclude, dtype="int64"))
+        sel = faiss.IDSelectorNot(batch)
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+    if params is None:
+        return index.search(queries, top_k)
+    return index.search(queries, top_k, params=params)
+
+
+def merge_results(results, top_k):
+    # Merges per-tier (distances, labels) pairs of the same queries into one top-k.
+    results = [(d, i) for d, i in results if d.shape[1]]
+    if not results:
+        return np.zeros((0, 0), dtype="float32"), np.zeros((0, 0), dtype="int64")
+    if len(results) == 1:
+        return results[0]
+    distances = np.hstack([d for d, _ in results])
+    labels = np.hstack([i for _, i in results])
+    distances = np.where(labels < 0, np.inf, distances)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :top_k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+
+def exact_search(vectors, queries, top_k):
+    # Brute force over (possibly memory-mapped) vectors, one block at a time so the
+    # whole matrix never has to be resident.
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    results = []
+    for start in range(0, len(vectors), EXACT_SEARCH_BLOCK):
+        block = np.ascontiguousarray(vectors[start:start + EXACT_SEARCH_BLOCK], dtype="float32")
+        exact = faiss.IndexFlatL2(block.shape[1])
+        exact.add(block)
+        distances, labels = exact.search(queries, min(top_k, len(block)))
+        results.append((distances, np.where(labels >= 0, labels + start, labels)))
+    return merge_results(results, top_k)
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f[f >= 0]) & set(t[t >= 0])) for f, t in zip(found, truth))
+    return hits / float(truth.size) if truth.size else 1.0
+
+
+def recall_report(index, vectors, queries, top_k=10, settings=None, search_fn=None, exact_fn=None):
+    # exact_fn(queries, k), when given, replaces the flat scan over vectors.
+    queries = np.ascontiguousarray(queries, dtype="float32")
+
+    start = time.perf_counter()
+    _, truth = (exact_fn or (lambda q, k: exact_search(vectors, q, k)))(queries, top_k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    index_type, codec = describe_index(index)
+    if settings is None:
+        if index_type in ("ivf_flat", "ivf_pq"):
+            nlist = faiss.extract_index_ivf(index).nlist
+            settings = [{"nprobe": p} for p in (1, 4, 16, 64, 256) if p <= nlist]
+        elif index_type == "hnsw":
+            settings = [{"ef_search": ef} for ef in (16, 32, 64, 128, 256)]
+        else:
+            settings = [{}]
+
+    report = []
+    for setting in settings:
+        start = time.perf_counter()
+        _, found = (search_fn or (lambda q, k, **kw: search(index, q, k, **kw)))(queries, top_k, **setting)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        report.append({
+            "index_type": index_type,
+            "vector_codec": codec,
+            **setting,
+            "recall_at_k": recall_at_k(found, truth),
+            "latency_ms": latency_ms,
+            "exact_latency_ms": exact_ms,
+        })
+    return report
@@ -0,0 +1,176 @@
+# ingestion_jobs.py
+import io
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import content_hash, document_id
+from tracing import new_trace_id, tracer
+
+MAX_JOBS = 100
+FINISHED = ("done", "failed")
+
+
+class IngestionJob:
+    # One submission of files. The ingestion threads update it through progress();
+    # the UI reads it through snapshot(). Files are keyed by document id, so two
+    # uploads with the same name keep their own progress.
+    def __init__(self, uploaded_files, file_hashes):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.trace_id = new_trace_id() if tracer.enabled else None
+        # The bytes are copied now: the uploader's file objects belong to the script
+        # run that submitted the job, not to the worker that runs it later.
+        self.uploads = []
+        for uploaded_file in uploaded_files:
+            upload = io.BytesIO(uploaded_file.getvalue())
+            upload.name = uploaded_file.name
+            self.uploads.append(upload)
+        self.file_hashes = list(file_hashes)
+        self.files = OrderedDict()
+        for uploaded_file, file_hash in zip(uploaded_files, self.file_hashes):
+            doc_id = document_id(uploaded_file.name, file_hash)
+            self.files[doc_id] = {"name": uploaded_file.name, "doc_id": doc_id, "file_hash": file_hash,
+                                  "status": "queued", "chunks_extracted": 0, "chunks_indexed": 0, "error": None}
+        self._lock = threading.Lock()
+
+    def progress(self, event, doc_id, value=None):
+        with self._lock:
+            f = self.files.get(doc_id)
+            if f is None:
+                return
+            if event == "started":
+                f["status"] = "extracting"
+            elif event == "extracted":
+                f["chunks_extracted"] = value
+            elif event == "indexed":
+                f["chunks_indexed"] += value
+            elif event == "done":
+                f["status"] = "done"
+                f["chunks_extracted"] = value
+            elif event == "failed":
+                f["status"] = "failed"
+                f["error"] = value
+
+    def run(self, ingestion_agent, vector_store):
+        with self._lock:
+            self.status = "running"
+            self.started = time.time()
+        try:
+            ingestion_agent.ingest_files(self.uploads, vector_store, file_hashes=self.file_hashes,
+                                         trace_id=self.trace_id, progress=self.progress)
+            status, error = "done", None
+        except Exception as e:
+            # The store itself failed; every file not finished by then failed with it.
+            print(f"Error in ingestion job {self.id}: {str(e)}")
+            status, error = "failed", str(e)
+        with self._lock:
+            for f in self.files.values():
+                if f["status"] not in FINISHED:
+                    f["status"] = "failed"
+                    f["error"] = error or "ingestion stopped before this file finished"
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self.uploads = []
+
+    def snapshot(self):
+        with self._lock:
+            files = [dict(f) for f in self.files.values()]
+            finished = sum(f["status"] in FINISHED for f in files)
+            return {
+                "id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "trace_id": self.trace_id,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "files": files,
+                "files_finished": finished,
+                "files_failed": sum(f["status"] == "failed" for f in files),
+                "chunks_extracted": sum(f["chunks_extracted"] for f in files),
+                "chunks_indexed": sum(f["chunks_indexed"] for f in files),
+                "progress": finished / len(files) if files else 1.0,
+            }
+
+
+class IngestionJobQueue:
+    # Runs ingestion jobs on a small thread pool instead of inside the Streamlit script
+    # run. A file (by content hash) that is already indexed, or is in a job that has
+    # not finished, is not submitted again: reruns and other sessions uploading the
+    # same file get the existing job back. Jobs can run side by side because no two
+    # of them hold the same document, and a job replaces a document in one write.
+    def __init__(self, ingestion_agent, vector_store, max_workers=2, max_jobs=MAX_JOBS):
+        self.ingestion_agent = ingestion_agent
+        self.vector_store = vector_store
+        self.max_jobs = max_jobs
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest-job")
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, uploaded_files, file_hashes=None):
+        # Returns the ids of the jobs covering these files, new or already running.
+        if file_hashes is None:
+            file_hashes = [content_hash(f.getvalue()) for f in uploaded_files]
+        job_ids, new_files, new_hashes = [], [], []
+        with self._lock:
+            for uploaded_file, file_hash in zip(uploaded_files, file_hashes):
+                if file_hash in self._active:
+                    if self._active[file_hash] not in job_ids:
+                        job_ids.append(self._active[file_hash])
+                elif file_hash not in new_hashes and not self.vector_store.has_file(file_hash):
+                    new_files.append(uploaded_file)
+                    new_hashes.append(file_hash)
+            if not new_files:
+                return job_ids
+            job = IngestionJob(new_files, new_hashes)
+            self._jobs[job.id] = job
+            for file_hash in new_hashes:
+                self._active[file_hash] = job.id
+            self._evict()
+        self._pool.submit(self._run, job)
+        job_ids.append(job.id)
+        return job_ids
+
+    def _run(self, job):
+        try:
+            job.run(self.ingestion_agent, self.vector_store)
+        finally:
+            # Released only after the files are marked in the store, so a submit in
+            # between still sees them as either active or indexed.
+            with self._lock:
+                for file_hash in job.file_hashes:
+                    if self._active.get(file_hash) == job.id:
+                        del self._active[file_hash]
+
+    def _evict(self):
+        # Oldest finished jobs go first; unfinished ones are always kept.
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].finished is not None:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def jobs(self, job_ids=None):
+        with self._lock:
+            jobs = list(self._jobs.values()) if job_ids is None else [self._jobs[i] for i in job_ids if i in self._jobs]
+        return [job.snapshot() for job in jobs]
+
+    def has_active(self, job_ids=None):
+        return any(job["status"] not in FINISHED for job in self.jobs(job_ids))
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
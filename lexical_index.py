@@ -0,0 +1,145 @@
+# lexical_index.py
+import math
+import re
+import sys
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Keeps identifiers such as "ERR-1042", "sku_88-x" or "v2.3.1" as single tokens.
+TOKEN_RE = re.compile(r"\w(?:[\w.\-]*\w)?")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    # Inverted index keyed on stable chunk ids (see chunk_table.py), so compaction
+    # renumbering rows never touches it. Postings are append-only int arrays; deleted
+    # chunks get length 0 and are skipped when scoring.
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = array("I")
+        self.num_docs = 0
+        self.total_length = 0
+        self.deleted = set()
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def add(self, chunk_ids, texts):
+        # Tokenized outside the lock, so concurrent searches only wait for the appends.
+        docs = []
+        for chunk_id, text in zip(chunk_ids, texts):
+            tokens = tokenize(text)
+            if tokens:
+                docs.append((int(chunk_id), len(tokens), Counter(tokens)))
+        with self._lock:
+            for chunk_id, length, counts in docs:
+                if chunk_id in self.deleted:
+                    continue
+                if chunk_id < len(self.lengths) and self.lengths[chunk_id]:
+                    continue
+                if chunk_id >= len(self.lengths):
+                    self.lengths.extend([0] * (chunk_id + 1 - len(self.lengths)))
+                self.lengths[chunk_id] = length
+                self.num_docs += 1
+                self.total_length += length
+                for token, tf in counts.items():
+                    posting = self.postings.get(token)
+                    if posting is None:
+                        posting = self.postings[token] = (array("q"), array("I"))
+                    posting[0].append(chunk_id)
+                    posting[1].append(tf)
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                chunk_id = int(chunk_id)
+                self.deleted.add(chunk_id)
+                if chunk_id < len(self.lengths) and self.lengths[chunk_id]:
+                    self.num_docs -= 1
+                    self.total_length -= self.lengths[chunk_id]
+                    self.lengths[chunk_id] = 0
+
+    def search(self, query, top_k):
+        # Returns (chunk_ids, scores), best first.
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self.num_docs:
+                return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+            ids_parts, score_parts = self._score_terms(terms)
+        if not ids_parts:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        unique, inverse = np.unique(np.concatenate(ids_parts), return_inverse=True)
+        scores = np.bincount(inverse.reshape(-1), weights=np.concatenate(score_parts)).astype("float32")
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return unique[best], scores[best]
+
+    def _score_terms(self, terms):
+        # Called with the lock held. The numpy views over the posting arrays must not
+        # outlive it: an array.array cannot grow while a buffer export exists, so every
+        # view dies with this frame and only fresh arrays are returned.
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        avgdl = self.total_length / self.num_docs
+        ids_parts, score_parts = [], []
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids = np.frombuffer(posting[0], dtype=np.int64)
+            tf = np.frombuffer(posting[1], dtype=np.uint32).astype("float32")
+            dl = lengths[ids].astype("float32")
+            live = dl > 0
+            df = int(live.sum())
+            if not df:
+                continue
+            idf = math.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            score = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+            ids_parts.append(ids[live])
+            score_parts.append(score[live])
+        return ids_parts, score_parts
+
+    def clear(self):
+        with self._lock:
+            self.postings = {}
+            self.lengths = array("I")
+            self.num_docs = 0
+            self.total_length = 0
+            self.deleted = set()
+
+    def memory_bytes(self):
+        # Payload of the posting arrays plus the dictionary and per-term overhead.
+        with self._lock:
+            size = sys.getsizeof(self.postings) + self.lengths.buffer_info()[1] * self.lengths.itemsize
+            for term, (ids, tfs) in self.postings.items():
+                size += sys.getsizeof(term) + sys.getsizeof(ids) + sys.getsizeof(tfs) + 56
+            return size
+
+    def get_stats(self):
+        return {
+            "ready": self.ready,
+            "chunks": self.num_docs,
+            "terms": len(self.postings),
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    # rankings: lists of keys, best first. Returns [(key, score)], best first.
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
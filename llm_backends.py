@@ -0,0 +1,122 @@
+# llm_backends.py
+import asyncio
+import os
+import time
+
+DEFAULT_OPENAI_MODEL = "gpt-3.5-turbo"
+
+
+class LLMBackend:
+    # stream() yields text deltas as the model produces them; complete() is the
+    # blocking call built on top of it.
+    name = "base"
+
+    def __init__(self, model_name=DEFAULT_OPENAI_MODEL):
+        self.model_name = model_name
+
+    def stream(self, messages, temperature=0.7, max_tokens=500):
+        raise NotImplementedError
+
+    def complete(self, messages, temperature=0.7, max_tokens=500):
+        return "".join(self.stream(messages, temperature=temperature, max_tokens=max_tokens))
+
+    async def astream(self, messages, temperature=0.7, max_tokens=500):
+        # Drives the blocking stream() on a worker thread, one delta at a time.
+        loop = asyncio.get_running_loop()
+        deltas = self.stream(messages, temperature=temperature, max_tokens=max_tokens)
+        done = object()
+        while True:
+            delta = await loop.run_in_executor(None, next, deltas, done)
+            if delta is done:
+                break
+            yield delta
+
+
+class OpenAIBackend(LLMBackend):
+    # Also serves local OpenAI-compatible servers (vLLM, llama.cpp, Ollama, ...)
+    # through base_url.
+    name = "openai"
+
+    def __init__(self, model_name=DEFAULT_OPENAI_MODEL, base_url=None, api_key=None):
+        super().__init__(model_name)
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import openai
+            api_key = self.api_key if self.api_key is not None else os.environ.get("OPENAI_API_KEY", "")
+            # Local servers usually ignore the key, but the client insists on one.
+            if self.base_url and not api_key:
+                api_key = "local"
+            self._client = openai.OpenAI(api_key=api_key, base_url=self.base_url)
+        return self._client
+
+    def stream(self, messages, temperature=0.7, max_tokens=500):
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class FakeLLMBackend(LLMBackend):
+    # Deterministic offline stand-in: answers with words from the prompt at a fixed
+    # time-to-first-token and token rate, so streaming can be measured without a model.
+    # With prefill_tokens_per_s, the first token also waits for the prompt to be "read"
+    # (about 4 characters per token), so prompt size shows up in latency as it would.
+    name = "fake"
+
+    def __init__(self, model_name="fake", first_token_s=0.3, tokens_per_s=50.0, prefill_tokens_per_s=0.0):
+        super().__init__(model_name)
+        self.first_token_s = first_token_s
+        self.tokens_per_s = tokens_per_s
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+
+    def _first_token_delay(self, messages):
+        if not self.prefill_tokens_per_s:
+            return self.first_token_s
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        return self.first_token_s + prompt_chars / 4 / self.prefill_tokens_per_s
+
+    def _tokens(self, messages, max_tokens):
+        words = messages[-1]["content"].split() if messages else []
+        words = words or ["ok"]
+        return [words[i % len(words)] + " " for i in range(max_tokens)]
+
+    def stream(self, messages, temperature=0.7, max_tokens=500):
+        time.sleep(self._first_token_delay(messages))
+        interval = 1.0 / self.tokens_per_s if self.tokens_per_s else 0.0
+        for i, token in enumerate(self._tokens(messages, max_tokens)):
+            if i and interval:
+                time.sleep(interval)
+            yield token
+
+    async def astream(self, messages, temperature=0.7, max_tokens=500):
+        await asyncio.sleep(self._first_token_delay(messages))
+        interval = 1.0 / self.tokens_per_s if self.tokens_per_s else 0.0
+        for i, token in enumerate(self._tokens(messages, max_tokens)):
+            if i and interval:
+                await asyncio.sleep(interval)
+            yield token
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "fake": FakeLLMBackend,
+}
+
+
+def get_backend(backend="openai", **kwargs):
+    if isinstance(backend, LLMBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](**kwargs)
@@ -1,89 +1,154 @@
 # mcp.py
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional
+
+# Version tag of the binary encoding produced by MCPMessage.to_bytes.
+SCHEMA_VERSION = 1
+ERROR_TYPES = ("ERROR", "CREATION_ERROR", "CONVERSION_ERROR")
+
+
+_second_cache = (None, "")
+
+
+def _format_timestamp(created: float) -> str:
+    # Same format as datetime.utcnow().isoformat() + "Z"; the date/time prefix is
+    # cached per second since consecutive messages almost always share it.
+    global _second_cache
+    second = int(created)
+    cached_second, prefix = _second_cache
+    if second != cached_second:
+        prefix = datetime.fromtimestamp(second, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        _second_cache = (second, prefix)
+    return "%s.%06dZ" % (prefix, int((created - second) * 1e6))
+
+
+def _msgpack_default(obj):
+    # Payloads carry numpy scalars/arrays (e.g. FAISS distances).
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Cannot serialize object of type {type(obj).__name__}")
+
+
 class MCPMessage:
+    # Messages are created on every hop of every query, so construction only stores
+    # references: the trace id and ISO timestamp are formatted on first access and
+    # nothing is printed.
+    __slots__ = ("sender", "receiver", "msg_type", "payload", "_trace_id", "_created", "_timestamp")
+
     def __init__(self, sender: str, receiver: str, msg_type: str, payload: Dict[str, Any], trace_id: Optional[str] = None):
-        try:
-            if not isinstance(sender, str) or not sender.strip():
-                raise ValueError("sender must be a non-empty string")            
-            if not isinstance(receiver, str) or not receiver.strip():
-                raise ValueError("receiver must be a non-empty string")            
-            if not isinstance(msg_type, str) or not msg_type.strip():
-                raise ValueError("msg_type must be a non-empty string")            
-            if not isinstance(payload, dict):
-                raise ValueError("payload must be a dictionary")            
-            self.message = {
-                "sender": sender.strip(),
-                "receiver": receiver.strip(),
-                "type": msg_type.strip(),
-                "trace_id": trace_id or str(uuid.uuid4()),
-                "payload": payload,
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            }            
-            self.sender = self.message["sender"]
-            self.receiver = self.message["receiver"]
-            self.msg_type = self.message["type"]
-            self.trace_id = self.message["trace_id"]
-            self.payload = self.message["payload"]
-            self.timestamp = self.message["timestamp"]            
-            print(f"MCPMessage created successfully: {self.sender} -> {self.receiver} [{self.msg_type}]")
-        except Exception as e:
-            print(f"Error creating MCPMessage: {str(e)}")
-            self.message = {
-                "sender": "SYSTEM",
-                "receiver": "ERROR_HANDLER",
-                "type": "CREATION_ERROR",
-                "trace_id": str(uuid.uuid4()),
-                "payload": {"error": str(e), "original_params": locals()},
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            }
-            self.sender = self.message["sender"]
-            self.receiver = self.message["receiver"]
-            self.msg_type = self.message["type"]
-            self.trace_id = self.message["trace_id"]
-            self.payload = self.message["payload"]
-            self.timestamp = self.message["timestamp"]    
+        self._trace_id = trace_id or None
+        self._created = time.time()
+        self._timestamp = None
+        if (isinstance(sender, str) and sender and isinstance(receiver, str) and receiver
+                and isinstance(msg_type, str) and msg_type and isinstance(payload, dict)):
+            self.sender = sender.strip()
+            self.receiver = receiver.strip()
+            self.msg_type = msg_type.strip()
+            self.payload = payload
+            if self.sender and self.receiver and self.msg_type:
+                return
+        self._set_creation_error(sender, receiver, msg_type, payload)
+
+    def _set_creation_error(self, sender, receiver, msg_type, payload):
+        if not isinstance(sender, str) or not sender.strip():
+            error = "sender must be a non-empty string"
+        elif not isinstance(receiver, str) or not receiver.strip():
+            error = "receiver must be a non-empty string"
+        elif not isinstance(msg_type, str) or not msg_type.strip():
+            error = "msg_type must be a non-empty string"
+        else:
+            error = "payload must be a dictionary"
+        self.sender = "SYSTEM"
+        self.receiver = "ERROR_HANDLER"
+        self.msg_type = "CREATION_ERROR"
+        self._trace_id = None
+        self.payload = {
+            "error": error,
+            "original_params": {"sender": sender, "receiver": receiver, "msg_type": msg_type,
+                                "payload_type": type(payload).__name__},
+        }
+
+    @property
+    def trace_id(self) -> str:
+        if self._trace_id is None:
+            self._trace_id = str(uuid.uuid4())
+        return self._trace_id
+
+    @property
+    def timestamp(self) -> str:
+        if self._timestamp is None:
+            self._timestamp = _format_timestamp(self._created)
+        return self._timestamp
+
+    @property
+    def message(self) -> Dict[str, Any]:
+        return self.to_dict()
+
     def to_dict(self) -> Dict[str, Any]:
-        try:
-            print(f"Converting MCPMessage to dict: {self.msg_type}")
-            return self.message.copy()  
-        except Exception as e:
-            print(f"Error converting MCPMessage to dict: {str(e)}")
-            return {
-                "sender": "SYSTEM",
-                "receiver": "ERROR_HANDLER",
-                "type": "CONVERSION_ERROR",
-                "trace_id": str(uuid.uuid4()),
-                "payload": {"error": str(e)},
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            }
+        return {
+            "sender": self.sender,
+            "receiver": self.receiver,
+            "type": self.msg_type,
+            "trace_id": self.trace_id,
+            "payload": self.payload,
+            "timestamp": self.timestamp,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MCPMessage":
+        msg = cls(data.get("sender"), data.get("receiver"), data.get("type"), data.get("payload"),
+                  trace_id=data.get("trace_id"))
+        if data.get("timestamp") and msg.msg_type != "CREATION_ERROR":
+            msg._timestamp = data["timestamp"]
+        return msg
+
+    def to_bytes(self) -> bytes:
+        # Compact msgpack array for handing messages between processes:
+        # [schema_version, sender, receiver, type, trace_id, created_epoch, payload]
+        import msgpack
+        return msgpack.packb(
+            [SCHEMA_VERSION, self.sender, self.receiver, self.msg_type, self.trace_id, self._created, self.payload],
+            default=_msgpack_default,
+            use_bin_type=True,
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "MCPMessage":
+        import msgpack
+        fields = msgpack.unpackb(data, raw=False)
+        if not fields or fields[0] != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported MCPMessage schema version: {fields[0] if fields else None}")
+        _, sender, receiver, msg_type, trace_id, created, payload = fields
+        msg = cls(sender, receiver, msg_type, payload, trace_id=trace_id)
+        msg._created = created
+        return msg
+
     def is_valid(self) -> bool:
-        try:
-            required_fields = ["sender", "receiver", "type", "trace_id", "payload", "timestamp"]
-            return all(field in self.message for field in required_fields)
-        except:
-            return False    
+        return bool(self.sender and self.receiver and self.msg_type) and isinstance(self.payload, dict)
+
     def is_error_message(self) -> bool:
-        return self.msg_type in ["ERROR", "CREATION_ERROR", "CONVERSION_ERROR"]    
+        return self.msg_type in ERROR_TYPES
+
     def get_summary(self) -> str:
         try:
             payload_size = len(str(self.payload))
             return f"{self.sender} -> {self.receiver} [{self.msg_type}] (payload: {payload_size} chars, trace: {self.trace_id[:8]}...)"
         except:
-            return f"Invalid message: {self.message}"    
+            return f"Invalid message: {self.sender} -> {self.receiver} [{self.msg_type}]"
+
     def add_metadata(self, key: str, value: Any) -> None:
-        try:
-            if "metadata" not in self.payload:
-                self.payload["metadata"] = {}
-            self.payload["metadata"][key] = value
-            print(f"Added metadata {key} to message")
-        except Exception as e:
-            print(f"Error adding metadata: {str(e)}")    
+        self.payload.setdefault("metadata", {})[key] = value
+
     def __str__(self) -> str:
-        return self.get_summary()    
+        return self.get_summary()
+
     def __repr__(self) -> str:
-        return f"MCPMessage({self.get_summary()})"    
+        return f"MCPMessage({self.get_summary()})"
+
     @classmethod
     def create_error_message(cls, error: Exception, sender: str = "SYSTEM", receiver: str = "ERROR_HANDLER", trace_id: Optional[str] = None):
         return cls(
@@ -96,7 +161,8 @@ class MCPMessage:
                 "severity": "ERROR"
             },
             trace_id=trace_id
-        )    
+        )
+
     @classmethod
     def create_success_message(cls, sender: str, receiver: str, data: Dict[str, Any], trace_id: Optional[str] = None):
         return cls(
@@ -108,4 +174,4 @@ class MCPMessage:
                 "data": data
             },
             trace_id=trace_id
-        )
\ No newline at end of file
+        )
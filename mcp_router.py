@@ -0,0 +1,302 @@
+# mcp_router.py
+import asyncio
+import inspect
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mcp import MCPMessage
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_QUEUE_SIZE = 256
+REPLY_QUEUE_SIZE = 64
+
+
+class _Route:
+    def __init__(self, name, handler, concurrency, timeout, queue_size):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(int(concurrency), 1)
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.is_async = inspect.iscoroutinefunction(handler) or inspect.isasyncgenfunction(handler)
+        self.inbox = None
+        self.workers = []
+        self.stats = {"processed": 0, "errors": 0, "timeouts": 0, "in_flight": 0}
+
+
+class MCPRouter:
+    # Agents register under the name other agents use as `receiver`. Every agent gets a
+    # bounded inbox drained by `concurrency` workers, so a slow LLM call only occupies
+    # one LLM worker while retrieval for other queries keeps flowing. Messages addressed
+    # to a name that is not registered (e.g. "UI") are replies: they go to the queue of
+    # the request waiting on that trace_id.
+    def __init__(self, reply_queue_size=REPLY_QUEUE_SIZE):
+        self.routes = {}
+        self.reply_queue_size = reply_queue_size
+        self._replies = {}
+        self._executor = None
+        self._loop = None
+        self._thread = None
+        self._started = False
+
+    def register(self, name, handler, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        # handler takes a message dict and returns an MCPMessage, a message dict or None,
+        # or is a (async) generator of messages, each routed as soon as it is yielded.
+        # Coroutine functions run on the loop; plain callables run on a thread pool.
+        if self._started:
+            raise RuntimeError("Agents must be registered before the router is started")
+        if not callable(handler):
+            raise ValueError(f"Handler for {name} must be callable")
+        self.routes[name] = _Route(name, handler, concurrency, timeout, queue_size)
+
+    async def start(self):
+        if self._started:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(sum(r.concurrency for r in self.routes.values() if not r.is_async), 1),
+            thread_name_prefix="mcp-agent",
+        )
+        for route in self.routes.values():
+            route.inbox = asyncio.Queue(maxsize=route.queue_size)
+            route.workers = [asyncio.create_task(self._worker(route)) for _ in range(route.concurrency)]
+        self._started = True
+
+    async def stop(self):
+        workers = {w for route in self.routes.values() for w in route.workers}
+        while workers:
+            # wait_for() can swallow a cancellation that races with its inner future
+            # completing, so keep cancelling until every worker has really exited.
+            for worker in workers:
+                worker.cancel()
+            _, workers = await asyncio.wait(workers, timeout=0.1)
+        for route in self.routes.values():
+            route.workers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._started = False
+
+    async def _worker(self, route):
+        while True:
+            msg = await route.inbox.get()
+            try:
+                result = await self._handle(route, msg)
+                if inspect.isasyncgen(result) or inspect.isgenerator(result):
+                    await self._drain(route, msg, result)
+                elif result is not None:
+                    await self.dispatch(result)
+            except Exception as e:
+                print(f"Router error in {route.name}: {str(e)}")
+            finally:
+                route.inbox.task_done()
+
+    async def _handle(self, route, msg):
+        route.stats["in_flight"] += 1
+        try:
+            if inspect.isasyncgenfunction(route.handler):
+                return route.handler(msg)
+            if route.is_async:
+                call = route.handler(msg)
+            else:
+                call = self._loop.run_in_executor(self._executor, route.handler, msg)
+            result = await asyncio.wait_for(call, route.timeout)
+            if not inspect.isgenerator(result):
+                route.stats["processed"] += 1
+            return result
+        except asyncio.TimeoutError:
+            # A sync handler keeps running in its thread; only the caller stops waiting.
+            route.stats["timeouts"] += 1
+            error = TimeoutError(f"{route.name} did not respond within {route.timeout}s")
+        except Exception as e:
+            route.stats["errors"] += 1
+            error = e
+        finally:
+            route.stats["in_flight"] -= 1
+        self._fail(route, msg, error)
+        return None
+
+    def _fail(self, route, msg, error):
+        # Errors end the trace: they go straight back to whoever is waiting on it.
+        self._deliver(MCPMessage.create_error_message(
+            error, sender=route.name, receiver=msg.get("sender") or "UI", trace_id=msg.get("trace_id")
+        ).to_dict(), force=True)
+
+    async def _drain(self, route, msg, messages):
+        # For streaming handlers the timeout bounds the wait for each next message,
+        # not the whole stream.
+        route.stats["in_flight"] += 1
+        done = object()
+        try:
+            while True:
+                if inspect.isasyncgen(messages):
+                    step = messages.__anext__()
+                else:
+                    step = self._loop.run_in_executor(self._executor, next, messages, done)
+                try:
+                    item = await asyncio.wait_for(step, route.timeout)
+                except StopAsyncIteration:
+                    break
+                if item is done:
+                    break
+                await self.dispatch(item)
+            route.stats["processed"] += 1
+        except asyncio.TimeoutError:
+            route.stats["timeouts"] += 1
+            self._fail(route, msg, TimeoutError(f"{route.name} stalled for more than {route.timeout}s"))
+        except Exception as e:
+            route.stats["errors"] += 1
+            self._fail(route, msg, e)
+        finally:
+            route.stats["in_flight"] -= 1
+
+    @staticmethod
+    def _as_dict(msg):
+        if isinstance(msg, MCPMessage):
+            return msg.to_dict()
+        if not isinstance(msg, dict):
+            raise ValueError("Messages must be MCPMessage instances or dictionaries")
+        return msg
+
+    async def dispatch(self, msg):
+        msg = self._as_dict(msg)
+        route = self.routes.get(msg.get("receiver"))
+        if route is not None:
+            # Bounded inbox: a full downstream agent applies backpressure to its senders.
+            await route.inbox.put(msg)
+        else:
+            await self._deliver_async(msg)
+
+    def _deliver(self, msg, force=False):
+        replies = self._replies.get(msg.get("trace_id"))
+        if replies is None:
+            print(f"Dropping undeliverable message for trace {msg.get('trace_id')} ({msg.get('type')})")
+            return
+        if force and replies.full():
+            replies.get_nowait()
+        replies.put_nowait(msg)
+
+    async def _deliver_async(self, msg):
+        trace_id = msg.get("trace_id")
+        replies = self._replies.get(trace_id)
+        if replies is None:
+            self._deliver(msg)
+            return
+        # Waits while the caller is slow to read, but gives up once it has gone away.
+        while self._replies.get(trace_id) is replies:
+            try:
+                await asyncio.wait_for(replies.put(msg), 1.0)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    def _open_trace(self, msg):
+        msg = self._as_dict(msg)
+        if not msg.get("trace_id"):
+            msg = dict(msg, trace_id=MCPMessage("UI", "UI", "TRACE", {}).trace_id)
+        if msg["trace_id"] in self._replies:
+            raise ValueError(f"A request with trace_id {msg['trace_id']} is already in flight")
+        self._replies[msg["trace_id"]] = asyncio.Queue(maxsize=self.reply_queue_size)
+        return msg
+
+    async def request(self, msg, timeout=None):
+        # Sends msg into the pipeline and returns the reply that leaves it for this trace.
+        if not self._started:
+            await self.start()
+        msg = self._open_trace(msg)
+        try:
+            await self.dispatch(msg)
+            return await asyncio.wait_for(self._replies[msg["trace_id"]].get(), timeout)
+        finally:
+            self._replies.pop(msg["trace_id"], None)
+
+    @staticmethod
+    def is_final(msg):
+        # Streaming agents mark partial replies with payload["done"] = False.
+        payload = msg.get("payload")
+        return not isinstance(payload, dict) or payload.get("done", True) is not False
+
+    async def stream(self, msg, timeout=None):
+        # Yields every reply for this trace until the final one; timeout applies per reply.
+        if not self._started:
+            await self.start()
+        msg = self._open_trace(msg)
+        replies = self._replies[msg["trace_id"]]
+        try:
+            await self.dispatch(msg)
+            while True:
+                reply = await asyncio.wait_for(replies.get(), timeout)
+                yield reply
+                if self.is_final(reply):
+                    break
+        finally:
+            self._replies.pop(msg["trace_id"], None)
+
+    def start_background(self):
+        # Runs the router on its own event loop thread for synchronous callers (Streamlit).
+        if self._thread is not None:
+            return self
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="mcp-router", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def submit(self, msg, timeout=None):
+        # Thread-safe entry point; returns a concurrent.futures.Future of the reply.
+        if self._thread is None:
+            raise RuntimeError("Router is not running in the background; call start_background() first")
+        return asyncio.run_coroutine_threadsafe(self.request(msg, timeout=timeout), self._loop)
+
+    def stream_sync(self, msg, timeout=None):
+        # Blocking iterator over stream() for synchronous callers.
+        if self._thread is None:
+            raise RuntimeError("Router is not running in the background; call start_background() first")
+        replies = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for reply in self.stream(msg, timeout=timeout):
+                    replies.put(reply)
+            except Exception as e:
+                replies.put(e)
+            finally:
+                replies.put(done)
+
+        asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        while True:
+            item = replies.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def shutdown(self):
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def get_stats(self):
+        return {
+            "agents": {
+                name: dict(route.stats, queued=route.inbox.qsize() if route.inbox is not None else 0)
+                for name, route in self.routes.items()
+            },
+            "pending_traces": len(self._replies),
+        }
@@ -0,0 +1,305 @@
+# persistence.py
+import json
+import os
+import pickle
+import shutil
+import struct
+import time
+
+import faiss
+import numpy as np
+
+from chunk_store import ChunkStore
+from chunk_table import ChunkTable
+from index_backends import read_index_mmap
+
+# On-disk layout under persist_path:
+#   MANIFEST                 -> {"base": "base-000003", "generation": 3, "segment_upto": 7, "meta": {...}}
+#   base-000003/index.faiss  -> compacted snapshot of every segment <= 7
+#   base-000003/vectors.npy  -> raw float32 vectors, kept for (re)training the index
+#   base-000003/chunks.bin + chunk_offsets.npy -> see chunk_store.py (older bases: chunks.pkl)
+#   base-000003/chunk_ids.npy, chunk_docs.npy, documents.json -> see chunk_table.py
+#   segments/seg-000008.bin  -> append-only records written after the snapshot
+#   quarantine/              -> unreadable segments and those after them, set aside on load
+# A segment adds vectors with their chunks, chunk ids and document ids, and/or deletes
+# chunk ids; an upsert is a single segment doing both. Version 1 segments carry only
+# vectors and chunks; their chunks get the next ids in order.
+SEGMENT_MAGIC = b"VSEG"
+SEGMENT_VERSION = 2
+SEGMENT_HEADER = struct.Struct("<4sIII")
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_index(path, index):
+    # Straight from the index to disk, without a serialized copy of it in memory.
+    faiss.write_index(index, path)
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _atomic_write_bytes(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SegmentLog:
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "MANIFEST")
+        self.segments_dir = os.path.join(root, "segments")
+        self.quarantine_dir = os.path.join(root, "quarantine")
+        # Pre-segment layout, still read so existing stores keep working.
+        self.legacy_index_path = os.path.join(root, "faiss_index")
+        self.legacy_chunks_path = os.path.join(root, "chunks.pkl")
+        self.base_name = None
+        self.segment_upto = 0
+        self.next_segment = 1
+        self.generation = 0
+        self.meta = {}
+
+    def _segment_path(self, seq):
+        return os.path.join(self.segments_dir, f"seg-{seq:06d}.bin")
+
+    def _list_segments(self):
+        if not os.path.isdir(self.segments_dir):
+            return []
+        seqs = []
+        for name in os.listdir(self.segments_dir):
+            if name.startswith("seg-") and name.endswith(".bin"):
+                try:
+                    seqs.append(int(name[4:-4]))
+                except ValueError:
+                    continue
+        return sorted(seqs)
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def pending_segments(self):
+        return [seq for seq in self._list_segments() if seq > self.segment_upto]
+
+    def base_dir(self):
+        return os.path.join(self.root, self.base_name) if self.base_name else None
+
+    def open_table(self, base_len):
+        return ChunkTable.open(self.base_dir(), base_len, next_id=self.meta.get("next_chunk_id"))
+
+    def open_base(self, use_mmap=True):
+        # Returns the base index and chunks; with use_mmap both are mapped read-only
+        # so processes opening the same store share pages through the OS cache.
+        base_dir = self.base_dir()
+        if base_dir:
+            index_path = os.path.join(base_dir, "index.faiss")
+            if use_mmap:
+                index = read_index_mmap(index_path, self.meta.get("index_type"))
+            else:
+                index = faiss.read_index(index_path)
+            if ChunkStore.exists(base_dir):
+                chunks = ChunkStore(base_dir)
+            else:
+                with open(os.path.join(base_dir, "chunks.pkl"), "rb") as f:
+                    chunks = pickle.load(f)
+            return index, chunks
+        if os.path.exists(self.legacy_index_path) and os.path.exists(self.legacy_chunks_path):
+            index = faiss.read_index(self.legacy_index_path)
+            with open(self.legacy_chunks_path, "rb") as f:
+                chunks = pickle.load(f)
+            return index, chunks
+        return None, []
+
+    def load(self, use_mmap=True):
+        os.makedirs(self.segments_dir, exist_ok=True)
+        manifest = self._read_manifest()
+        if manifest:
+            self.base_name = manifest.get("base")
+            self.segment_upto = manifest.get("segment_upto", 0)
+            self.generation = manifest.get("generation", 0)
+            self.meta = manifest.get("meta", {})
+        index, chunks = self.open_base(use_mmap)
+
+        segments = []
+        pending = self.pending_segments()
+        self.next_segment = (max(pending) if pending else self.segment_upto) + 1
+        for i, seq in enumerate(pending):
+            try:
+                vectors, seg_chunks, record = self._read_segment(seq)
+            except Exception as e:
+                # Replay stops at the first unreadable segment: later ones may delete or
+                # replace chunks it added. All of them are moved out of the log and new
+                # segments are numbered from here, so they are neither replayed again nor
+                # read by compaction.
+                print(f"Stopping segment replay at {seq}: {str(e)}")
+                self._quarantine(pending[i:])
+                self.next_segment = seq
+                break
+            segments.append((seq, vectors, seg_chunks, record))
+        return index, chunks, segments
+
+    def _quarantine(self, seqs):
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for seq in seqs:
+            target = os.path.join(self.quarantine_dir, f"seg-{seq:06d}.bin.{stamp}")
+            try:
+                os.replace(self._segment_path(seq), target)
+                print(f"Quarantined segment {seq} to {target}")
+            except OSError as e:
+                print(f"Error quarantining segment {seq}: {str(e)}")
+        _fsync_dir(self.segments_dir)
+
+    def _live_segments(self, after, upto=None):
+        # Segments in (after, upto] that this log replayed or appended; a file with a
+        # later number is not part of the store.
+        last = self.next_segment - 1 if upto is None else min(upto, self.next_segment - 1)
+        return [seq for seq in self._list_segments() if after < seq <= last]
+
+    def _read_segment(self, seq):
+        with open(self._segment_path(seq), "rb") as f:
+            data = f.read()
+        magic, version, n, dim = SEGMENT_HEADER.unpack_from(data, 0)
+        if magic != SEGMENT_MAGIC or version not in (1, SEGMENT_VERSION):
+            raise ValueError(f"bad segment header in seg-{seq:06d}")
+        offset = SEGMENT_HEADER.size
+        vec_bytes = n * dim * 4
+        vectors = np.frombuffer(data, dtype="float32", count=n * dim, offset=offset).reshape(n, dim)
+        record = pickle.loads(data[offset + vec_bytes:])
+        if version == 1:
+            record = {"chunks": record, "ids": None, "doc_ids": None, "deleted": []}
+        chunks = record["chunks"]
+        if len(chunks) != n:
+            raise ValueError(f"segment seg-{seq:06d} has {n} vectors but {len(chunks)} chunks")
+        return vectors, chunks, record
+
+    def base_vectors(self, reconstruct=True):
+        if self.base_name:
+            base_dir = os.path.join(self.root, self.base_name)
+            vectors_path = os.path.join(base_dir, "vectors.npy")
+            if os.path.exists(vectors_path):
+                return np.load(vectors_path, mmap_mode="r")
+            index_path = os.path.join(base_dir, "index.faiss")
+        elif os.path.exists(self.legacy_index_path):
+            index_path = self.legacy_index_path
+        else:
+            return None
+        if not reconstruct:
+            return None
+        # Snapshots written before vectors.npy existed were always IndexFlatL2.
+        index = faiss.read_index(index_path)
+        return index.reconstruct_n(0, index.ntotal)
+
+    def _write_vectors(self, path, upto, keep=None):
+        base = self.base_vectors()
+        seqs = self._live_segments(self.segment_upto, upto)
+        segments = [self._read_segment(seq)[0] for seq in seqs]
+        segments = [v for v in segments if len(v)]
+        dims = [v.shape[1] for v in segments] + ([base.shape[1]] if base is not None and len(base) else [])
+        if not dims:
+            np.save(path, np.zeros((0, 0), dtype="float32"))
+            return
+        parts = ([base] if base is not None else []) + segments
+        total = sum(len(v) for v in parts) if keep is None else int(keep.sum())
+        out = np.lib.format.open_memmap(path, mode="w+", dtype="float32", shape=(total, dims[0]))
+        offset = 0
+        row = 0
+        for part in parts:
+            if keep is not None:
+                rows = np.flatnonzero(keep[row:row + len(part)])
+                row += len(part)
+                if len(rows) != len(part):
+                    out[offset:offset + len(rows)] = part[rows]
+                    offset += len(rows)
+                    continue
+            out[offset:offset + len(part)] = part
+            offset += len(part)
+        out.flush()
+        del out
+
+    def append(self, vectors, chunks, ids=None, doc_ids=None, deleted=None):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        n, dim = vectors.shape
+        record = {
+            "chunks": list(chunks),
+            "ids": [int(i) for i in ids] if ids is not None else None,
+            "doc_ids": list(doc_ids) if doc_ids is not None else None,
+            "deleted": [int(i) for i in deleted or []],
+        }
+        payload = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, n, dim)
+        payload += vectors.tobytes() + pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(self.segments_dir, exist_ok=True)
+        seq = self.next_segment
+        _atomic_write_bytes(self._segment_path(seq), payload)
+        _fsync_dir(self.segments_dir)
+        self.next_segment = seq + 1
+        return seq
+
+    def compact(self, index, chunk_parts, upto, meta=None, table=None, tail_len=None, keep=None):
+        # Write the new snapshot beside the old one, then flip MANIFEST; a crash at any
+        # point leaves either the old base + its segments or the new base fully intact.
+        # keep (a boolean mask over all rows up to upto) drops deleted rows.
+        generation = self.generation + 1
+        base_name = f"base-{generation:06d}"
+        base_dir = os.path.join(self.root, base_name)
+        tmp_dir = base_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        _write_index(os.path.join(tmp_dir, "index.faiss"), index)
+        self._write_vectors(os.path.join(tmp_dir, "vectors.npy"), upto, keep=keep)
+        ChunkStore.write(tmp_dir, chunk_parts, keep=keep)
+        if table is not None:
+            table.write(tmp_dir, tail_len, keep=keep)
+        shutil.rmtree(base_dir, ignore_errors=True)
+        os.replace(tmp_dir, base_dir)
+        _fsync_dir(self.root)
+
+        if meta is not None:
+            self.meta = dict(meta)
+        manifest = {"base": base_name, "generation": generation, "segment_upto": upto, "meta": self.meta}
+        _atomic_write_bytes(self.manifest_path, json.dumps(manifest).encode("utf-8"))
+        _fsync_dir(self.root)
+
+        old_base = self.base_name
+        self.base_name = base_name
+        self.generation = generation
+        self.segment_upto = upto
+        self._remove_obsolete(old_base)
+
+    def _remove_obsolete(self, old_base):
+        for seq in self._list_segments():
+            if seq <= self.segment_upto:
+                try:
+                    os.remove(self._segment_path(seq))
+                except OSError:
+                    pass
+        if old_base and old_base != self.base_name:
+            shutil.rmtree(os.path.join(self.root, old_base), ignore_errors=True)
+        for path in (self.legacy_index_path, self.legacy_chunks_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        self.base_name = None
+        self.segment_upto = 0
+        self.next_segment = 1
+        self.generation = 0
+        self.meta = {}
@@ -0,0 +1,403 @@
+# sharded_store.py
+import heapq
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embeddings import get_backend
+from tracing import span
+from vector_store import VectorStore
+
+DEFAULT_COLLECTION = "default"
+# Chunk ids are per shard; results carry (shard << SHARD_ID_SHIFT) | local id so ids are
+# unique in a collection and consecutive chunks of a document stay consecutive.
+SHARD_ID_SHIFT = 40
+COLLECTION_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+SHARDS_FILE = "SHARDS.json"
+
+
+def shard_of(key, num_shards):
+    # Stable across processes and restarts (unlike hash()); a document always lands
+    # on the same shard, so deletes and upserts touch exactly one shard.
+    return zlib.crc32(str(key).encode("utf-8")) % num_shards
+
+
+def global_chunk_id(shard, chunk_id):
+    return (shard << SHARD_ID_SHIFT) | int(chunk_id)
+
+
+def merge_shard_results(per_shard, top_k):
+    # Every shard returns its own top-k; a heap over their union keeps the global
+    # top-k. Fused (hybrid/lexical) results carry a score, higher is better; dense
+    # results a distance, lower is better. (A shard whose lexical index is still
+    # building answers dense, so the lists are not assumed to share one order.)
+    results = [r for shard_results in per_shard for r in shard_results]
+    if results and all(r.get('score') is not None for r in results):
+        return heapq.nsmallest(top_k, results, key=lambda r: -r['score'])
+    return heapq.nsmallest(top_k, results, key=lambda r: np.inf if r.get('distance') is None else r['distance'])
+
+
+class LocalShard:
+    # A VectorStore in this process. FAISS releases the GIL while it searches, so
+    # shards searched from different threads run in parallel.
+    def __init__(self, index, store_kwargs):
+        self.index = index
+        self.store = VectorStore(**store_kwargs)
+
+    def call(self, method, *args, **kwargs):
+        target = getattr(self.store, method)
+        return target(*args, **kwargs) if callable(target) else target
+
+    def close(self):
+        self.store.wait_for_maintenance()
+
+
+def _shard_worker(conn, store_kwargs):
+    # Serves one VectorStore in its own process; requests are (method, args, kwargs).
+    store = VectorStore(**store_kwargs)
+    conn.send((True, None))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        method, args, kwargs = request
+        try:
+            target = getattr(store, method)
+            conn.send((True, target(*args, **kwargs) if callable(target) else target))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {str(e)}"))
+    store.wait_for_maintenance()
+    conn.close()
+
+
+class ProcessShard:
+    # A VectorStore in a worker process, for corpora that should use more than one
+    # core for search and ingestion. The worker loads its own embedding model when it
+    # has chunks to embed; queries arrive already encoded. Calls to one shard are
+    # serialized over its pipe.
+    def __init__(self, index, store_kwargs):
+        self.index = index
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_shard_worker, args=(child, store_kwargs), daemon=True,
+                                        name=f"vector-store-shard-{index}")
+        self._process.start()
+        child.close()
+        self._lock = threading.Lock()
+        self._receive()
+
+    def _receive(self):
+        ok, value = self._conn.recv()
+        if not ok:
+            raise RuntimeError(f"shard {self.index}: {value}")
+        return value
+
+    def call(self, method, *args, **kwargs):
+        with self._lock:
+            self._conn.send((method, args, kwargs))
+            return self._receive()
+
+    def close(self):
+        with self._lock:
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self._process.join(30)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+class ShardedCollection:
+    # One named collection: num_shards VectorStores under persist_path/shard-NN, with
+    # the VectorStore methods the agents use. Writes are routed by document id (by
+    # chunk text when there is none); searches fan out to every shard in parallel.
+    def __init__(self, name, persist_path, num_shards, executor, model, processes=False, **store_kwargs):
+        self.name = name
+        self.persist_path = persist_path
+        self.model = model
+        self.retrieval_mode = store_kwargs.get("retrieval_mode", "dense")
+        self._executor = executor
+        os.makedirs(persist_path, exist_ok=True)
+        # The shard count is fixed when the collection is created: routing depends on it.
+        shards_file = os.path.join(persist_path, SHARDS_FILE)
+        if os.path.exists(shards_file):
+            with open(shards_file) as f:
+                recorded = json.load(f)["num_shards"]
+            if recorded != num_shards:
+                print(f"Collection {name} has {recorded} shards; ignoring num_shards={num_shards}")
+            num_shards = recorded
+        else:
+            with open(shards_file, "w") as f:
+                json.dump({"num_shards": num_shards}, f)
+        self.num_shards = num_shards
+        # An encoding engine is shared by in-process shards; worker processes each get a
+        # copy that starts its own encoder pool. Enough chunks per add that every
+        # shard's share still fills a window.
+        engine = store_kwargs.get("encoding_engine")
+        self.ingest_batch_size = engine.window * num_shards if engine is not None else 64
+        shard_class = ProcessShard if processes else LocalShard
+        # In-process shards share this process's model; worker processes get the spec.
+        backend = store_kwargs.pop("embedding_backend", model) if processes else model
+        kwargs = []
+        for i in range(num_shards):
+            shard_path = os.path.join(persist_path, f"shard-{i:02d}")
+            kwargs.append(dict(store_kwargs, persist_path=os.path.join(shard_path, "index"),
+                               cache_path=os.path.join(shard_path, "embedding_cache"), embedding_backend=backend))
+        self.shards = self._map(lambda i: shard_class(i, kwargs[i]), range(num_shards))
+
+    def _map(self, fn, items):
+        items = list(items)
+        if len(items) == 1:
+            return [fn(items[0])]
+        return [future.result() for future in [self._executor.submit(fn, item) for item in items]]
+
+    def _call_all(self, method, *args, **kwargs):
+        return self._map(lambda shard: shard.call(method, *args, **kwargs), self.shards)
+
+    def _shard_for(self, doc_id, chunk=None):
+        return self.shards[shard_of(doc_id if doc_id is not None else chunk, self.num_shards)]
+
+    def _globalize(self, shard, results):
+        for result in results:
+            result['chunk_id'] = global_chunk_id(shard.index, result['chunk_id'])
+            result['shard'] = shard.index
+        return results
+
+    @property
+    def generation(self):
+        return sum(self._call_all("generation"))
+
+    @property
+    def ntotal(self):
+        return sum(self._call_all("ntotal"))
+
+    def has_file(self, file_hash):
+        # Whole-file markers live on shard 0; the chunks themselves are spread out.
+        return self.shards[0].call("has_file", file_hash)
+
+    def mark_file(self, file_hash, file_name=None, num_chunks=0, doc_id=None):
+        self.shards[0].call("mark_file", file_hash, file_name, num_chunks, doc_id)
+
+    def add_documents(self, chunks, file_hash=None, file_name=None, doc_id=None):
+        doc_ids = doc_id if isinstance(doc_id, (list, tuple)) else [doc_id] * len(chunks)
+        if len(doc_ids) != len(chunks):
+            raise ValueError(f"doc_id has {len(doc_ids)} entries for {len(chunks)} chunks")
+        groups = {}
+        for chunk, d in zip(chunks, doc_ids):
+            shard = self._shard_for(d, chunk)
+            group = groups.setdefault(shard.index, ([], []))
+            group[0].append(chunk)
+            group[1].append(d)
+        self._map(lambda item: self.shards[item[0]].call("add_documents", item[1][0], doc_id=item[1][1]),
+                  groups.items())
+        if file_hash:
+            self.mark_file(file_hash, file_name, len(chunks), None if isinstance(doc_id, (list, tuple)) else doc_id)
+
+    def has_document(self, doc_id):
+        return self._shard_for(doc_id).call("has_document", doc_id)
+
+    def document_chunk_ids(self, doc_id):
+        shard = self._shard_for(doc_id)
+        return [global_chunk_id(shard.index, i) for i in shard.call("document_chunk_ids", doc_id)]
+
+    def delete_document(self, doc_id):
+        # The document's shard forgets its own file records; shard 0 holds the rest.
+        shard = self._shard_for(doc_id)
+        if shard.index != 0:
+            self.shards[0].call("unmark_document_files", doc_id)
+        return shard.call("delete_document", doc_id)
+
+    def upsert_document(self, doc_id, chunks):
+        shard = self._shard_for(doc_id)
+        if shard.index != 0:
+            self.shards[0].call("unmark_document_files", doc_id)
+        return shard.call("upsert_document", doc_id, chunks)
+
+    def retrieve(self, query, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False):
+        return self.retrieve_with_embedding(query, top_k, nprobe=nprobe, ef_search=ef_search, mode=mode,
+                                            narrow=narrow)[0]
+
+    def retrieve_with_embedding(self, query, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False,
+                                with_embeddings=False):
+        # The query is encoded once here, then every shard searches with that vector.
+        try:
+            query_emb = None
+            if (mode or self.retrieval_mode) != "lexical":
+                with span("vector_store.encode_query"):
+                    query_emb = self.model.encode([query])[0]
+            with span("vector_store.fan_out", collection=self.name, shards=self.num_shards):
+                per_shard = self._map(
+                    lambda shard: self._globalize(shard, shard.call(
+                        "retrieve_with_embedding", query, top_k, nprobe=nprobe, ef_search=ef_search, mode=mode,
+                        narrow=narrow, with_embeddings=with_embeddings, query_emb=query_emb)[0]),
+                    self.shards)
+                return merge_shard_results(per_shard, top_k), query_emb
+        except Exception as e:
+            print(f"Error retrieving documents: {str(e)}")
+            return [], None
+
+    def retrieve_batch(self, queries, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False):
+        if not queries:
+            return []
+        query_embs = None
+        if (mode or self.retrieval_mode) != "lexical":
+            with span("vector_store.encode_query", queries=len(queries)):
+                query_embs = self.model.encode(list(queries))
+        with span("vector_store.fan_out", collection=self.name, shards=self.num_shards, queries=len(queries)):
+            per_shard = self._map(
+                lambda shard: [self._globalize(shard, results) for results in shard.call(
+                    "retrieve_batch", queries, top_k, nprobe=nprobe, ef_search=ef_search, query_embs=query_embs,
+                    mode=mode, narrow=narrow)],
+                self.shards)
+        return [merge_shard_results([results[q] for results in per_shard], top_k) for q in range(len(queries))]
+
+    def compact(self, force=False):
+        self._call_all("compact", force)
+
+    def wait_for_maintenance(self, timeout=None):
+        self._call_all("wait_for_maintenance", timeout)
+
+    def clear(self):
+        self._call_all("clear")
+
+    def get_stats(self):
+        shards = self._call_all("get_stats")
+        return {
+            'collection': self.name,
+            'num_shards': self.num_shards,
+            'total_documents': sum(s['total_documents'] for s in shards),
+            'deleted_chunks': sum(s['deleted_chunks'] for s in shards),
+            'index_size': sum(s['index_size'] for s in shards),
+            'embedding_dimension': shards[0]['embedding_dimension'],
+            'embedding_backend': shards[0]['embedding_backend'],
+            'generation': sum(s['generation'] for s in shards),
+            'shards': shards,
+        }
+
+    def close(self):
+        self._map(lambda shard: shard.close(), self.shards)
+
+
+class ShardedVectorStore:
+    # Named collections (one per tenant, say) under persist_path/<collection>, each
+    # split over num_shards shards. The VectorStore methods below act on the default
+    # collection unless given collection=; collection(name) returns the collection
+    # itself, which can stand in for a VectorStore (e.g. as an ingestion target).
+    # With processes=True every shard runs in its own worker process.
+    def __init__(self, persist_path="vector_store", num_shards=4, processes=False,
+                 default_collection=DEFAULT_COLLECTION, embedding_backend="torch", fan_out_workers=None,
+                 **store_kwargs):
+        self.persist_path = persist_path
+        self.num_shards = num_shards
+        self.processes = processes
+        self.default_collection = default_collection
+        self.model = get_backend(embedding_backend)
+        self.store_kwargs = dict(store_kwargs, embedding_backend=embedding_backend)
+        self._executor = ThreadPoolExecutor(max_workers=fan_out_workers or max(4, num_shards * 4),
+                                            thread_name_prefix="shard-fan-out")
+        self._collections = {}
+        self._lock = threading.Lock()
+        os.makedirs(persist_path, exist_ok=True)
+        self.collection(default_collection, create=True)
+
+    def collections(self):
+        on_disk = [name for name in os.listdir(self.persist_path)
+                   if os.path.exists(os.path.join(self.persist_path, name, SHARDS_FILE))]
+        return sorted(set(on_disk) | set(self._collections))
+
+    def collection(self, name=None, create=False):
+        name = name or self.default_collection
+        if not COLLECTION_NAME_RE.match(name):
+            raise ValueError(f"Invalid collection name: {name!r}")
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                path = os.path.join(self.persist_path, name)
+                if not create and not os.path.exists(os.path.join(path, SHARDS_FILE)):
+                    raise ValueError(f"Unknown collection: {name}")
+                store_kwargs = dict(self.store_kwargs)
+                collection = ShardedCollection(name, path, self.num_shards, self._executor, self.model,
+                                               processes=self.processes, **store_kwargs)
+                self._collections[name] = collection
+            return collection
+
+    @property
+    def generation(self):
+        # Any write to any collection; answer caches only need it to change.
+        with self._lock:
+            collections = list(self._collections.values())
+        return sum(c.generation for c in collections)
+
+    @property
+    def ntotal(self):
+        return self.collection().ntotal
+
+    def has_file(self, file_hash, collection=None):
+        return self.collection(collection).has_file(file_hash)
+
+    def mark_file(self, file_hash, file_name=None, num_chunks=0, doc_id=None, collection=None):
+        self.collection(collection, create=True).mark_file(file_hash, file_name, num_chunks, doc_id)
+
+    def add_documents(self, chunks, file_hash=None, file_name=None, doc_id=None, collection=None):
+        self.collection(collection, create=True).add_documents(chunks, file_hash=file_hash, file_name=file_name,
+                                                               doc_id=doc_id)
+
+    def has_document(self, doc_id, collection=None):
+        return self.collection(collection).has_document(doc_id)
+
+    def document_chunk_ids(self, doc_id, collection=None):
+        return self.collection(collection).document_chunk_ids(doc_id)
+
+    def delete_document(self, doc_id, collection=None):
+        return self.collection(collection).delete_document(doc_id)
+
+    def upsert_document(self, doc_id, chunks, collection=None):
+        return self.collection(collection, create=True).upsert_document(doc_id, chunks)
+
+    def retrieve(self, query, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False, collection=None):
+        return self.collection(collection).retrieve(query, top_k, nprobe=nprobe, ef_search=ef_search, mode=mode,
+                                                    narrow=narrow)
+
+    def retrieve_with_embedding(self, query, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False,
+                                with_embeddings=False, collection=None):
+        return self.collection(collection).retrieve_with_embedding(
+            query, top_k, nprobe=nprobe, ef_search=ef_search, mode=mode, narrow=narrow,
+            with_embeddings=with_embeddings)
+
+    def retrieve_batch(self, queries, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False,
+                       collection=None):
+        return self.collection(collection).retrieve_batch(queries, top_k, nprobe=nprobe, ef_search=ef_search,
+                                                          mode=mode, narrow=narrow)
+
+    def compact(self, force=False, collection=None):
+        self.collection(collection).compact(force)
+
+    def wait_for_maintenance(self, timeout=None):
+        with self._lock:
+            collections = list(self._collections.values())
+        for collection in collections:
+            collection.wait_for_maintenance(timeout)
+
+    def clear(self, collection=None):
+        self.collection(collection).clear()
+
+    def get_stats(self, collection=None):
+        return dict(self.collection(collection).get_stats(), collections=self.collections())
+
+    def close(self):
+        with self._lock:
+            collections = list(self._collections.values())
+            self._collections = {}
+        for collection in collections:
+            collection.close()
+        self._executor.shutdown(wait=False)
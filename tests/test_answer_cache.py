@@ -0,0 +1,74 @@
+# tests/test_answer_cache.py
+import answer_cache
+from answer_cache import SemanticAnswerCache, context_fingerprint
+
+FINGERPRINT = context_fingerprint([1, 2, 3])
+
+
+def answer(text):
+    return {"answer": text}
+
+
+def put(cache, embedding, fingerprint, generation, payload):
+    # The way answers get in: a missed lookup, then the LLM's answer for its trace.
+    trace_id = f"trace-{cache._next_key}"
+    assert cache.lookup(embedding, fingerprint, generation, trace_id=trace_id) is None
+    cache.complete(trace_id, payload)
+
+
+def test_similar_query_hits_and_context_order_matters():
+    cache = SemanticAnswerCache(threshold=0.9)
+    put(cache, [1.0, 0.0], FINGERPRINT, 1, answer("a"))
+    hit = cache.lookup([0.99, 0.05], FINGERPRINT, 1)
+    assert hit["answer"] == "a" and hit["cache_similarity"] > 0.9
+    assert cache.lookup([0.0, 1.0], FINGERPRINT, 1) is None
+    assert context_fingerprint([3, 2, 1]) != FINGERPRINT
+    assert cache.lookup([1.0, 0.0], context_fingerprint([3, 2, 1]), 1) is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    put(cache, [1.0, 0.0], FINGERPRINT, 1, answer("a"))
+    now[0] += 59
+    assert cache.lookup([1.0, 0.0], FINGERPRINT, 1)["answer"] == "a"
+    now[0] += 2
+    assert cache.lookup([1.0, 0.0], FINGERPRINT, 1) is None
+    stats = cache.get_stats()
+    assert (stats["entries"], stats["expirations"]) == (0, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    for i, vector in enumerate([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]):
+        put(cache, vector, FINGERPRINT, 1, answer(str(i)))
+    cache.lookup([1.0, 0.0, 0.0], FINGERPRINT, 1)
+    put(cache, [0.0, 0.0, 1.0], FINGERPRINT, 1, answer("2"))
+    assert cache.lookup([1.0, 0.0, 0.0], FINGERPRINT, 1)["answer"] == "0"
+    assert cache.lookup([0.0, 1.0, 0.0], FINGERPRINT, 1) is None
+    assert cache.lookup([0.0, 0.0, 1.0], FINGERPRINT, 1)["answer"] == "2"
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_a_new_generation_drops_every_entry():
+    cache = SemanticAnswerCache()
+    put(cache, [1.0, 0.0], FINGERPRINT, 1, answer("a"))
+    assert cache.lookup([1.0, 0.0], FINGERPRINT, 2) is None
+    assert cache.lookup([1.0, 0.0], FINGERPRINT, 1) is None
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_answer_is_stored_only_for_the_generation_it_was_asked_in():
+    cache = SemanticAnswerCache()
+    assert cache.lookup([1.0, 0.0], FINGERPRINT, 1, trace_id="t1") is None
+    cache.complete("t1", answer("a"))
+    assert cache.lookup([1.0, 0.0], FINGERPRINT, 1)["answer"] == "a"
+    # The store changed while t2's answer was being generated.
+    assert cache.lookup([0.0, 1.0], FINGERPRINT, 1, trace_id="t2") is None
+    cache.lookup([0.0, 1.0], FINGERPRINT, 2)
+    cache.complete("t2", answer("stale"))
+    assert cache.lookup([0.0, 1.0], FINGERPRINT, 2) is None
+    assert cache.get_stats()["entries"] == 0
@@ -0,0 +1,42 @@
+# tests/test_benchmarks.py
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.pipeline import ROOT, latency_stats, peak_rss_bytes, synthetic_corpus, synthetic_queries
+
+
+def test_synthetic_data_is_reproducible():
+    corpus = synthetic_corpus(50, words=10)
+    assert corpus == synthetic_corpus(50, words=10) != synthetic_corpus(50, seed=1, words=10)
+    assert corpus[7].endswith("REF-0000007") and len(corpus[7].split()) == 11
+    queries = synthetic_queries(corpus, 20)
+    assert len(queries) == 20 and queries == synthetic_queries(corpus, 20)
+
+
+def test_latency_stats_in_milliseconds():
+    stats = latency_stats([0.001 * i for i in range(1, 101)])
+    assert stats["count"] == 100 and stats["max_ms"] == pytest.approx(100.0)
+    assert (stats["p50_ms"], stats["p99_ms"]) == pytest.approx((50.5, 99.01))
+    assert latency_stats([]) == {}
+
+
+def test_peak_rss_without_the_resource_module(monkeypatch):
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert peak_rss_bytes() is None
+
+
+def test_pipeline_emits_a_json_report(tmp_path):
+    output = tmp_path / "report.json"
+    subprocess.run([sys.executable, "-m", "benchmarks.pipeline", "--sizes", "300", "--queries", "20",
+                    "--e2e-queries", "5", "--warmup", "2", "--llm-tokens", "5", "--dim", "64",
+                    "--output", str(output)], cwd=ROOT, check=True, capture_output=True, timeout=300)
+    report = json.loads(output.read_text())
+    result, = report["results"]
+    assert "error" not in result and "error" not in result["cold_start"]
+    assert (result["size"], result["ntotal"], result["end_to_end"]["errors"]) == (300, 300, 0)
+    assert set(result["retrieve"]) == {"dense", "hybrid"} and result["retrieve"]["dense"]["count"] == 20
+    assert result["ingest"]["chunks_per_s"] > 0 and result["cold_start"]["first_query_ms"] > 0
+    assert report["config"]["dim"] == 64 and report["meta"]["python"]
@@ -0,0 +1,43 @@
+# tests/test_chunk_store.py
+import numpy as np
+
+from chunk_store import ChunkList, ChunkStore
+
+
+def write_store(directory, parts, keep=None):
+    directory.mkdir()
+    ChunkStore.write(str(directory), parts, keep=keep)
+    return ChunkStore(str(directory))
+
+
+def test_write_and_read_back(tmp_path):
+    store = write_store(tmp_path / "a", [["alpha", "", "grüße"], ["omega"]])
+    assert list(store) == ["alpha", "", "grüße", "omega"]
+    assert (len(store), store[-1], store[1:3]) == (4, "omega", ["", "grüße"])
+    store.close()
+
+
+def test_keep_mask_drops_rows_across_parts(tmp_path):
+    base = write_store(tmp_path / "base", [["b0", "b1", "b2"]])
+    # The mask spans the mapped part and the list part; rows are numbered across both.
+    keep = np.array([True, False, True, False, True])
+    store = write_store(tmp_path / "kept", [base, ["t0", "t1"]], keep=keep)
+    assert list(store) == ["b0", "b2", "t1"]
+    # A fully kept ChunkStore part is copied as is, offsets shifted past earlier parts.
+    store2 = write_store(tmp_path / "copied", [["x"], base, ["t0", "t1"]],
+                         keep=np.array([True, True, True, True, False, True]))
+    assert list(store2) == ["x", "b0", "b1", "b2", "t1"]
+    for s in (base, store, store2):
+        s.close()
+
+
+def test_chunk_list_reads_through_base_and_tail(tmp_path):
+    base = write_store(tmp_path / "base", [["b0", "b1"]])
+    chunks = ChunkList(base)
+    chunks.extend(["t0"])
+    snapshot = chunks.snapshot()
+    chunks.extend(["t1"])
+    assert list(chunks) == ["b0", "b1", "t0", "t1"] and chunks[-1] == "t1"
+    assert snapshot == (base, 1)
+    assert [list(part) for part in chunks.parts(snapshot[1])] == [["b0", "b1"], ["t0"]]
+    base.close()
@@ -0,0 +1,66 @@
+# tests/test_concurrency.py
+import pytest
+
+from benchmarks.concurrency import Readers
+from benchmarks.pipeline import synthetic_corpus, synthetic_queries
+from embeddings import HashingBackend
+from vector_store import VectorStore
+
+
+def open_store(path, **kwargs):
+    return VectorStore(persist_path=str(path / "index"), cache_path=str(path / "embedding_cache"),
+                       embedding_backend=HashingBackend(dimension=64), index_type="flat", **kwargs)
+
+
+def close_store(store):
+    store.wait_for_writes()
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+@pytest.mark.parametrize("mode", ["dense", "hybrid"])
+def test_readers_during_submit_and_compaction(tmp_path, mode):
+    # Small compaction thresholds, so the base is rewritten several times under the readers.
+    store = open_store(tmp_path, compact_ratio=0.2, min_compact_rows=200)
+    corpus = synthetic_corpus(3000, words=20)
+    store.add_documents(corpus[:500])
+    generation = store.log.generation
+    written = []
+
+    def write(stop):
+        futures = [store.submit("add_documents", corpus[first:first + 100]) for first in range(500, 3000, 100)]
+        for future in futures:
+            future.result()
+            written.append(future)
+        store.wait_for_maintenance()
+
+    report = Readers(store, corpus, synthetic_queries(corpus[:500], 200), 3, 5, mode).run(None, during=write)
+    assert len(written) == 25 and store.ntotal == 3000
+    assert store.log.generation > generation
+    assert report["results_checked"] > 0
+    assert report["mismatches"] == 0 and report["errors"] == [] and report["empty_results"] == 0
+    close_store(store)
+
+
+def test_published_snapshot_does_not_change_under_later_writes(tmp_path):
+    store = open_store(tmp_path, min_compact_rows=10 ** 9)
+    store.add_documents(["alpha one", "alpha two"], doc_id="a")
+    store.compact(force=True)
+    store.add_documents(["beta one", "beta two"], doc_id="b")
+    snapshot = store._snapshot()
+    rows = range(snapshot["rows"])
+
+    def read(snapshot):
+        table = snapshot["table"]
+        return ([snapshot["chunks"][row] for row in rows], table.ids_of(list(rows)).tolist(),
+                [table.doc_of(row) for row in rows], snapshot["deleted"].tolist())
+
+    before = read(snapshot)
+    store.add_documents(["gamma one"], doc_id="c")
+    store.upsert_document("b", ["beta revised"])
+    store.delete_document("a")
+    store.compact(force=True)
+    assert read(snapshot) == before
+    assert before[0] == ["alpha one", "alpha two", "beta one", "beta two"]
+    assert [r['text'] for r in store.retrieve("beta revised", top_k=10)][0] == "beta revised"
+    close_store(store)
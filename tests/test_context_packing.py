@@ -0,0 +1,54 @@
+# tests/test_context_packing.py
+import numpy as np
+
+from context_packing import ContextPacker, estimate_tokens, mmr_order, overlap_length
+
+LEFT = "The quick brown fox jumps over the lazy dog near the river bank"
+RIGHT = "over the lazy dog near the river bank and then rests in the shade"
+
+
+def candidate(text, doc_id, chunk_id, embedding=None):
+    return {"text": text, "doc_id": doc_id, "chunk_id": chunk_id, "embedding": embedding}
+
+
+def test_overlap_length_finds_the_shared_suffix():
+    assert overlap_length(LEFT, RIGHT) == len("over the lazy dog near the river bank")
+    assert overlap_length(RIGHT, LEFT) == 0
+    assert overlap_length("abc river bank", "river bank xyz", min_overlap=20) == 0
+    assert overlap_length("abc river bank", "river bank xyz", min_overlap=5) == len("river bank")
+
+
+def test_mmr_prefers_new_material_and_drops_near_duplicates():
+    embeddings = np.array([[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]])
+    order, duplicates = mmr_order([1.0, 0.9, 0.5], embeddings)
+    assert (order, duplicates) == ([0, 2], [1])
+    # Kept, the redundant candidate still goes after the less relevant but new one.
+    order, duplicates = mmr_order([1.0, 0.9, 0.5], embeddings, duplicate_similarity=1.01)
+    assert (order, duplicates) == ([0, 2, 1], [])
+
+
+def test_pack_stitches_neighbours_and_stays_within_the_budget():
+    other = "unrelated material " * 30
+    candidates = [candidate(LEFT, "d", 0), candidate(RIGHT, "d", 1), candidate(other, "e", 7),
+                  candidate("A short note.", "e", 3)]
+    budget = estimate_tokens(LEFT + RIGHT) + 10
+    passages, stats = ContextPacker(token_budget=budget).pack(None, candidates)
+    assert passages[0]["text"] == "The quick brown fox jumps over the lazy dog near the river bank" \
+                                  " and then rests in the shade"
+    assert passages[0]["chunk_ids"] == [0, 1]
+    assert [p["text"] for p in passages[1:]] == ["A short note."]
+    assert (stats["stitched"], stats["over_budget"]) == (1, 1)
+    assert stats["tokens_packed"] <= budget
+
+
+def test_pack_joins_adjacent_chunks_and_skips_contained_ones():
+    candidates = [candidate("second part", "d", 5), candidate("first part", "d", 4),
+                  candidate("first", "d", 9)]
+    passages, stats = ContextPacker().pack(None, candidates)
+    assert [(p["text"], p["chunk_ids"]) for p in passages] == [("first part\nsecond part", [4, 5])]
+    assert stats["contained"] == 1
+
+
+def test_a_chunk_over_the_budget_is_cut_rather_than_dropped():
+    passages, _ = ContextPacker(token_budget=5).pack(None, [candidate("x" * 100, "d", 0)])
+    assert passages[0]["text"] == "x" * 20
@@ -0,0 +1,52 @@
+# tests/test_embedding_cache.py
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def vectors(n, dimension=4):
+    return np.arange(n * dimension, dtype="float32").reshape(n, dimension)
+
+
+def stored(cache):
+    return cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=10)
+    cache.put_many(["a", "b"], vectors(2))
+    found = cache.get_many(["a", "b", "c", "c"])
+    assert sorted(found) == ["a", "b"]
+    np.testing.assert_array_equal(found["b"], vectors(2)[1])
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 1, 2 / 3)
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=3)
+    cache.put_many(["a", "b", "c"], vectors(3))
+    cache.get_many(["a"])
+    cache.put_many(["d", "e"], vectors(2))
+    assert sorted(cache.get_many(["a", "b", "c", "d", "e"])) == ["a", "d", "e"]
+    stats = cache.get_stats()
+    assert (stats["entries"], stats["evictions"]) == (3, 2)
+    assert stored(cache) == 3
+    cache.close()
+
+
+def test_entry_count_survives_repeats_and_reopening(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=4)
+    cache.put_many(["a", "b", "a"], vectors(3))
+    cache.put_many(["b", "c"], vectors(2))
+    assert cache.get_stats()["entries"] == stored(cache) == 3
+    # Putting a cached hash again refreshes it, so b outlives a.
+    cache.put_many(["b", "d", "e"], vectors(3))
+    assert sorted(cache.get_many(["a", "b", "c", "d", "e"])) == ["b", "c", "d", "e"]
+    assert cache.get_stats()["evictions"] == 1
+    cache.close()
+    cache = EmbeddingCache(str(tmp_path), max_entries=4)
+    assert cache.get_stats()["entries"] == 4
+    cache.put_many(["f"], vectors(1))
+    assert cache.get_stats()["entries"] == stored(cache) == 4
+    cache.close()
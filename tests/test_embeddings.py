@@ -0,0 +1,60 @@
+# tests/test_embeddings.py
+import pickle
+
+import numpy as np
+import pytest
+
+from embeddings import EmbeddingBackend, HashingBackend, get_backend
+from vector_store import VectorStore
+
+
+class CountingBackend(EmbeddingBackend):
+    # Goes through EmbeddingBackend.encode and load(), with the hashing model standing
+    # in for the real one.
+    name = "counting"
+    loads = 0
+
+    def _load_model(self):
+        CountingBackend.loads += 1
+        return HashingBackend(dimension=self.dimension)
+
+
+def test_backends_load_nothing_until_first_use():
+    for name in ("torch", "int8", "onnx"):
+        assert not get_backend(name).loaded
+    with pytest.raises(ValueError, match="Unknown embedding backend"):
+        get_backend("tensorflow")
+
+
+def test_store_loads_the_model_on_first_encode(tmp_path):
+    CountingBackend.loads = 0
+    backend = CountingBackend(dimension=32)
+    store = VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                        embedding_backend=backend, index_type="flat")
+    assert CountingBackend.loads == 0 and not backend.loaded
+    store.add_documents(["alpha beta", "gamma delta"])
+    assert store.retrieve("gamma delta", top_k=1)[0]['text'] == "gamma delta"
+    assert CountingBackend.loads == 1
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+def test_backends_pickle_unloaded():
+    backend = CountingBackend(dimension=8)
+    backend.load()
+    copy = pickle.loads(pickle.dumps(backend))
+    assert backend.loaded and not copy.loaded and copy.dimension == 8
+
+
+def test_quantized_backends_get_their_own_cache_namespace():
+    assert get_backend("torch").cache_namespace == get_backend("torch").model_name
+    assert get_backend("int8").cache_namespace != get_backend("torch").cache_namespace
+    assert get_backend("onnx").cache_namespace.endswith(":onnx")
+
+
+def test_hashing_backend_is_deterministic_and_normalised():
+    backend = HashingBackend(dimension=64)
+    first = backend.encode(["The cat sat", "", "the CAT sat"])
+    assert np.array_equal(first, HashingBackend(dimension=64).encode(["The cat sat", "", "the CAT sat"]))
+    assert np.allclose(np.linalg.norm(first[[0, 2]], axis=1), 1.0) and not first[1].any()
+    assert np.array_equal(first[0], first[2])
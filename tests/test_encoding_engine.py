@@ -0,0 +1,39 @@
+# tests/test_encoding_engine.py
+import numpy as np
+import pytest
+
+from embeddings import HashingBackend
+from encoding_engine import EncodingEngine, plan_batches, token_lengths
+
+
+def test_batches_go_longest_first_within_the_token_budget():
+    lengths = np.array([10, 200, 50, 200, 10, 100])
+    batches = plan_batches(lengths, batch_size=3, max_batch_tokens=400)
+    assert [batch.tolist() for batch in batches] == [[1, 3], [5, 2, 0], [4]]
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) * lengths[batch[0]] <= 400 and lengths[batch[0]] == lengths[batch].max()
+
+
+def test_a_chunk_longer_than_the_budget_gets_a_batch_of_its_own():
+    assert [batch.tolist() for batch in plan_batches(np.array([900, 5]), max_batch_tokens=100)] == [[0], [1]]
+
+
+def test_token_lengths_are_capped():
+    assert token_lengths(["abcd" * 10, "x" * 5000], max_length=256).tolist() == [12, 256]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_windows_come_back_in_input_order(workers):
+    backend = HashingBackend(dimension=32)
+    texts = [f"chunk {i} " + "word " * (i % 37) for i in range(250)]
+    engine = EncodingEngine(backend, workers=workers, window=64, batch_size=16, max_batch_tokens=256)
+    try:
+        windows = list(engine.iter_encode(texts))
+    finally:
+        engine.close()
+    assert [offset for offset, _ in windows] == [0, 64, 128, 192]
+    np.testing.assert_allclose(np.concatenate([out for _, out in windows]),
+                               backend.encode(texts, batch_size=len(texts)), rtol=1e-6)
+    stats = engine.get_stats()
+    assert stats["chunks"] == 250 and stats["padding_efficiency"] <= 1.0
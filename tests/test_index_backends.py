@@ -0,0 +1,152 @@
+# tests/test_index_backends.py
+import faiss
+import numpy as np
+import pytest
+
+from benchmarks.pipeline import synthetic_corpus
+from embeddings import HashingBackend
+from index_backends import (StackedVectors, build_index, describe_index, empty_like, read_index_mmap, recall_at_k,
+                            recall_report, sample_rows, search)
+from vector_store import VectorStore
+
+
+def test_stacked_vectors_read_like_one_matrix(tmp_path):
+    rng = np.random.default_rng(0)
+    first, second = rng.random((7, 4), dtype="float32"), rng.random((5, 4), dtype="float32")
+    np.save(tmp_path / "first.npy", first)
+    stacked = StackedVectors([np.load(tmp_path / "first.npy", mmap_mode="r"), second])
+    whole = np.vstack([first, second])
+    assert len(stacked) == 12 and stacked.shape == (12, 4)
+    assert np.array_equal(stacked[3:10], whole[3:10])
+    assert np.array_equal(stacked[np.array([11, 0, 6, 7])], whole[[11, 0, 6, 7]])
+    assert np.array_equal(stacked[8], whole[8])
+    assert np.array_equal(sample_rows(stacked, 12), whole)
+
+
+def test_build_index_from_memory_mapped_vectors(tmp_path):
+    vectors = np.random.default_rng(1).random((3000, 16), dtype="float32")
+    np.save(tmp_path / "vectors.npy", vectors)
+    index = build_index("ivf_flat", 16, np.load(tmp_path / "vectors.npy", mmap_mode="r"))
+    assert index.ntotal == 3000
+    np.testing.assert_array_equal(faiss_vectors(index, [0, 1500, 2999]), vectors[[0, 1500, 2999]])
+
+
+def faiss_vectors(index, ids):
+    import faiss
+    ivf = faiss.extract_index_ivf(index)
+    ivf.make_direct_map()
+    return np.vstack([ivf.reconstruct(int(i)) for i in ids])
+
+
+@pytest.mark.parametrize("index_type,codec", [("ivf_flat", "fp32"), ("flat", "sq8")])
+def test_retrain_over_base_and_delta(tmp_path, index_type, codec):
+    store = VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                        embedding_backend=HashingBackend(dimension=64), index_type="flat", min_compact_rows=10 ** 9)
+    corpus = synthetic_corpus(1500, words=20)
+    store.add_documents(corpus[:1000])
+    store.compact(force=True)
+    store.add_documents(corpus[1000:])
+    assert store.index.ntotal == 1000 and store.delta_index.ntotal == 500
+    assert store.retrain(index_type=index_type, vector_codec=codec)
+    assert describe_index(store.index) == (index_type, codec)
+    assert store.index.ntotal == 1500 and store.delta_index.ntotal == 0
+    assert isinstance(store._base_vectors, StackedVectors)
+    for i in (0, 999, 1000, 1499):
+        assert store.retrieve(corpus[i], top_k=1, nprobe=64)[0]['text'] == corpus[i]
+    store.compact(force=True)
+    assert not isinstance(store._base_vectors, StackedVectors)
+    assert store.retrieve(corpus[1200], top_k=1, nprobe=64)[0]['text'] == corpus[1200]
+    assert store.recall_report(top_k=5, sample=20)
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+@pytest.mark.parametrize("index_type,codec", [("flat", "fp32"), ("flat", "sq8"), ("flat", "pq"), ("ivf_flat", "fp32"),
+                                              ("ivf_flat", "fp16"), ("ivf_pq", "pq"), ("hnsw", "fp32"), ("hnsw", "sq8")])
+def test_empty_like_keeps_the_trained_parameters(tmp_path, index_type, codec):
+    rng = np.random.default_rng(2)
+    vectors, queries = rng.random((10000, 16), dtype="float32"), rng.random((10, 16), dtype="float32")
+    index = build_index(index_type, 16, vectors, codec=codec)
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+    empty = empty_like(read_index_mmap(str(tmp_path / "index.faiss"), index_type))
+    assert empty.ntotal == 0 and describe_index(empty) == (index_type, codec)
+    empty.add(vectors)
+    np.testing.assert_array_equal(empty.search(queries, 5)[1], index.search(queries, 5)[1])
+
+
+def test_purging_compaction_does_not_load_the_base(tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                        embedding_backend=HashingBackend(dimension=64), index_type="ivf_flat",
+                        promote_threshold=10 ** 9, min_compact_rows=10 ** 9)
+    corpus = synthetic_corpus(1200, words=20)
+    store.add_documents(corpus[:1000], doc_id=[f"doc-{i // 10}" for i in range(1000)])
+    assert store.retrain()
+    store.compact(force=True)
+    store.add_documents(corpus[1000:])
+    store.delete_document("doc-3")
+    # Nothing left for background maintenance to do; the purge below is the only compaction.
+    store.wait_for_maintenance()
+    opened = []
+    open_base = store.log.open_base
+    store.log.open_base = lambda use_mmap=True: opened.append(use_mmap) or open_base(use_mmap)
+    store.compact(force=True)
+    assert opened == [True]
+    assert store.index.ntotal == 1190 and describe_index(store.index) == ("ivf_flat", "fp32")
+    assert store.retrieve(corpus[1100], top_k=1, nprobe=64)[0]['text'] == corpus[1100]
+    assert corpus[35] not in [r['text'] for r in store.retrieve(corpus[35], top_k=5, nprobe=64)]
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+def test_store_promotes_from_flat_past_the_threshold(tmp_path):
+    def open_store():
+        return VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                           embedding_backend=HashingBackend(dimension=64), index_type="ivf_flat",
+                           promote_threshold=800, min_compact_rows=10 ** 9)
+
+    store = open_store()
+    corpus = synthetic_corpus(1000, words=20)
+    store.add_documents(corpus[:500])
+    store.wait_for_maintenance()
+    assert describe_index(store.index) == ("flat", "fp32")
+    store.add_documents(corpus[500:])
+    store.wait_for_maintenance()
+    assert describe_index(store.index) == ("ivf_flat", "fp32") and store.ntotal == 1000
+    store.embedding_cache.close()
+    store = open_store()
+    assert describe_index(store.index) == ("ivf_flat", "fp32") and store.ntotal == 1000
+    assert store.retrieve(corpus[700], top_k=1, nprobe=64)[0]['text'] == corpus[700]
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+def test_nprobe_is_per_query():
+    rng = np.random.default_rng(2)
+    vectors, queries = rng.random((4000, 16), dtype="float32"), rng.random((50, 16), dtype="float32")
+    index = build_index("ivf_flat", 16, vectors)
+    nlist = faiss.extract_index_ivf(index).nlist
+    default = index.nprobe
+    _, exact = faiss.knn(queries, vectors, 10)
+    _, one = search(index, queries, 10, nprobe=1)
+    _, every = search(index, queries, 10, nprobe=nlist)
+    assert recall_at_k(one, exact) < recall_at_k(every, exact) == 1.0
+    assert index.nprobe == default
+    # A restricted search probes every list, so allowed rows outside the nearest ones are found.
+    include = np.arange(0, 4000, 97)
+    _, labels = search(index, queries[:1], 5, nprobe=1, include=include)
+    _, truth = faiss.knn(queries[:1], vectors[include], 5)
+    assert labels[0].tolist() == include[truth[0]].tolist()
+    report = recall_report(index, vectors, queries, top_k=10)
+    assert [row["nprobe"] for row in report] == [p for p in (1, 4, 16, 64, 256) if p <= nlist]
+    assert report[0]["recall_at_k"] == recall_at_k(one, exact) and report[-1]["recall_at_k"] > report[0]["recall_at_k"]
+
+
+def test_ef_search_is_per_query():
+    rng = np.random.default_rng(3)
+    vectors, queries = rng.random((2000, 16), dtype="float32"), rng.random((20, 16), dtype="float32")
+    index = build_index("hnsw", 16, vectors)
+    default = index.hnsw.efSearch
+    _, exact = faiss.knn(queries, vectors, 10)
+    assert recall_at_k(search(index, queries, 10, ef_search=512)[1], exact) >= \
+        recall_at_k(search(index, queries, 10, ef_search=10)[1], exact)
+    assert index.hnsw.efSearch == default
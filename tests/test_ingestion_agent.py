@@ -0,0 +1,86 @@
+# tests/test_ingestion_agent.py
+import pytest
+
+from embedding_cache import document_id
+from embeddings import HashingBackend
+from vector_store import VectorStore
+
+ingestion_agent = pytest.importorskip("agents.ingestion_agent")
+
+
+class Upload:
+    def __init__(self, name):
+        self.name = name
+
+
+class ChunkingAgent(ingestion_agent.IngestionAgent):
+    def __init__(self, chunks, fail=False):
+        super().__init__(max_workers=1)
+        self.chunks = chunks
+        self.fail = fail
+
+    def iter_chunks(self, uploaded_file):
+        yield from self.chunks
+        if self.fail:
+            # Extraction dies after some chunks were already streamed to the store.
+            raise RuntimeError("page range 8-16 failed")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                        embedding_backend=HashingBackend(), index_type="flat")
+    yield store
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+def texts(store, query):
+    return [r['text'] for r in store.retrieve(query, top_k=10)]
+
+
+def test_failed_file_leaves_no_partial_document(store):
+    events = []
+    stats = ChunkingAgent(["broken first chunk", "broken second chunk"], fail=True).ingest_files(
+        [Upload("broken.pdf")], store, file_hashes=["hash-1"], batch_size=1,
+        progress=lambda *event: events.append(event))
+    assert [e["file"] for e in stats["errors"]] == ["broken.pdf"]
+    assert events[-1][0] == "failed"
+    assert not store.has_document(document_id("broken.pdf", "hash-1"))
+    assert not store.has_file("hash-1")
+
+
+def test_failed_reingest_keeps_the_old_version(store):
+    doc_id = document_id("report.pdf", "hash-1")
+    ChunkingAgent(["old boiler section", "old pump section"]).ingest_files([Upload("report.pdf")], store,
+                                                                          file_hashes=["hash-1"])
+    # Forget the file record, as after a failed earlier attempt, so the file goes in again.
+    store.embedding_cache.unmark_document_files(doc_id)
+    seen = []
+    agent = ChunkingAgent(["new boiler section"], fail=True)
+    agent.ingest_files([Upload("report.pdf")], store, file_hashes=["hash-1"], batch_size=1,
+                       progress=lambda event, name, value: seen.append(texts(store, "old boiler section")))
+    assert "old boiler section" in texts(store, "old boiler section")
+    assert "new boiler section" not in texts(store, "new boiler section")
+    assert len(store.document_chunk_ids(doc_id)) == 2
+    # Readers never saw the old version disappear while the new one was extracted.
+    assert all("old boiler section" in found for found in seen)
+
+
+def test_reingest_swaps_the_document_in_one_write(store):
+    doc_id = document_id("report.pdf", "hash-1")
+    ChunkingAgent(["old boiler section", "old pump section"]).ingest_files([Upload("report.pdf")], store,
+                                                                          file_hashes=["hash-1"])
+    store.embedding_cache.unmark_document_files(doc_id)
+    ChunkingAgent(["new boiler section"]).ingest_files([Upload("report.pdf")], store, file_hashes=["hash-1"])
+    assert "new boiler section" in texts(store, "new boiler section")
+    assert "old boiler section" not in texts(store, "old boiler section")
+    assert store.has_file("hash-1")
+
+
+def test_same_name_different_files_stay_separate(store):
+    ChunkingAgent(["first report"]).ingest_files([Upload("report.pdf")], store, file_hashes=["hash-1"])
+    ChunkingAgent(["second report"]).ingest_files([Upload("report.pdf")], store, file_hashes=["hash-2"])
+    assert store.has_document(document_id("report.pdf", "hash-1"))
+    assert store.has_document(document_id("report.pdf", "hash-2"))
+    assert "first report" in texts(store, "first report")
@@ -0,0 +1,50 @@
+# tests/test_ingestion_jobs.py
+import io
+import threading
+
+from embedding_cache import content_hash, document_id
+from ingestion_jobs import IngestionJob, IngestionJobQueue
+
+
+def upload(name, data):
+    f = io.BytesIO(data)
+    f.name = name
+    return f
+
+
+class StubStore:
+    def has_file(self, file_hash):
+        return False
+
+
+class StubAgent:
+    # Reports every file as done with as many chunks as it has bytes.
+    def __init__(self, barrier=None):
+        self.barrier = barrier
+
+    def ingest_files(self, uploads, vector_store, file_hashes=None, trace_id=None, progress=None):
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        for f, file_hash in zip(uploads, file_hashes):
+            size = len(f.getvalue())
+            progress("started", document_id(f.name, file_hash))
+            progress("indexed", document_id(f.name, file_hash), size)
+            progress("done", document_id(f.name, file_hash), size)
+
+
+def test_files_with_the_same_name_keep_their_own_progress():
+    files = [upload("report.pdf", b"abc"), upload("report.pdf", b"defgh")]
+    job = IngestionJob(files, [content_hash(f.getvalue()) for f in files])
+    job.run(StubAgent(), StubStore())
+    snapshot = job.snapshot()
+    assert [(f["name"], f["chunks_indexed"], f["status"]) for f in snapshot["files"]] == \
+        [("report.pdf", 3, "done"), ("report.pdf", 5, "done")]
+    assert len({f["doc_id"] for f in snapshot["files"]}) == 2
+
+
+def test_jobs_run_side_by_side():
+    # Each job waits for the other at the barrier; run one at a time, both would fail.
+    jobs = IngestionJobQueue(StubAgent(barrier=threading.Barrier(2)), StubStore())
+    job_ids = jobs.submit([upload("a.txt", b"first")]) + jobs.submit([upload("b.txt", b"second")])
+    jobs.shutdown(wait=True)
+    assert [job["status"] for job in jobs.jobs(job_ids)] == ["done", "done"]
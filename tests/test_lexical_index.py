@@ -0,0 +1,42 @@
+# tests/test_lexical_index.py
+import math
+
+import pytest
+
+from lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def bm25(tf, dl, df, num_docs, avgdl, k1=1.2, b=0.75):
+    idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+
+
+def test_identifiers_stay_single_tokens():
+    assert tokenize("Error ERR-1042 in sku_88-x, see v2.3.1.") == ["error", "err-1042", "in", "sku_88-x", "see", "v2.3.1"]
+
+
+def test_scores_follow_bm25():
+    index = BM25Index()
+    index.add([0, 1, 2], ["apple apple banana", "banana cherry", "cherry cherry cherry durian"])
+    ids, scores = index.search("apple cherry", top_k=3)
+    avgdl = 9 / 3
+    expected = {0: bm25(2, 3, 1, 3, avgdl), 1: bm25(1, 2, 2, 3, avgdl), 2: bm25(3, 4, 2, 3, avgdl)}
+    assert ids.tolist() == sorted(expected, key=lambda i: -expected[i])
+    assert scores.tolist() == pytest.approx([expected[i] for i in ids.tolist()], rel=1e-5)
+    assert index.search("apple cherry", top_k=1)[0].tolist() == ids.tolist()[:1]
+
+
+def test_removed_chunks_are_not_found_or_counted():
+    index = BM25Index()
+    index.add([0, 1], ["apple banana", "banana cherry"])
+    index.remove([0])
+    assert index.search("apple", top_k=5)[0].tolist() == []
+    assert index.search("banana", top_k=5)[0].tolist() == [1]
+    index.add([0], ["apple banana"])
+    assert index.get_stats()["chunks"] == 1
+
+
+def test_rrf_rewards_agreement_between_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "b", "d"]], k=60)
+    assert [key for key, _ in fused] == ["c", "b", "a", "d"]
+    assert dict(fused) == pytest.approx({"a": 1 / 61, "b": 2 / 62, "c": 1 / 63 + 1 / 61, "d": 1 / 63})
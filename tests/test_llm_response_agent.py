@@ -0,0 +1,82 @@
+# tests/test_llm_response_agent.py
+import asyncio
+
+from agents.llm_response_agent import LLMResponseAgent
+from answer_cache import SemanticAnswerCache
+from llm_backends import FakeLLMBackend, LLMBackend
+from mcp import MCPMessage
+from mcp_router import MCPRouter
+
+
+class BrokenBackend(LLMBackend):
+    name = "broken"
+
+    def stream(self, messages, temperature=0.7, max_tokens=500):
+        yield "partial "
+        raise RuntimeError("connection reset")
+
+
+def fake(max_tokens=5):
+    return LLMResponseAgent(backend=FakeLLMBackend(first_token_s=0, tokens_per_s=0), max_tokens=max_tokens)
+
+
+def retrieval_result(query="alpha beta"):
+    return MCPMessage("RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT",
+                      {"query": query, "retrieved_context": ["some context"]}).to_dict()
+
+
+def test_fake_backend_streams_and_completes_the_same_text():
+    backend = FakeLLMBackend(first_token_s=0, tokens_per_s=0)
+    messages = [{"role": "user", "content": "one two"}]
+    deltas = list(backend.stream(messages, max_tokens=3))
+
+    async def collect():
+        return [delta async for delta in backend.astream(messages, max_tokens=3)]
+
+    assert deltas == ["one ", "two ", "one "] == asyncio.run(collect())
+    assert backend.complete(messages, max_tokens=3) == "".join(deltas)
+
+
+def test_stream_yields_partials_then_the_full_answer():
+    msg = retrieval_result()
+    replies = [r.to_dict() for r in fake().stream_response(msg)]
+    partials, final = replies[:-1], replies[-1]
+    assert len(partials) == 5 and [p["payload"]["index"] for p in partials] == list(range(5))
+    assert all(p["payload"]["done"] is False and p["trace_id"] == msg["trace_id"] for p in partials)
+    assert final["type"] == "FINAL_RESPONSE" and final["payload"]["done"] is True
+    assert final["payload"]["answer"] == "".join(p["payload"]["delta"] for p in partials).strip()
+    assert final["payload"]["answer"] == fake().generate_response(msg).payload["answer"]
+
+
+def test_a_failed_stream_ends_in_an_error_and_caches_nothing():
+    cache = SemanticAnswerCache()
+    agent = LLMResponseAgent(backend=BrokenBackend(), answer_cache=cache)
+    msg = retrieval_result()
+    cache.lookup([1.0, 0.0], "context", 1, trace_id=msg["trace_id"])
+    replies = list(agent.stream_response(msg))
+    assert [r.payload["done"] for r in replies] == [False, True]
+    assert replies[-1].msg_type == "ERROR" and "connection reset" in replies[-1].payload["answer"]
+    assert cache.lookup([1.0, 0.0], "context", 1) is None and not cache._pending
+
+
+def test_finished_answer_goes_into_the_answer_cache():
+    cache = SemanticAnswerCache()
+    agent = fake()
+    agent.answer_cache = cache
+    msg = retrieval_result()
+    cache.lookup([1.0, 0.0], "context", 1, trace_id=msg["trace_id"])
+    final = list(agent.stream_response(msg))[-1]
+    assert cache.lookup([1.0, 0.0], "context", 1)["answer"] == final.payload["answer"]
+
+
+def test_async_stream_through_the_router():
+    async def run():
+        router = MCPRouter()
+        router.register("LLMResponseAgent", fake(max_tokens=3).astream_response)
+        replies = [r async for r in router.stream(retrieval_result(), timeout=5)]
+        await router.stop()
+        return replies
+
+    replies = asyncio.run(run())
+    assert [r["payload"]["done"] for r in replies] == [False, False, False, True]
+    assert replies[-1]["payload"]["answer"] == fake(max_tokens=3).generate_response(retrieval_result()).payload["answer"]
@@ -0,0 +1,31 @@
+# tests/test_mcp.py
+import numpy as np
+import pytest
+
+from mcp import SCHEMA_VERSION, MCPMessage
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def test_bytes_round_trip_keeps_every_field():
+    msg = MCPMessage("RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT",
+                     {"query": "q", "retrieved_context": ["a", "b"], "distances": np.array([0.5, 0.25], dtype="float32"),
+                      "top": np.int64(3)}, trace_id="trace-1")
+    copy = MCPMessage.from_bytes(msg.to_bytes())
+    assert (copy.sender, copy.receiver, copy.msg_type, copy.trace_id) == \
+        ("RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT", "trace-1")
+    assert copy.payload == {"query": "q", "retrieved_context": ["a", "b"], "distances": [0.5, 0.25], "top": 3}
+    assert copy.timestamp == msg.timestamp
+    assert copy.to_dict() == MCPMessage.from_dict(copy.to_dict()).to_dict()
+
+
+def test_unknown_schema_version_is_rejected():
+    data = msgpack.packb([SCHEMA_VERSION + 1, "UI", "RetrievalAgent", "QUERY", "t", 0.0, {}])
+    with pytest.raises(ValueError, match="schema version"):
+        MCPMessage.from_bytes(data)
+
+
+def test_invalid_fields_make_a_creation_error():
+    msg = MCPMessage("UI", "", "QUERY", {})
+    assert msg.msg_type == "CREATION_ERROR" and msg.is_error_message()
+    assert msg.payload["error"] == "receiver must be a non-empty string"
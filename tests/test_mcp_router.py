@@ -0,0 +1,118 @@
+# tests/test_mcp_router.py
+import asyncio
+import threading
+import time
+
+from mcp import MCPMessage
+from mcp_router import MCPRouter
+
+
+def query(text, receiver="RetrievalAgent"):
+    return MCPMessage("UI", receiver, "QUERY", {"query": text}).to_dict()
+
+
+def reply(msg, sender, receiver, msg_type, **payload):
+    return MCPMessage(sender, receiver, msg_type, dict(msg["payload"], **payload), trace_id=msg["trace_id"])
+
+
+def test_requests_are_routed_through_every_agent():
+    # Two sync retrieval workers must be busy at the same time to pass the barrier.
+    barrier = threading.Barrier(2)
+
+    def retrieve(msg):
+        barrier.wait(timeout=5)
+        return reply(msg, "RetrievalAgent", "LLMResponseAgent", "RETRIEVAL_RESULT", context=["c"])
+
+    async def answer(msg):
+        return reply(msg, "LLMResponseAgent", "UI", "FINAL_RESPONSE", answer=msg["payload"]["query"].upper())
+
+    async def run():
+        router = MCPRouter()
+        router.register("RetrievalAgent", retrieve, concurrency=2)
+        router.register("LLMResponseAgent", answer)
+        messages = [query("first"), query("second")]
+        replies = await asyncio.gather(*(router.request(m, timeout=5) for m in messages))
+        stats = router.get_stats()
+        await router.stop()
+        return messages, replies, stats
+
+    messages, replies, stats = asyncio.run(run())
+    assert [r["type"] for r in replies] == ["FINAL_RESPONSE", "FINAL_RESPONSE"]
+    assert [r["payload"]["answer"] for r in replies] == ["FIRST", "SECOND"]
+    assert [r["trace_id"] for r in replies] == [m["trace_id"] for m in messages]
+    assert stats["agents"]["RetrievalAgent"]["processed"] == 2
+    assert stats["agents"]["LLMResponseAgent"]["processed"] == 2
+    assert stats["pending_traces"] == 0
+
+
+def test_a_full_inbox_holds_back_the_sender():
+    release = threading.Event()
+
+    def slow(msg):
+        release.wait(timeout=5)
+
+    async def run():
+        router = MCPRouter()
+        router.register("Slow", slow, concurrency=1, queue_size=1)
+        await router.start()
+        await router.dispatch(query("first", "Slow"))
+        while router.get_stats()["agents"]["Slow"]["in_flight"] == 0:
+            await asyncio.sleep(0.01)
+        await router.dispatch(query("second", "Slow"))
+        try:
+            await asyncio.wait_for(router.dispatch(query("third", "Slow")), 0.2)
+            held_back = False
+        except asyncio.TimeoutError:
+            held_back = True
+        queued = router.get_stats()["agents"]["Slow"]["queued"]
+        release.set()
+        await router.routes["Slow"].inbox.join()
+        stats = router.get_stats()["agents"]["Slow"]
+        await router.stop()
+        return held_back, queued, stats
+
+    held_back, queued, stats = asyncio.run(run())
+    assert held_back and queued == 1
+    assert stats["processed"] == 2 and stats["queued"] == 0
+
+
+def test_errors_and_timeouts_come_back_as_error_replies():
+    def broken(msg):
+        raise ValueError("no index loaded")
+
+    def stuck(msg):
+        time.sleep(0.5)
+
+    async def run():
+        router = MCPRouter()
+        router.register("Broken", broken)
+        router.register("Stuck", stuck, timeout=0.05)
+        replies = [await router.request(query("q", "Broken"), timeout=5),
+                   await router.request(query("q", "Stuck"), timeout=5)]
+        stats = router.get_stats()["agents"]
+        await router.stop()
+        return replies, stats
+
+    (error, timeout), stats = asyncio.run(run())
+    assert (error["type"], error["payload"]["error_type"], error["payload"]["error"]) == \
+        ("ERROR", "ValueError", "no index loaded")
+    assert (timeout["type"], timeout["payload"]["error_type"]) == ("ERROR", "TimeoutError")
+    assert stats["Broken"]["errors"] == 1 and stats["Stuck"]["timeouts"] == 1
+
+
+def test_streamed_replies_arrive_until_the_final_one():
+    def tokens(msg):
+        for token in ["a", "b"]:
+            yield reply(msg, "LLMResponseAgent", "UI", "PARTIAL_RESPONSE", token=token, done=False)
+        yield reply(msg, "LLMResponseAgent", "UI", "FINAL_RESPONSE", done=True)
+
+    async def run():
+        router = MCPRouter()
+        router.register("LLMResponseAgent", tokens)
+        replies = [r async for r in router.stream(query("q", "LLMResponseAgent"), timeout=5)]
+        await router.stop()
+        return replies
+
+    replies = asyncio.run(run())
+    assert [r["type"] for r in replies] == ["PARTIAL_RESPONSE", "PARTIAL_RESPONSE", "FINAL_RESPONSE"]
+    assert [r["payload"].get("token") for r in replies[:2]] == ["a", "b"]
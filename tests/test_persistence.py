@@ -0,0 +1,61 @@
+# tests/test_persistence.py
+import os
+
+from embeddings import HashingBackend
+from vector_store import VectorStore
+
+
+def open_store(path):
+    return VectorStore(persist_path=str(path / "index"), cache_path=str(path / "embedding_cache"),
+                       embedding_backend=HashingBackend(), index_type="flat")
+
+
+def close_store(store):
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+def test_corrupt_segment_is_quarantined_and_numbering_resumes(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(4):
+        store.add_documents([f"chunk number {i}"], doc_id=f"doc-{i}")
+    close_store(store)
+    segment = os.path.join(str(tmp_path / "index"), "segments", "seg-000002.bin")
+    with open(segment, "r+b") as f:
+        f.truncate(10)
+
+    store = open_store(tmp_path)
+    assert store.get_stats()['total_documents'] == 1
+    assert store.log.next_segment == 2
+    assert sorted(os.listdir(store.log.segments_dir)) == ["seg-000001.bin"]
+    assert len(os.listdir(store.log.quarantine_dir)) == 3
+    store.add_documents(["added after recovery"], doc_id="later")
+    close_store(store)
+
+    store = open_store(tmp_path)
+    assert store.get_stats()['total_documents'] == 2
+    assert store.has_document("later")
+    store.compact(force=True)
+    assert store.log.pending_segments() == []
+    close_store(store)
+
+    store = open_store(tmp_path)
+    assert store.get_stats()['total_documents'] == 2
+    assert [r['doc_id'] for r in store.retrieve("added after recovery", top_k=1)] == ["later"]
+    close_store(store)
+
+
+def test_compaction_waits_for_a_share_of_the_base(tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                        embedding_backend=HashingBackend(), index_type="flat", compact_ratio=0.5, min_compact_rows=4)
+    for i in range(4):
+        store.add_documents([f"first batch chunk {i}"])
+        store.wait_for_maintenance()
+    assert store.log.generation == 1
+    for i in range(20):
+        store.add_documents([f"small upload {i}"])
+        store.wait_for_maintenance()
+    # Bases of 4, 8, 12 and 18 rows: each compaction waits for half the base again.
+    assert store.log.generation == 4
+    assert store.index.ntotal == 18 and store.delta_index.ntotal == 6
+    close_store(store)
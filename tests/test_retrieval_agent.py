@@ -0,0 +1,16 @@
+# tests/test_retrieval_agent.py
+from agents.retrieval_agent import RetrievalAgent
+
+
+class FailingStore:
+    def retrieve_batch(self, queries, top_k=3, mode=None):
+        raise RuntimeError("index unavailable")
+
+
+def test_batch_error_goes_back_to_the_sender():
+    agent = RetrievalAgent(FailingStore())
+    reply = agent.handle_batch_query({"sender": "EvalHarness", "payload": {"queries": ["boiler pressure"]},
+                                      "trace_id": "t-1"})
+    assert reply.msg_type == "ERROR"
+    assert reply.receiver == "EvalHarness"
+    assert reply.payload["error_type"] == "RuntimeError"
@@ -0,0 +1,59 @@
+# tests/test_sharded_store.py
+import numpy as np
+import pytest
+
+from benchmarks.pipeline import synthetic_corpus
+from embeddings import HashingBackend
+from sharded_store import SHARD_ID_SHIFT, ShardedVectorStore, merge_shard_results
+from vector_store import VectorStore
+
+
+def dense(shard, *distances):
+    return [{"text": f"{shard}-{i}", "distance": d} for i, d in enumerate(distances)]
+
+
+def fused(shard, *scores):
+    return [{"text": f"{shard}-{i}", "distance": None, "score": s} for i, s in enumerate(scores)]
+
+
+def test_dense_results_merge_by_distance():
+    merged = merge_shard_results([dense("a", 0.1, 0.4), dense("b", 0.2, 0.3), []], top_k=3)
+    assert [r["text"] for r in merged] == ["a-0", "b-0", "b-1"]
+
+
+def test_fused_results_merge_by_score():
+    merged = merge_shard_results([fused("a", 0.9, 0.2), fused("b", 0.5, 0.4)], top_k=3)
+    assert [r["text"] for r in merged] == ["a-0", "b-0", "b-1"]
+
+
+def test_mixed_results_fall_back_to_distance():
+    # A shard whose lexical index is still building answers dense.
+    per_shard = [fused("a", 0.9) + [{"text": "a-d", "distance": 0.5, "score": 0.1}], dense("b", 0.3)]
+    per_shard[0][0]["distance"] = 0.7
+    merged = merge_shard_results(per_shard + [[{"text": "c-0", "distance": None}]], top_k=4)
+    assert [r["text"] for r in merged] == ["b-0", "a-d", "a-0", "c-0"]
+
+
+def test_sharded_search_matches_a_single_store(tmp_path):
+    backend = HashingBackend(dimension=64)
+    corpus = synthetic_corpus(300, words=20)
+    doc_ids = [f"doc-{i // 10}" for i in range(len(corpus))]
+    single = VectorStore(persist_path=str(tmp_path / "single"), cache_path=str(tmp_path / "cache"),
+                         embedding_backend=backend, index_type="flat")
+    single.add_documents(corpus, doc_id=doc_ids)
+    sharded = ShardedVectorStore(persist_path=str(tmp_path / "sharded"), num_shards=3, embedding_backend=backend,
+                                 index_type="flat")
+    for doc in sorted(set(doc_ids)):
+        sharded.add_documents([c for c, d in zip(corpus, doc_ids) if d == doc], doc_id=doc)
+    try:
+        for query in corpus[::50]:
+            expected = single.retrieve(query, top_k=5)
+            results = sharded.retrieve(query, top_k=5)
+            assert [r["distance"] for r in results] == pytest.approx([r["distance"] for r in expected], abs=1e-5)
+            assert results[0]["text"] == query
+            assert len({r["chunk_id"] >> SHARD_ID_SHIFT for r in sharded.retrieve(query, top_k=30)}) == 3
+        assert sharded.ntotal == len(corpus)
+    finally:
+        single.wait_for_maintenance()
+        single.embedding_cache.close()
+        sharded.close()
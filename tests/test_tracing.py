@@ -0,0 +1,55 @@
+# tests/test_tracing.py
+import pytest
+
+from tracing import BUCKETS, METRIC_NAME, Histogram, Tracer
+
+
+def histogram(*samples):
+    h = Histogram()
+    for seconds in samples:
+        h.observe(seconds)
+    return h
+
+
+def test_quantile_interpolates_inside_the_bucket():
+    h = histogram(*[0.0007] * 4, *[0.004] * 4)
+    assert h.quantile(0.25) == pytest.approx(0.00075)
+    assert h.quantile(0.75) == pytest.approx(0.00375)
+    # Never above the largest observation.
+    assert h.quantile(1.0) == pytest.approx(0.004)
+    assert Histogram().quantile(0.5) is None
+
+
+def test_quantile_past_the_last_bucket_uses_the_max():
+    h = histogram(0.001, 100.0)
+    assert h.quantile(0.99) == pytest.approx(BUCKETS[-1] + (100.0 - BUCKETS[-1]) * 0.98)
+    assert h.counts[-1] == 1 and h.max == 100.0
+
+
+def test_prometheus_buckets_are_cumulative():
+    tracer = Tracer(enabled=True)
+    for seconds in (0.001, 0.003, 0.003, 2.0):
+        tracer.record("retrieve", seconds)
+    tracer.record("embed", 0.02, trace_id="t1", batch=3)
+    lines = tracer.to_prometheus().splitlines()
+    assert lines[:2] == [f"# HELP {METRIC_NAME} Latency of each pipeline stage.", f"# TYPE {METRIC_NAME} histogram"]
+    retrieve = {line.split("} ")[0] + "}": line.split("} ")[1] for line in lines if 'stage="retrieve"' in line}
+    assert retrieve[f'{METRIC_NAME}_bucket{{stage="retrieve",le="0.001"}}'] == "1"
+    assert retrieve[f'{METRIC_NAME}_bucket{{stage="retrieve",le="0.005"}}'] == "3"
+    assert retrieve[f'{METRIC_NAME}_bucket{{stage="retrieve",le="1.0"}}'] == "3"
+    assert retrieve[f'{METRIC_NAME}_bucket{{stage="retrieve",le="+Inf"}}'] == "4"
+    assert float(retrieve[f'{METRIC_NAME}_sum{{stage="retrieve"}}']) == pytest.approx(2.007)
+    assert retrieve[f'{METRIC_NAME}_count{{stage="retrieve"}}'] == "4"
+    assert len(retrieve) == len(BUCKETS) + 3
+    # Stages come out sorted; the spans of a trace are kept with their attributes.
+    assert lines.index(f'{METRIC_NAME}_count{{stage="embed"}} 1') < lines.index(
+        f'{METRIC_NAME}_count{{stage="retrieve"}} 4')
+    assert [(s["stage"], s["batch"]) for s in tracer.trace("t1")] == [("embed", 3)]
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    with tracer.span("retrieve"):
+        pass
+    tracer.record("embed", 0.1)
+    assert tracer.to_json()["stages"] == {}
@@ -0,0 +1,100 @@
+# tests/test_vector_store.py
+import pytest
+
+from benchmarks.pipeline import synthetic_corpus
+from embeddings import HashingBackend
+from sharded_store import ShardedVectorStore
+from vector_store import VectorStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VectorStore(persist_path=str(tmp_path / "index"), cache_path=str(tmp_path / "embedding_cache"),
+                        embedding_backend=HashingBackend(), index_type="flat")
+    yield store
+    store.wait_for_maintenance()
+    store.embedding_cache.close()
+
+
+def docs_with(store, text):
+    return sorted(r['doc_id'] for r in store.retrieve(text, top_k=10) if r['text'] == text)
+
+
+def test_shared_chunk_is_indexed_for_each_document(store):
+    store.add_documents(["shared boiler"], doc_id="X")
+    store.add_documents(["shared boiler", "y only"], doc_id="Y")
+    assert len(store.document_chunk_ids("Y")) == 2
+    assert docs_with(store, "shared boiler") == ["X", "Y"]
+
+
+def test_delete_keeps_other_documents_copy(store):
+    store.add_documents(["shared boiler"], doc_id="X")
+    store.add_documents(["shared boiler", "y only"], doc_id="Y")
+    assert store.delete_document("X") == 1
+    assert docs_with(store, "shared boiler") == ["Y"]
+    assert len(store.document_chunk_ids("Y")) == 2
+
+
+def test_replace_after_delete_reindexes(store):
+    # IngestionAgent with replace_existing: delete the old version, add the new one.
+    store.add_documents(["shared boiler"], doc_id="X")
+    store.add_documents(["shared boiler", "y only"], doc_id="Y")
+    store.delete_document("Y")
+    store.add_documents(["shared boiler", "y revised"], doc_id="Y")
+    assert docs_with(store, "shared boiler") == ["X", "Y"]
+    assert docs_with(store, "y only") == []
+    assert docs_with(store, "y revised") == ["Y"]
+
+
+def test_upsert_keeps_other_documents_copy(store):
+    store.add_documents(["shared boiler"], doc_id="X")
+    store.add_documents(["shared boiler", "y only"], doc_id="Y")
+    store.upsert_document("X", ["x revised"])
+    assert docs_with(store, "shared boiler") == ["Y"]
+    store.upsert_document("X", ["shared boiler"])
+    assert docs_with(store, "shared boiler") == ["X", "Y"]
+
+
+def test_delete_forgets_the_documents_files(store):
+    store.add_documents(["first chunk", "second chunk"], file_hash="file-1", file_name="a.txt", doc_id="a.txt")
+    store.mark_file("file-2", "b.txt", 1, doc_id="b.txt")
+    assert store.has_file("file-1")
+    store.delete_document("a.txt")
+    assert not store.has_file("file-1")
+    assert store.has_file("file-2")
+    store.add_documents(["first chunk", "second chunk"], file_hash="file-1", file_name="a.txt", doc_id="a.txt")
+    assert len(store.document_chunk_ids("a.txt")) == 2
+
+
+def test_upsert_forgets_the_documents_files(store):
+    store.add_documents(["first chunk"], file_hash="file-1", file_name="a.txt", doc_id="a.txt")
+    store.upsert_document("a.txt", ["new chunk"])
+    assert not store.has_file("file-1")
+
+
+def test_doc_id_list_must_match_chunks(store):
+    with pytest.raises(ValueError):
+        store.add_documents(["one", "two", "three"], doc_id=["x"])
+    assert store.ntotal == 0
+
+
+@pytest.mark.parametrize("mode", ["hybrid", "lexical"])
+def test_retrieve_batch_fuses_like_retrieve(store, mode):
+    corpus = synthetic_corpus(200, words=20)
+    store.add_documents(corpus, doc_id=[f"doc-{i // 10}" for i in range(len(corpus))])
+    queries = [corpus[3], " ".join(corpus[77].split()[:5]), "no such words"]
+    batch = store.retrieve_batch(queries, top_k=5, mode=mode)
+    assert batch == [store.retrieve(query, top_k=5, mode=mode) for query in queries]
+    assert all(r['score'] is not None for results in batch for r in results)
+
+
+def test_sharded_retrieve_batch_fuses_like_retrieve(tmp_path):
+    sharded = ShardedVectorStore(persist_path=str(tmp_path / "sharded"), num_shards=2, embedding_backend="hash",
+                                 index_type="flat", retrieval_mode="hybrid")
+    corpus = synthetic_corpus(200, words=20)
+    sharded.add_documents(corpus, doc_id=[f"doc-{i // 10}" for i in range(len(corpus))])
+    queries = [corpus[3], " ".join(corpus[150].split()[:5])]
+    batch = sharded.retrieve_batch(queries, top_k=5)
+    assert [[r['chunk_id'] for r in results] for results in batch] == \
+        [[r['chunk_id'] for r in sharded.retrieve(query, top_k=5)] for query in queries]
+    sharded.close()
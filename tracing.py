@@ -0,0 +1,232 @@
+# tracing.py
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus-style cumulative buckets, in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_TRACES = 1000
+MAX_SPANS_PER_TRACE = 256
+METRIC_NAME = "rag_stage_duration_seconds"
+
+# The trace the current thread (or task) is working on; nested spans inherit it, so
+# VectorStore spans land in the trace of the agent call that triggered them.
+_current_trace = contextvars.ContextVar("rag_trace_id", default=None)
+
+
+def new_trace_id():
+    return str(uuid.uuid4())
+
+
+def current_trace_id():
+    return _current_trace.get()
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation.
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "stage", "trace_id", "attrs", "start", "wall_start", "_token")
+
+    def __init__(self, tracer, stage, trace_id, attrs):
+        self.tracer = tracer
+        self.stage = stage
+        self.trace_id = trace_id
+        self.attrs = attrs
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace_id)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_trace.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer._record(self.stage, duration, self.trace_id, self.attrs, self.wall_start)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    # Spans per trace_id (the most recent max_traces traces) and one latency histogram
+    # per stage. When disabled, span() returns a shared no-op and record() returns at
+    # once, so instrumented code pays one attribute check per call.
+    def __init__(self, enabled=False, max_traces=MAX_TRACES):
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self._histograms = {}
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def span(self, stage, trace_id=None, **attrs):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, stage, trace_id or _current_trace.get(), attrs)
+
+    def record(self, stage, seconds, trace_id=None, **attrs):
+        # For work that cannot sit inside a with block, such as a streaming generator
+        # resumed from different threads.
+        if not self.enabled:
+            return
+        self._record(stage, seconds, trace_id or _current_trace.get(), attrs, time.time() - seconds)
+
+    def _record(self, stage, seconds, trace_id, attrs, wall_start):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if trace_id is None:
+                return
+            spans = self._traces.get(trace_id)
+            if spans is None:
+                spans = self._traces[trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if len(spans) < MAX_SPANS_PER_TRACE:
+                spans.append({"stage": stage, "start": wall_start, "duration_ms": seconds * 1000, **attrs})
+
+    def trace(self, trace_id):
+        with self._lock:
+            return sorted((dict(s) for s in self._traces.get(trace_id, ())), key=lambda s: s["start"])
+
+    def recent_traces(self, n=20):
+        with self._lock:
+            return list(self._traces)[-n:]
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._traces.clear()
+
+    def to_json(self):
+        with self._lock:
+            stages = {}
+            for stage, h in sorted(self._histograms.items()):
+                stages[stage] = {
+                    "count": h.count,
+                    "sum_s": h.sum,
+                    "mean_ms": h.sum / h.count * 1000 if h.count else None,
+                    "p50_ms": h.quantile(0.5) * 1000,
+                    "p95_ms": h.quantile(0.95) * 1000,
+                    "p99_ms": h.quantile(0.99) * 1000,
+                    "max_ms": h.max * 1000,
+                }
+            return {"enabled": self.enabled, "traces": len(self._traces), "stages": stages}
+
+    def to_prometheus(self):
+        lines = [f"# HELP {METRIC_NAME} Latency of each pipeline stage.",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        with self._lock:
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide tracer; RAG_TRACING=1 turns it on at start-up.
+tracer = Tracer(enabled=os.environ.get("RAG_TRACING", "0") not in ("", "0", "false"))
+
+
+def span(stage, trace_id=None, **attrs):
+    if not tracer.enabled:
+        return NOOP_SPAN
+    return Span(tracer, stage, trace_id or _current_trace.get(), attrs)
+
+
+def record(stage, seconds, trace_id=None, **attrs):
+    if tracer.enabled:
+        tracer._record(stage, seconds, trace_id or _current_trace.get(), attrs, time.time() - seconds)
+
+
+def serve_metrics(port=9464, host="127.0.0.1", tracer=tracer):
+    # GET /metrics (Prometheus text), /metrics.json, /traces (recent ids) and
+    # /traces/<trace_id> (that trace's spans), from a daemon thread.
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, content_type):
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/metrics":
+                self._send(tracer.to_prometheus(), "text/plain; version=0.0.4")
+            elif path == "/metrics.json":
+                self._send(json.dumps(tracer.to_json()), "application/json")
+            elif path == "/traces":
+                self._send(json.dumps(tracer.recent_traces()), "application/json")
+            elif path.startswith("/traces/"):
+                self._send(json.dumps(tracer.trace(path[len("/traces/"):])), "application/json")
+            else:
+                self.send_error(404)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,20 +1,90 @@
 # vector_store.py
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import os
-import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from persistence import SegmentLog
+from embedding_cache import EmbeddingCache
+from embeddings import get_backend
+from chunk_store import ChunkList
+from chunk_table import ChunkTable
+from delta_index import DeltaIndex
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from tracing import record, span
+from index_backends import (ADD_BLOCK, StackedVectors, build_index, bytes_per_vector, describe_index, empty_like,
+                            exact_search, index_type_of, merge_results, min_training_size, recall_at_k, recall_report,
+                            search)
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+WRITE_OPERATIONS = ("add_documents", "delete_document", "upsert_document")
 
 class VectorStore:
-    def __init__(self, persist_path="vector_store"):
+    def __init__(self, persist_path="vector_store", compact_ratio=0.25, index_type="ivf_flat",
+                 promote_threshold=20000, retrain_factor=4.0, cache_path="embedding_cache",
+                 cache_size=100000, use_mmap=True, embedding_backend="torch", vector_codec="fp32",
+                 rerank_factor=4, lexical=True, retrieval_mode="dense", hybrid_fetch_factor=4,
+                 encoding_engine=None, min_compact_rows=2048):
         self.persist_path = persist_path
-        self.index_path = os.path.join(persist_path, "faiss_index")
-        self.chunks_path = os.path.join(persist_path, "chunks.pkl")
+        # Compaction rewrites the whole base, so it runs once the rows written since
+        # (added plus deleted) reach compact_ratio of the base, and not before
+        # min_compact_rows: its cost per written chunk stays constant as the corpus grows.
+        self.compact_ratio = compact_ratio
+        self.min_compact_rows = min_compact_rows
+        # Target ANN index; the store starts as IndexFlatL2 and is promoted once it is
+        # large enough for brute force to hurt. "flat" keeps exact search forever.
+        self.index_type = index_type
+        self.promote_threshold = promote_threshold
+        self.retrain_factor = retrain_factor
+        # fp16/sq8/pq shrink the in-RAM index; retrieve then re-ranks rerank_factor * top_k
+        # candidates against the full-precision vectors kept on disk in vectors.npy.
+        self.vector_codec = vector_codec
+        self.rerank_factor = rerank_factor
+        # BM25 over the chunk texts, maintained with every write; retrieval_mode picks
+        # the default of retrieve ("dense", "hybrid" or "lexical"). Hybrid fuses the
+        # top hybrid_fetch_factor * top_k of both rankings.
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode} (expected one of {', '.join(RETRIEVAL_MODES)})")
+        self.retrieval_mode = retrieval_mode
+        self.hybrid_fetch_factor = hybrid_fetch_factor
+        self.lexical_enabled = lexical
+        self.lexical_index = None
+        self._base_vectors = None
+        self._recall_stats = None
+        self.trained_ntotal = 0
+        self.use_mmap = use_mmap
+        self.log = SegmentLog(persist_path)
+        self._lock = threading.RLock()
+        self._maintenance_lock = threading.Lock()
+        self._maintenance_thread = None
+        # Writes queued with submit() run one at a time, in order, on this thread.
+        self._writer = None
+        # self.index is the compacted base, memory-mapped read-only when use_mmap is
+        # set and never written to; new vectors go to delta_index (an immutable
+        # DeltaIndex, replaced on every add) until compaction. Searches never take
+        # _lock: they read the snapshot last published by a writer (see _publish).
+        self._base_mapped = False
+        self._published = None
+        # Bumped whenever the searchable content changes; answer caches key on it.
+        self.generation = 0
         
         try:
-            self.model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-            self.text_chunks = []
+            # Loaded lazily on the first encode; see embeddings.py.
+            self.model = get_backend(embedding_backend)
+            self.model_name = self.model.model_name
+            self.dimension = self.model.dimension
+            self.embedding_cache = EmbeddingCache(cache_path, max_entries=cache_size, namespace=self.model.cache_namespace)
+            # Large adds are encoded by the engine's process pool and indexed window by
+            # window as the embeddings come back; see encoding_engine.py.
+            if encoding_engine is not None and encoding_engine.backend.cache_namespace != self.model.cache_namespace:
+                raise ValueError("encoding_engine must use the store's embedding backend")
+            self.encoding_engine = encoding_engine
+            self.text_chunks = ChunkList()
+            # Stable chunk ids, document ids and tombstones for every row; see chunk_table.py.
+            self.chunk_table = ChunkTable()
             self.index = None
+            self.delta_index = DeltaIndex(self.dimension)
             self._load_or_create_index()
         except Exception as e:
             print(f"VectorStore initialization error: {str(e)}")
@@ -22,86 +92,843 @@ class VectorStore:
     
     def _load_or_create_index(self):
         try:
-            if os.path.exists(self.index_path) and os.path.exists(self.chunks_path):
-                self.index = faiss.read_index(self.index_path)
-                with open(self.chunks_path, 'rb') as f:
-                    self.text_chunks = pickle.load(f)
-                print(f"Loaded existing index with {len(self.text_chunks)} documents")
+            index, chunks, segments = self.log.load(use_mmap=self.use_mmap)
+            self._base_mapped = index is not None and self.use_mmap
+            self._base_vectors = self.log.base_vectors(reconstruct=False) if index is not None else None
+            self._recall_stats = self.log.meta.get("recall")
+            self.index = index if index is not None else faiss.IndexFlatL2(self.dimension)
+            self.text_chunks = ChunkList(chunks)
+            self.chunk_table = self.log.open_table(len(chunks))
+            self.trained_ntotal = self.log.meta.get("trained_ntotal", 0)
+            replayed = []
+            for _, vectors, seg_chunks, record in segments:
+                if len(seg_chunks):
+                    replayed.append(vectors)
+                    self.text_chunks.extend(seg_chunks)
+                    ids = record["ids"] or self.chunk_table.assign(len(seg_chunks))
+                    self.chunk_table.extend(ids, record["doc_ids"] or [None] * len(seg_chunks))
+                self.chunk_table.delete(record["deleted"])
+            self.delta_index = DeltaIndex(self.dimension).add(np.vstack(replayed) if replayed else [])
+            with self._lock:
+                self._publish()
+            if self.text_chunks:
+                print(f"Loaded existing index with {len(self.text_chunks)} documents ({len(segments)} pending segments)")
             else:
-                self.index = faiss.IndexFlatL2(384)
-                self.text_chunks = []
-                os.makedirs(self.persist_path, exist_ok=True)
                 print("Created new vector store")
+            if self.text_chunks and self.embedding_cache.indexed_count() == 0:
+                # Stores created before the chunk registry existed: register once so
+                # re-uploads of already indexed text are still deduplicated.
+                cache = self.embedding_cache
+                cache.mark_indexed([cache.index_key(cache.chunk_hash(c), self.chunk_table.doc_of(row))
+                                    for row, c in enumerate(self.text_chunks)])
+            self._start_lexical_build()
+            if self._needs_compaction() or self._needs_retrain():
+                self._schedule_maintenance()
         except Exception as e:
             print(f"Error loading/creating index: {str(e)}")
-            self.index = faiss.IndexFlatL2(384)
-            self.text_chunks = []
+            self.index = faiss.IndexFlatL2(self.dimension)
+            self.delta_index = DeltaIndex(self.dimension)
+            self.text_chunks = ChunkList()
+            self.chunk_table = ChunkTable()
+            self._base_mapped = False
+            self._base_vectors = None
+            with self._lock:
+                self._publish()
+            self._start_lexical_build()
+    
+    def _start_lexical_build(self):
+        # The inverted index is not persisted: it is rebuilt from the chunk texts in the
+        # background, and retrieve falls back to dense search until it is ready.
+        if not self.lexical_enabled:
+            self.lexical_index = None
+            return
+        self.lexical_index = BM25Index()
+        if not self.text_chunks:
+            self.lexical_index.ready = True
+            return
+        threading.Thread(target=self._build_lexical, args=(self.lexical_index,), daemon=True).start()
+    
+    def _build_lexical(self, lexical, batch_size=2048):
+        try:
+            with self._lock:
+                chunks, table = self.text_chunks, self.chunk_table
+                n = len(chunks)
+                tombstones = sorted(table.tombstones)
+            # Deletes first, so chunks deleted meanwhile are skipped by add.
+            lexical.remove(tombstones)
+            for start in range(0, n, batch_size):
+                if lexical is not self.lexical_index:
+                    return
+                rows = np.arange(start, min(start + batch_size, n))
+                lexical.add(table.ids_of(rows), [chunks[int(r)] for r in rows])
+            lexical.ready = True
+            print(f"Built lexical index over {lexical.num_docs} chunks")
+        except Exception as e:
+            print(f"Error building lexical index: {str(e)}")
     
-    def add_documents(self, chunks):
+    def has_file(self, file_hash):
+        return self.embedding_cache.has_file(file_hash)
+    
+    def mark_file(self, file_hash, file_name=None, num_chunks=0, doc_id=None):
+        # With doc_id, deleting or replacing that document forgets the file again.
+        self.embedding_cache.mark_file(file_hash, file_name, num_chunks, doc_id)
+    
+    def unmark_document_files(self, doc_id):
+        return self.embedding_cache.unmark_document_files(doc_id)
+    
+    @property
+    def ingest_batch_size(self):
+        # How many chunks callers should hand to add_documents at once.
+        return self.encoding_engine.window if self.encoding_engine is not None else 64
+    
+    def add_documents(self, chunks, file_hash=None, file_name=None, doc_id=None):
+        # doc_id is one document id for every chunk, or a list with one per chunk.
+        # Large adds are appended as one segment per encoded window, so the first
+        # chunks are searchable before the last are embedded.
         try:
-            valid_chunks = [chunk for chunk in chunks if chunk and chunk.strip()]
-            if not valid_chunks:
+            cache = self.embedding_cache
+            if isinstance(doc_id, (list, tuple)):
+                if len(doc_id) != len(chunks):
+                    raise ValueError(f"doc_id has {len(doc_id)} entries for {len(chunks)} chunks")
+                doc_ids, file_doc = doc_id, None
+            else:
+                doc_ids, file_doc = [doc_id] * len(chunks), doc_id
+            valid = [(chunk, d) for chunk, d in zip(chunks, doc_ids) if chunk and chunk.strip()]
+            valid_chunks = [chunk for chunk, _ in valid]
+            hashes = [cache.chunk_hash(chunk) for chunk in valid_chunks]
+            # Deduplicated per document: text already indexed under another document is
+            # indexed again for this one (its embedding still comes from the cache).
+            keys = [cache.index_key(h, d) for (_, d), h in zip(valid, hashes)]
+            already_indexed = cache.indexed(keys)
+            new_chunks, new_hashes, new_keys, new_docs, seen = [], [], [], [], set()
+            for (chunk, d), h, key in zip(valid, hashes, keys):
+                if key in already_indexed or key in seen:
+                    continue
+                seen.add(key)
+                new_chunks.append(chunk)
+                new_hashes.append(h)
+                new_keys.append(key)
+                new_docs.append(d)
+            if not new_chunks:
+                if file_hash:
+                    cache.mark_file(file_hash, file_name, len(valid_chunks), file_doc)
                 return
             
-            embeddings = self.model.encode(valid_chunks)
-            embeddings = np.array(embeddings).astype("float32")
-            if embeddings.ndim == 1:
-                embeddings = embeddings.reshape(1, -1)
-            
-            self.index.add(embeddings)
-            self.text_chunks.extend(valid_chunks)
-            self._save_index()
+            for first, embeddings in self._embed_stream(new_chunks, new_hashes):
+                last = first + len(embeddings)
+                window_chunks, window_docs = new_chunks[first:last], new_docs[first:last]
+                with span("vector_store.append", chunks=len(window_chunks)), self._lock:
+                    # The segment is durable before the in-memory index changes, so a crash
+                    # never exposes chunks that would be lost on restart.
+                    ids = self.chunk_table.assign(len(window_chunks))
+                    self.log.append(embeddings, window_chunks, ids=ids, doc_ids=window_docs)
+                    self.delta_index = self.delta_index.add(embeddings)
+                    self.text_chunks.extend(window_chunks)
+                    self.chunk_table.extend(ids, window_docs)
+                    self.generation += 1
+                    self._publish()
+                    lexical = self.lexical_index
+                if lexical is not None:
+                    lexical.add(ids, window_chunks)
+                cache.mark_indexed(new_keys[first:last])
+            if file_hash:
+                cache.mark_file(file_hash, file_name, len(valid_chunks), file_doc)
+            if self._needs_compaction() or self._needs_retrain():
+                self._schedule_maintenance()
         except Exception as e:
             print(f"Error adding documents: {str(e)}")
             raise
     
-    def _save_index(self):
+    def has_document(self, doc_id):
+        with self._lock:
+            return doc_id in self.chunk_table.documents()
+    
+    def document_chunk_ids(self, doc_id):
+        with self._lock:
+            return self.chunk_table.document_chunks(doc_id)
+    
+    def _chunk_keys(self, chunk_ids, doc_id):
+        cache = self.embedding_cache
+        rows = self.chunk_table.rows_of(chunk_ids)
+        return [cache.index_key(cache.chunk_hash(self.text_chunks[int(r)]), doc_id) for r in rows if r >= 0]
+    
+    def delete_document(self, doc_id):
+        # Tombstones the document's chunks: O(chunks in the document). Their rows stay in
+        # the index, excluded from every search, until compaction drops them. Files
+        # recorded for the document are forgotten, so uploading one again re-indexes it.
+        try:
+            self.embedding_cache.unmark_document_files(doc_id)
+            with self._lock:
+                old_ids = self.chunk_table.document_chunks(doc_id)
+                if not old_ids:
+                    return 0
+                old_keys = self._chunk_keys(old_ids, doc_id)
+                self.log.append(np.zeros((0, self.dimension), dtype="float32"), [], ids=[], doc_ids=[], deleted=old_ids)
+                self.chunk_table.delete(old_ids)
+                self.generation += 1
+                self._publish()
+                lexical = self.lexical_index
+            if lexical is not None:
+                lexical.remove(old_ids)
+            self.embedding_cache.unmark_indexed(old_keys)
+            if self._needs_compaction():
+                self._schedule_maintenance()
+            return len(old_ids)
+        except Exception as e:
+            print(f"Error deleting document {doc_id}: {str(e)}")
+            raise
+    
+    def upsert_document(self, doc_id, chunks):
+        # Replaces the document's chunks in one segment, so a crash leaves either the old
+        # or the new version. Unchanged chunks are re-added from the embedding cache.
+        # Files recorded for the old version are forgotten, as in delete_document.
+        try:
+            new_chunks, new_hashes, seen = [], [], set()
+            for chunk in chunks:
+                if not chunk or not chunk.strip():
+                    continue
+                h = self.embedding_cache.chunk_hash(chunk)
+                if h in seen:
+                    continue
+                seen.add(h)
+                new_chunks.append(chunk)
+                new_hashes.append(h)
+            embeddings = self._embed_chunks(new_chunks, new_hashes) if new_chunks else \
+                np.zeros((0, self.dimension), dtype="float32")
+            with self._lock:
+                old_ids = self.chunk_table.document_chunks(doc_id)
+                old_keys = self._chunk_keys(old_ids, doc_id)
+                ids = self.chunk_table.assign(len(new_chunks))
+                doc_ids = [doc_id] * len(new_chunks)
+                self.log.append(embeddings, new_chunks, ids=ids, doc_ids=doc_ids, deleted=old_ids)
+                if new_chunks:
+                    self.delta_index = self.delta_index.add(embeddings)
+                    self.text_chunks.extend(new_chunks)
+                    self.chunk_table.extend(ids, doc_ids)
+                self.chunk_table.delete(old_ids)
+                self.generation += 1
+                self._publish()
+                lexical = self.lexical_index
+            if lexical is not None:
+                lexical.remove(old_ids)
+                lexical.add(ids, new_chunks)
+            new_keys = [self.embedding_cache.index_key(h, doc_id) for h in new_hashes]
+            self.embedding_cache.unmark_indexed(list(set(old_keys) - set(new_keys)))
+            self.embedding_cache.mark_indexed(new_keys)
+            self.embedding_cache.unmark_document_files(doc_id)
+            if self._needs_compaction() or self._needs_retrain():
+                self._schedule_maintenance()
+            return {"added": len(new_chunks), "deleted": len(old_ids)}
+        except Exception as e:
+            print(f"Error upserting document {doc_id}: {str(e)}")
+            raise
+    
+    def _encoder_for(self, num_chunks):
+        engine = self.encoding_engine
+        return engine if engine is not None and num_chunks >= engine.min_parallel else None
+    
+    def _embed_chunks(self, chunks, hashes, cached=None):
+        if cached is None:
+            cached = self.embedding_cache.get_many(hashes)
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        embeddings = np.empty((len(chunks), self.dimension), dtype="float32")
+        if missing:
+            with span("vector_store.embed", chunks=len(missing), cached=len(chunks) - len(missing)):
+                encoder = self._encoder_for(len(missing)) or self.model
+                encoded = encoder.encode([chunks[i] for i in missing])
+            embeddings[missing] = encoded
+            self.embedding_cache.put_many([hashes[i] for i in missing], encoded)
+        for i, h in enumerate(hashes):
+            if h in cached:
+                embeddings[i] = cached[h]
+        return embeddings
+    
+    def _embed_stream(self, chunks, hashes):
+        # Yields (first, embeddings) for consecutive slices of chunks. Without an engine,
+        # or for a small add, that is one slice; otherwise a slice ends at the last
+        # chunk of each window the engine returns, with cached rows filled in around it.
+        cached = self.embedding_cache.get_many(hashes)
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        engine = self._encoder_for(len(missing))
+        if engine is None:
+            yield 0, self._embed_chunks(chunks, hashes, cached)
+            return
+        first = 0
+        start = time.perf_counter()
+        for offset, encoded in engine.iter_encode([chunks[i] for i in missing]):
+            record("vector_store.embed", time.perf_counter() - start, chunks=len(encoded), workers=engine.workers)
+            rows = missing[offset:offset + len(encoded)]
+            self.embedding_cache.put_many([hashes[i] for i in rows], encoded)
+            last = rows[-1] + 1 if offset + len(encoded) < len(missing) else len(chunks)
+            embeddings = np.empty((last - first, self.dimension), dtype="float32")
+            embeddings[np.asarray(rows) - first] = encoded
+            for i in range(first, last):
+                if hashes[i] in cached:
+                    embeddings[i - first] = cached[hashes[i]]
+            yield first, embeddings
+            first = last
+            start = time.perf_counter()
+    
+    @property
+    def ntotal(self):
+        return self.index.ntotal + self.delta_index.ntotal
+    
+    def _needs_compaction(self):
+        written = self.delta_index.ntotal + len(self.chunk_table.tombstones)
+        return written >= max(self.min_compact_rows, self.compact_ratio * self.index.ntotal)
+    
+    def _needs_retrain(self):
+        current, codec = describe_index(self.index)
+        ntotal = self.ntotal
+        if (current, codec) != (self.index_type, self.vector_codec):
+            needed = min_training_size(self.index_type, self.vector_codec)
+            if current == "flat" and codec == "fp32" and self.index_type != "flat":
+                needed = max(needed, self.promote_threshold)
+            return ntotal >= max(needed, 1)
+        # IVF centroids and quantizer ranges drift out of shape as the corpus grows;
+        # HNSW graphs and fp16 need no training.
+        if (current in ("ivf_flat", "ivf_pq") or codec in ("sq8", "pq")) and self.trained_ntotal:
+            return ntotal >= self.retrain_factor * self.trained_ntotal
+        return False
+    
+    def _schedule_maintenance(self):
+        with self._lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return
+            self._maintenance_thread = threading.Thread(target=self._run_maintenance, daemon=True)
+            self._maintenance_thread.start()
+    
+    def _run_maintenance(self):
+        retrained = False
+        if self._needs_retrain():
+            retrained = self.retrain()
+        self.compact(force=retrained)
+        if retrained:
+            self.measure_recall_loss()
+    
+    def retrain(self, index_type=None, vector_codec=None):
+        # Builds the new index off-lock, trained on a sample and filled block by block
+        # from the memory-mapped base vectors and the delta, then swaps it in; vectors
+        # appended meanwhile stay in the delta. Until the next compaction writes them to
+        # vectors.npy, the delta's share of the new base is read from a copy in RAM.
         try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.chunks_path, 'wb') as f:
-                pickle.dump(self.text_chunks, f)
+            start = time.perf_counter()
+            with self._maintenance_lock:
+                index_type = index_type or self.index_type
+                vector_codec = vector_codec or self.vector_codec
+                with self._lock:
+                    base, delta, base_vectors = self.index, self.delta_index, self._base_vectors
+                    expected = self.ntotal
+                if base_vectors is None and base.ntotal:
+                    base_vectors = self.log.base_vectors()
+                parts = [base_vectors[:base.ntotal]] if base.ntotal else []
+                if delta.ntotal:
+                    parts.append(delta.reconstruct_n(0, delta.ntotal))
+                vectors = StackedVectors(parts)
+                if len(vectors) != expected:
+                    raise ValueError(f"full-precision vectors ({len(vectors)}) do not match index size ({expected})")
+                new_index = build_index(index_type, self.dimension, vectors, codec=vector_codec)
+                with self._lock:
+                    remaining = self.ntotal - expected
+                    self.index = new_index
+                    self.delta_index = self.delta_index.tail(self.delta_index.ntotal - remaining)
+                    self._base_vectors = vectors
+                    self._base_mapped = False
+                    self.trained_ntotal = len(vectors)
+                    self._publish()
+            record("vector_store.retrain", time.perf_counter() - start, vectors=new_index.ntotal)
+            print(f"Rebuilt vector index as {index_type}/{vector_codec} over {new_index.ntotal} vectors")
+            return True
         except Exception as e:
-            print(f"Error saving index: {str(e)}")
+            print(f"Error retraining index: {str(e)}")
+            return False
+    
+    def compact(self, force=False):
+        # Folds the delta into a new base snapshot, then re-opens that snapshot (mapped)
+        # and keeps only the vectors added while it was being written in the delta.
+        # Rows of deleted chunks are dropped here; the index is refilled from the
+        # full-precision vectors with its trained parameters (centroids, codebooks) kept.
+        try:
+            start = time.perf_counter()
+            with self._maintenance_lock:
+                with self._lock:
+                    upto = self.log.next_segment - 1
+                    base = self.index
+                    delta_n = self.delta_index.ntotal
+                    snapshot_n = base.ntotal + delta_n
+                    tombstones = self.chunk_table.tombstone_rows()
+                    purge = tombstones[tombstones < snapshot_n]
+                    if upto <= self.log.segment_upto and not force and not len(purge):
+                        return
+                    base_mapped = self._base_mapped
+                    base_vectors = self._base_vectors
+                    delta = self.delta_index
+                    base_chunks, tail_len = self.text_chunks.snapshot()
+                    table = self.chunk_table
+                    table_tail_len = table.snapshot()
+                    purged_ids = table.ids_of(purge)
+                    index_type, codec = describe_index(base)
+                    meta = {"index_type": index_type, "vector_codec": codec,
+                            "trained_ntotal": self.trained_ntotal, "recall": self._recall_stats,
+                            "next_chunk_id": table.next_id}
+                # The DeltaIndex is immutable, so its vectors can be copied off-lock.
+                delta_vectors = delta.reconstruct_n(0, delta_n) if delta_n else None
+                keep = None
+                if len(purge):
+                    keep = np.ones(snapshot_n, dtype=bool)
+                    keep[purge] = False
+                    if base_vectors is None and base.ntotal:
+                        base_vectors = self.log.base_vectors()
+                    # An empty index with the base's trained parameters, refilled block by
+                    # block, so a memory-mapped base is never read into RAM whole.
+                    merged = empty_like(base)
+                    for first in range(0, base.ntotal, ADD_BLOCK):
+                        rows = np.flatnonzero(keep[first:min(first + ADD_BLOCK, base.ntotal)]) + first
+                        if len(rows):
+                            merged.add(np.ascontiguousarray(base_vectors[rows], dtype="float32"))
+                    if delta_vectors is not None and keep[base.ntotal:].any():
+                        merged.add(np.ascontiguousarray(delta_vectors[keep[base.ntotal:]], dtype="float32"))
+                else:
+                    # A mapped base is read-only; merge into a private in-memory copy.
+                    merged = self.log.open_base(use_mmap=False)[0] if base_mapped else faiss.clone_index(base)
+                    if delta_vectors is not None:
+                        merged.add(delta_vectors)
+                chunk_parts = self.text_chunks.parts(tail_len)
+                self.log.compact(merged, chunk_parts, upto, meta=meta,
+                                 table=table, tail_len=table_tail_len, keep=keep)
+                new_index, new_chunks = self.log.open_base(use_mmap=self.use_mmap)
+                new_vectors = self.log.base_vectors()
+                with self._lock:
+                    self.index = new_index
+                    self.delta_index = self.delta_index.tail(delta_n)
+                    self.text_chunks = ChunkList(new_chunks, self.text_chunks.tail[tail_len:])
+                    self.chunk_table = self.chunk_table.rebased(self.log.base_dir(), new_index.ntotal,
+                                                                table_tail_len, purged_ids)
+                    self._base_vectors = new_vectors
+                    self._base_mapped = self.use_mmap
+                    self._publish()
+            record("vector_store.compact", time.perf_counter() - start, purged=len(purge))
+            print(f"Compacted vector store up to segment {upto}" +
+                  (f", dropped {len(purge)} deleted chunks" if len(purge) else ""))
+        except Exception as e:
+            print(f"Error compacting vector store: {str(e)}")
+    
+    def submit(self, operation, *args, **kwargs):
+        # Queues add_documents, delete_document or upsert_document for the background
+        # writer and returns a Future. Queued writes apply in order, one at a time, and
+        # each becomes visible to searches atomically when its snapshot is published.
+        if operation not in WRITE_OPERATIONS:
+            raise ValueError(f"Unknown write operation: {operation} (expected one of {', '.join(WRITE_OPERATIONS)})")
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-store-writer")
+            return self._writer.submit(getattr(self, operation), *args, **kwargs)
     
-    def retrieve(self, query, top_k=3):
+    def wait_for_writes(self, timeout=None):
+        writer = self._writer
+        if writer is not None:
+            writer.submit(lambda: None).result(timeout)
+    
+    def wait_for_maintenance(self, timeout=None):
+        thread = self._maintenance_thread
+        if thread is not None:
+            thread.join(timeout)
+    
+    def retrieve(self, query, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False):
+        # mode overrides retrieval_mode; with narrow, hybrid search runs the dense half
+        # only over the lexical candidates (through an ID selector).
         try:
-            if self.index.ntotal == 0:
+            if self.ntotal == 0:
                 return []
-            
-            actual_top_k = min(top_k, self.index.ntotal)
-            query_emb = self.model.encode([query])
-            query_emb = np.array(query_emb).astype("float32")
-            
-            distances, indices = self.index.search(query_emb, actual_top_k)
-            
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx >= 0 and idx < len(self.text_chunks):  
-                    results.append({
-                        'text': self.text_chunks[idx],
-                        'distance': distances[0][i],
-                        'index': idx
-                    })
-            return results            
+            return self.retrieve_with_embedding(query, top_k, nprobe=nprobe, ef_search=ef_search,
+                                                mode=mode, narrow=narrow)[0]
         except Exception as e:
             print(f"Error retrieving documents: {str(e)}")
             return []
     
+    def retrieve_with_embedding(self, query, top_k=3, nprobe=None, ef_search=None, mode=None, narrow=False,
+                                with_embeddings=False, query_emb=None):
+        # Same as retrieve, but also returns the query embedding (None if nothing was searched).
+        # with_embeddings adds each chunk's stored vector to its result as 'embedding';
+        # query_emb skips encoding (a sharded store encodes once for every shard).
+        try:
+            if self.ntotal == 0:
+                return [], None
+            mode = self._effective_mode(mode)
+            if mode == "lexical":
+                query_emb = None
+            elif query_emb is not None:
+                query_emb = np.asarray(query_emb, dtype="float32").reshape(1, -1)
+            else:
+                with span("vector_store.encode_query"):
+                    query_emb = self.model.encode([query])
+            results = self._retrieve(query, query_emb, top_k, nprobe=nprobe, ef_search=ef_search,
+                                     mode=mode, narrow=narrow, with_embeddings=with_embeddings)
+            return results, query_emb[0] if query_emb is not None else None
+        except Exception as e:
+            print(f"Error retrieving documents: {str(e)}")
+            return [], None
+    
+    def _effective_mode(self, mode):
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode} (expected one of {', '.join(RETRIEVAL_MODES)})")
+        lexical = self.lexical_index
+        if mode != "dense" and (lexical is None or not lexical.ready):
+            return "dense"
+        return mode
+    
+    def _retrieve(self, query, query_emb, top_k, nprobe=None, ef_search=None, mode="dense", narrow=False,
+                  with_embeddings=False):
+        snapshot = self._snapshot()
+        if mode == "dense":
+            with span("vector_store.search", mode=mode):
+                results = self._search_embeddings(query_emb, top_k, nprobe=nprobe, ef_search=ef_search,
+                                                  snapshot=snapshot)[0]
+        else:
+            results = self._retrieve_fused(query, query_emb, top_k, nprobe, ef_search, mode, narrow, snapshot)
+        if with_embeddings and results:
+            # Rows are only meaningful within the snapshot the search used.
+            vectors = self._row_vectors([result['index'] for result in results], snapshot)
+            for result, vector in zip(results, vectors):
+                result['embedding'] = vector
+        return results
+    
+    def _retrieve_fused(self, query, query_emb, top_k, nprobe, ef_search, mode, narrow, snapshot):
+        fetch_k = top_k * self.hybrid_fetch_factor
+        with span("vector_store.lexical_search"):
+            lex_ids, lex_scores = self.lexical_index.search(query, fetch_k)
+        # The lexical index may be ahead of the snapshot; keep only rows it can see.
+        lex_rows = snapshot["table"].rows_of(lex_ids)
+        live = (lex_rows >= 0) & (lex_rows < snapshot["rows"]) & ~np.isin(lex_rows, snapshot["deleted"])
+        lex_rows, lex_scores = lex_rows[live], lex_scores[live]
+        bm25 = dict(zip(lex_rows.tolist(), lex_scores.tolist()))
+        dense = {}
+        if mode == "lexical":
+            ranked = [(row, bm25[row]) for row in lex_rows[:top_k].tolist()]
+        else:
+            include = lex_rows if narrow and len(lex_rows) else None
+            with span("vector_store.search", mode=mode, narrowed=include is not None):
+                distances, labels = self._search_tiers(query_emb, fetch_k, nprobe=nprobe, ef_search=ef_search,
+                                                       snapshot=snapshot, include=include)
+            if labels.size:
+                found = labels[0] >= 0
+                dense = dict(zip(labels[0][found].tolist(), distances[0][found].tolist()))
+            ranked = reciprocal_rank_fusion([list(dense), lex_rows.tolist()])[:top_k]
+        text_chunks, table = snapshot["chunks"], snapshot["table"]
+        chunk_ids = table.ids_of([row for row, _ in ranked])
+        return [{
+            'text': text_chunks[row],
+            # None for chunks only the lexical ranking found.
+            'distance': dense.get(row),
+            'score': score,
+            'bm25': bm25.get(row),
+            'index': row,
+            'chunk_id': int(chunk_id),
+            'doc_id': table.doc_of(row)
+        } for (row, score), chunk_id in zip(ranked, chunk_ids)]
+    
+    def retrieve_batch(self, queries, top_k=3, nprobe=None, ef_search=None, query_embs=None, mode=None,
+                       narrow=False):
+        # One encode call for the whole batch, and one FAISS search when dense. Hybrid
+        # and lexical queries are fused one by one over the same snapshot, as retrieve does.
+        try:
+            if not queries:
+                return []
+            if self.ntotal == 0:
+                return [[] for _ in queries]
+            mode = self._effective_mode(mode)
+            if mode != "lexical":
+                if query_embs is None:
+                    with span("vector_store.encode_query", queries=len(queries)):
+                        query_embs = self.model.encode(list(queries))
+                query_embs = np.ascontiguousarray(query_embs, dtype="float32")
+            if mode == "dense":
+                with span("vector_store.search", mode=mode, queries=len(queries)):
+                    return self._search_embeddings(query_embs, top_k, nprobe=nprobe, ef_search=ef_search)
+            snapshot = self._snapshot()
+            return [self._retrieve_fused(query, None if mode == "lexical" else query_embs[i:i + 1], top_k,
+                                         nprobe, ef_search, mode, narrow, snapshot)
+                    for i, query in enumerate(queries)]
+        except Exception as e:
+            print(f"Error retrieving documents: {str(e)}")
+            return [[] for _ in queries]
+    
+    def _publish(self):
+        # Called with _lock held at the end of every write. Everything one search reads
+        # is captured together, so a concurrent compaction that renumbers rows cannot mix
+        # old labels with new chunks. The base index and DeltaIndex are never modified.
+        # The chunk list and table are shared with later writes, which is safe because
+        # of one invariant: writes only append to their tails, and compaction, clear()
+        # and loading replace them with new objects instead of trimming or rewriting
+        # them. So rows < "rows" read the same text, chunk id and document for as long
+        # as the snapshot is held. Deletions reach searches only through "deleted",
+        # never through the live table's tombstones.
+        self._published = MappingProxyType({
+            "base": self.index, "delta": self.delta_index, "base_vectors": self._base_vectors,
+            "chunks": self.text_chunks, "table": self.chunk_table,
+            "deleted": self.chunk_table.tombstone_rows(),
+            "rows": self.index.ntotal + self.delta_index.ntotal, "generation": self.generation})
+    
+    def _row_vectors(self, rows, snapshot):
+        # Full-precision vectors of rows in one snapshot: the base from its fp32 copy
+        # (or the index itself for pre-vectors.npy flat snapshots), the delta from its runs.
+        base, delta, base_vectors = snapshot["base"], snapshot["delta"], snapshot["base_vectors"]
+        out = np.empty((len(rows), self.dimension), dtype="float32")
+        for j, row in enumerate(rows):
+            if row >= base.ntotal:
+                out[j] = delta.reconstruct(int(row - base.ntotal))
+            elif base_vectors is not None:
+                out[j] = base_vectors[row]
+            else:
+                out[j] = base.reconstruct(int(row))
+        return out
+    
+    def _snapshot(self):
+        # A single reference read: the latest published snapshot, without locking.
+        return self._published
+    
+    def _search_tiers(self, query_embs, top_k, nprobe=None, ef_search=None, rerank=True, snapshot=None,
+                      include=None):
+        # include (rows, optional) restricts the search to those rows.
+        snapshot = snapshot or self._snapshot()
+        base, delta, base_vectors = snapshot["base"], snapshot["delta"], snapshot["base_vectors"]
+        deleted = snapshot["deleted"]
+        rerank = rerank and self._is_lossy(base) and base_vectors is not None and self.rerank_factor > 1
+        fetch_k = top_k * self.rerank_factor if rerank else top_k
+        base_include = delta_include = None
+        if include is not None:
+            include = np.asarray(include, dtype="int64")
+            base_include = include[include < base.ntotal]
+            delta_include = include[include >= base.ntotal] - base.ntotal
+        tiers = []
+        if base.ntotal and (base_include is None or len(base_include)):
+            tiers.append(search(base, query_embs, min(fetch_k, base.ntotal), nprobe=nprobe, ef_search=ef_search,
+                                exclude=deleted[deleted < base.ntotal], include=base_include))
+        if delta.ntotal and (delta_include is None or len(delta_include)):
+            distances, labels = delta.search(query_embs, min(fetch_k, delta.ntotal),
+                                             exclude=deleted[deleted >= base.ntotal] - base.ntotal,
+                                             include=delta_include)
+            tiers.append((distances, np.where(labels >= 0, labels + base.ntotal, labels)))
+        distances, labels = merge_results(tiers, fetch_k)
+        if rerank and labels.size:
+            distances, labels = self._rerank(query_embs, labels, top_k, base, delta, base_vectors)
+        return distances[:, :top_k], labels[:, :top_k]
+    
+    def _is_lossy(self, index):
+        return describe_index(index)[1] != "fp32"
+    
+    def _rerank(self, query_embs, labels, top_k, base, delta, base_vectors):
+        # Exact L2 over the candidates, reading full-precision rows from disk for the
+        # base and from the (always fp32) delta for everything newer.
+        out_d = np.full((len(labels), top_k), np.inf, dtype="float32")
+        out_i = np.full((len(labels), top_k), -1, dtype="int64")
+        for row, candidates in enumerate(labels):
+            candidates = candidates[candidates >= 0]
+            if not len(candidates):
+                continue
+            vectors = np.empty((len(candidates), self.dimension), dtype="float32")
+            in_base = candidates < base.ntotal
+            if in_base.any():
+                ids = candidates[in_base]
+                order = np.argsort(ids)
+                rows = np.empty((len(ids), self.dimension), dtype="float32")
+                rows[order] = base_vectors[ids[order]]
+                vectors[in_base] = rows
+            for j in np.nonzero(~in_base)[0]:
+                vectors[j] = delta.reconstruct(int(candidates[j] - base.ntotal))
+            exact = ((vectors - query_embs[row]) ** 2).sum(axis=1)
+            best = np.argsort(exact, kind="stable")[:top_k]
+            out_d[row, :len(best)] = exact[best]
+            out_i[row, :len(best)] = candidates[best]
+        return out_d, out_i
+    
+    def _search_embeddings(self, query_embs, top_k, nprobe=None, ef_search=None, snapshot=None):
+        snapshot = snapshot or self._snapshot()
+        distances, indices = self._search_tiers(query_embs, top_k, nprobe=nprobe, ef_search=ef_search,
+                                                snapshot=snapshot)
+        text_chunks, table = snapshot["chunks"], snapshot["table"]
+        
+        batch_results = []
+        for row in range(len(query_embs)):
+            results = []
+            valid = [(i, idx) for i, idx in enumerate(indices[row]) if idx >= 0 and idx < len(text_chunks)]
+            chunk_ids = table.ids_of([idx for _, idx in valid])
+            for (i, idx), chunk_id in zip(valid, chunk_ids):
+                results.append({
+                    'text': text_chunks[idx],
+                    'distance': distances[row][i],
+                    'index': idx,
+                    'chunk_id': int(chunk_id),
+                    'doc_id': table.doc_of(idx)
+                })
+            batch_results.append(results)
+        return batch_results
+    
     def clear(self):
         try:
-            if os.path.exists(self.index_path):
-                os.remove(self.index_path)
-            if os.path.exists(self.chunks_path):
-                os.remove(self.chunks_path)
-            if os.path.exists(self.persist_path):
-                os.rmdir(self.persist_path)
+            self.wait_for_maintenance()
+            with self._maintenance_lock, self._lock:
+                self.log.clear()
+                self.embedding_cache.reset_index_state()
+                self.index = faiss.IndexFlatL2(self.dimension)
+                self.delta_index = DeltaIndex(self.dimension)
+                self.text_chunks = ChunkList()
+                self.chunk_table = ChunkTable()
+                self._base_mapped = False
+                self._base_vectors = None
+                self._recall_stats = None
+                self.trained_ntotal = 0
+                self.generation += 1
+                self._publish()
+                self._start_lexical_build()
             print("Vector store cleared")
         except Exception as e:
             print(f"Error clearing vector store: {str(e)}")
     
     def get_stats(self):
         return {
-            'total_documents': len(self.text_chunks),
-            'index_size': self.index.ntotal,
-            'embedding_dimension': self.index.d
+            'total_documents': len(self.text_chunks) - len(self.chunk_table.tombstone_rows()),
+            'deleted_chunks': len(self.chunk_table.tombstones),
+            'index_size': self.ntotal,
+            'embedding_dimension': self.dimension,
+            'index_type': index_type_of(self.index),
+            'vector_codec': describe_index(self.index)[1],
+            'bytes_per_vector': bytes_per_vector(self.index) if self.index.ntotal else self.dimension * 4,
+            'recall_loss': self._recall_stats,
+            'memory_mapped': self._base_mapped,
+            'unmerged_vectors': self.delta_index.ntotal,
+            'generation': self.generation,
+            'retrieval_mode': self.retrieval_mode,
+            'lexical_index': self.lexical_index.get_stats() if self.lexical_index is not None else None,
+            'embedding_backend': self.model.name,
+            'embedding_model_loaded': self.model.loaded,
+            'embedding_cache': self.embedding_cache.get_stats(),
+            'encoding': self.encoding_engine.get_stats() if self.encoding_engine is not None else None
         }
+    
+    def _full_precision_parts(self):
+        # (vectors, first id) pairs covering every id: the mapped base vectors on disk
+        # and the fp32 delta, without loading the base into RAM.
+        with self._lock:
+            base, delta, base_vectors = self.index, self.delta_index, self._base_vectors
+            delta_vectors = delta.reconstruct_n(0, delta.ntotal) if delta.ntotal else None
+        if base_vectors is None and base.ntotal:
+            base_vectors = self.log.base_vectors()
+        parts = []
+        if base.ntotal:
+            parts.append((base_vectors, 0))
+        if delta_vectors is not None:
+            parts.append((delta_vectors, base.ntotal))
+        return parts
+    
+    def _exact_search(self, parts, queries, top_k):
+        results = []
+        for vectors, offset in parts:
+            distances, labels = exact_search(vectors, queries, top_k)
+            results.append((distances, np.where(labels >= 0, labels + offset, labels)))
+        return merge_results(results, top_k)
+    
+    def _sample_queries(self, parts, sample):
+        total = sum(len(v) for v, _ in parts)
+        rng = np.random.default_rng(0)
+        picks = np.sort(rng.choice(total, size=min(sample, total), replace=False))
+        rows = []
+        for vectors, offset in parts:
+            local = picks[(picks >= offset) & (picks < offset + len(vectors))] - offset
+            if len(local):
+                rows.append(np.asarray(vectors[local], dtype="float32"))
+        return np.ascontiguousarray(np.vstack(rows), dtype="float32")
+    
+    def measure_recall_loss(self, sample=100, top_k=10):
+        # recall@k of the live search path (ANN + codec + re-ranking) against exact
+        # search over the full-precision vectors; cached and reported by get_stats.
+        try:
+            parts = self._full_precision_parts()
+            total = sum(len(v) for v, _ in parts)
+            if total == 0:
+                return None
+            queries = self._sample_queries(parts, sample)
+            k = min(top_k, total)
+            _, truth = self._exact_search(parts, queries, k)
+            _, found = self._search_tiers(queries, k)
+            _, found_raw = self._search_tiers(queries, k, rerank=False)
+            recall = recall_at_k(found, truth)
+            self._recall_stats = {
+                'recall_at_k': recall,
+                'recall_loss': 1.0 - recall,
+                'recall_loss_without_rerank': 1.0 - recall_at_k(found_raw, truth),
+                'k': k,
+                'sample': len(queries)
+            }
+            return self._recall_stats
+        except Exception as e:
+            print(f"Error measuring recall loss: {str(e)}")
+            return None
+    
+    def recall_report(self, queries=None, top_k=10, settings=None, sample=200):
+        # Recall@k and per-query latency of the live index against an exact flat scan.
+        # The exact scan reads the memory-mapped base block by block.
+        try:
+            index = self.index
+            parts = self._full_precision_parts()
+            total = sum(len(v) for v, _ in parts)
+            if total == 0:
+                return []
+            if queries is None:
+                query_vectors = self._sample_queries(parts, sample)
+            else:
+                query_vectors = self.model.encode(list(queries))
+            return recall_report(index, None, query_vectors, top_k=min(top_k, total), settings=settings,
+                                 search_fn=self._search_tiers, exact_fn=lambda q, k: self._exact_search(parts, q, k))
+        except Exception as e:
+            print(f"Error building recall report: {str(e)}")
+            return []
+    
+    def hybrid_report(self, queries=None, top_k=10, sample=100):
+        # Per-query search latency (query encoding excluded, it is the same for every
+        # mode), overlap with the dense top-k and index memory of each retrieval mode.
+        try:
+            lexical = self.lexical_index
+            if self.ntotal == 0 or lexical is None or not lexical.ready:
+                return {}
+            if queries is None:
+                # Leading words of sampled chunks stand in for real queries.
+                chunks = self._snapshot()["chunks"]
+                rng = np.random.default_rng(0)
+                picks = rng.choice(len(chunks), size=min(sample, len(chunks)), replace=False)
+                queries = [" ".join(chunks[int(i)].split()[:8]) for i in picks]
+            queries = list(queries)
+            query_embs = self.model.encode(queries)
+            settings = {"dense": ("dense", False), "hybrid": ("hybrid", False),
+                        "hybrid_narrowed": ("hybrid", True), "lexical": ("lexical", False)}
+            results, report = {}, {}
+            for name, (mode, narrow) in settings.items():
+                latencies, results[name] = [], []
+                for query, query_emb in zip(queries, query_embs):
+                    start = time.perf_counter()
+                    found = self._retrieve(query, query_emb[None], top_k, mode=mode, narrow=narrow)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    results[name].append({r['chunk_id'] for r in found})
+                overlap = [len(found & dense) / max(len(dense), 1)
+                           for found, dense in zip(results[name], results["dense"])]
+                report[name] = {
+                    "mean_ms": float(np.mean(latencies)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                    "overlap_with_dense": float(np.mean(overlap)),
+                }
+            with self._lock:
+                index, delta = self.index, self.delta_index
+            dense_bytes = (bytes_per_vector(index) if index.ntotal else 0) * index.ntotal + delta.ntotal * delta.d * 4
+            lexical_bytes = lexical.memory_bytes()
+            report["memory"] = {
+                "dense_index_bytes": dense_bytes,
+                "lexical_index_bytes": lexical_bytes,
+                "hybrid_bytes": dense_bytes + lexical_bytes,
+            }
+            report["queries"] = len(queries)
+            report["top_k"] = top_k
+            return report
+        except Exception as e:
+            print(f"Error building hybrid report: {str(e)}")
+            return {}